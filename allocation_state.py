@@ -0,0 +1,430 @@
+"""セッションで保持する引当状態（NumPy 配列 + 商品コードのハッシュ索引）
+
+不足確認の結果を商品ごとの配列（実在庫・入庫予定数・入数・受注合計・引当後在庫）として
+保持し、商品コード -> 行番号の辞書で引く。在庫の差分ファイルはこの配列に直接適用し、
+影響を受けた商品の引当後在庫だけを再計算する。適用した差分は監査ログに残す。
+
+What-if シミュレーションは実在庫・入庫予定数を上書きする別レイヤー（上書き値とマスク）で、
+差分とは独立に設定・解除できる。受注明細は商品 -> 行・伝票 -> 行の索引（CSR 形式）で持ち、
+上書きした商品に関係する伝票だけを見て、解消する伝票を求める。
+
+totals_only で作った状態は受注明細を持たず、在庫の置き換え（set_stock）と商品別の受注合計の
+足し引き（add_orders）だけで更新する（監視フォルダのデーモンがファイル単位の取り込みに使う）。
+
+RunningTotals は受注ファイルの読み込み中に使う、商品ごとの受注合計の途中経過。
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+SPECIAL_CODE = '19005'
+
+# 差分ファイルの列名（別名を含む）
+DELTA_COLUMNS = {
+    '商品コード': ('商品コード', '品目コード', 'code'),
+    '在庫調整': ('在庫調整', '在庫増減'),
+    '入庫予定調整': ('入庫予定調整', '入庫予定増減'),
+    '入数': ('入数', 'pack'),
+}
+# 在庫ファイル（絶対値）の列名。差分として足し込むと在庫が二重になるので受け付けない
+ABSOLUTE_COLUMNS = ('倉庫在庫数', '入庫予定', 'stock', 'incoming')
+
+
+class DeltaError(ValueError):
+    """差分ファイルの形式エラー"""
+
+
+def read_delta_file(file):
+    """差分ファイル（csv / txt / xlsx、ヘッダー付き）を 商品コード・在庫調整・入庫予定調整・入数 の表にする
+
+    在庫調整は個数、入庫予定調整はケース数（入数を掛けて個数にする）。
+    """
+    name = file.name.lower()
+    if name.endswith(('.xlsx', '.xls')):
+        raw = pd.read_excel(file, dtype=str)
+    else:
+        raw = None
+        for encoding in ('utf-8-sig', 'cp932'):
+            try:
+                if hasattr(file, 'seek'):
+                    file.seek(0)
+                raw = pd.read_csv(file, dtype=str, sep=None, engine='python', encoding=encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+        if raw is None:
+            raise DeltaError("差分ファイルの文字コードを判別できません。")
+    raw.columns = [str(c).strip() for c in raw.columns]
+    found = {}
+    for column, aliases in DELTA_COLUMNS.items():
+        found[column] = next((a for a in aliases if a in raw.columns), None)
+    if found['商品コード'] is None:
+        raise DeltaError("差分ファイルに「商品コード」列がありません。")
+    if found['在庫調整'] is None and found['入庫予定調整'] is None:
+        absolute = [c for c in ABSOLUTE_COLUMNS if c in raw.columns]
+        if absolute:
+            raise DeltaError(f"在庫ファイル（{'・'.join(absolute)} の絶対値）は差分として適用できません。"
+                             "「在庫調整」「入庫予定調整」列の差分ファイルを指定してください。")
+        raise DeltaError("差分ファイルに「在庫調整」または「入庫予定調整」列がありません。")
+    delta = pd.DataFrame({'商品コード': raw[found['商品コード']].astype(str).str.strip().str.lstrip('0')})
+    for column in ('在庫調整', '入庫予定調整', '入数'):
+        values = raw[found[column]] if found[column] else None
+        delta[column] = pd.to_numeric(values, errors='coerce').fillna(0).astype(np.int64) if values is not None else 0
+    return delta[delta['商品コード'] != ''].reset_index(drop=True)
+
+
+class RunningTotals:
+    """受注ファイルを1つずつ取り込みながら、商品ごとの受注合計と暫定の不足を求める
+
+    受注数量は加算されるだけなので、途中で不足と判定された商品は以降のファイルで解消しない。
+    """
+
+    def __init__(self, inventory_df):
+        stock = inventory_df.assign(商品コード=inventory_df['商品コード'].astype(str))
+        self.stock = stock.groupby('商品コード')['倉庫在庫数'].sum()
+        self.totals = pd.Series(dtype=np.int64)
+        self.names = pd.Series(dtype=object)
+        self.files = 0
+
+    def add(self, order_df):
+        """受注明細を加算し、今回のファイルに含まれる商品数を返す"""
+        summary = order_df.assign(商品コード=order_df['商品コード'].astype(str)).groupby('商品コード').agg(
+            発注数量=('発注数量', 'sum'), 商品名漢字=('商品名漢字', 'first'), 商品名カナ=('商品名カナ', 'first'))
+        self.totals = self.totals.add(summary['発注数量'], fill_value=0).astype(np.int64)
+        self.names = self.names.combine_first(summary['商品名漢字'].astype(object).fillna(summary['商品名カナ'].astype(object)))
+        self.files += 1
+        return len(summary)
+
+    def shortages(self):
+        """現時点で不足している商品（calculate_allocation と同じ列、不足数の多い順）"""
+        stock = self.stock.reindex(self.totals.index).fillna(0).astype(np.int64)
+        result = pd.DataFrame({
+            '商品コード': self.totals.index,
+            '受注合計数': self.totals.to_numpy(),
+            '商品名': self.names.reindex(self.totals.index).fillna('').to_numpy(),
+            '倉庫在庫数': stock.to_numpy(),
+            '引当後在庫': (stock - self.totals).to_numpy(),
+        })
+        result = result[(result['引当後在庫'] < 0) & (result['商品コード'] != SPECIAL_CODE)]
+        return result.sort_values(['引当後在庫', '商品コード']).reset_index(drop=True)
+
+
+class AllocationState:
+    """商品ごとの引当状態"""
+
+    def __init__(self, codes, names, on_hand, incoming, packs, ordered, n_ordered=None, lines=None):
+        self.codes = np.asarray(codes, dtype=object)
+        self.names = np.asarray(names, dtype=object)
+        self.on_hand = np.asarray(on_hand, dtype=np.int64)
+        self.incoming = np.asarray(incoming, dtype=np.int64)
+        self.packs = np.asarray(packs, dtype=np.int64)
+        self.ordered = np.asarray(ordered, dtype=np.int64)
+        # 先頭 n_ordered 件が受注のある商品（残りは在庫のみ）
+        self.n_ordered = len(self.codes) if n_ordered is None else n_ordered
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.special = self.codes == SPECIAL_CODE
+        n = len(self.codes)
+        # What-if の上書きレイヤー
+        self.override_on_hand = np.zeros(n, dtype=np.int64)
+        self.override_incoming = np.zeros(n, dtype=np.int64)
+        self.has_on_hand_override = np.zeros(n, dtype=bool)
+        self.has_incoming_override = np.zeros(n, dtype=bool)
+        self.remaining = np.empty(n, dtype=np.int64)
+        self.audit = []
+        # 受注明細を持たず、商品ごとの受注合計だけを足し引きする状態（totals_only で作る）
+        self.totals_only = False
+        self._set_lines(lines)
+        self.recompute()
+
+    def _set_lines(self, lines):
+        """受注明細（行ごとの商品番号・伝票番号）から商品別・伝票別の索引を作る"""
+        if lines is None:
+            lines = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=object), np.zeros(0, dtype=object))
+        self.line_product, self.line_slip, self.slip_labels, self.slip_customers = lines
+        self._product_lines = np.argsort(self.line_product, kind='stable')
+        self._product_starts = np.searchsorted(self.line_product[self._product_lines], np.arange(self.n_ordered + 1))
+        self._slip_lines = np.argsort(self.line_slip, kind='stable')
+        self._slip_starts = np.searchsorted(self.line_slip[self._slip_lines], np.arange(len(self.slip_labels) + 1))
+
+    @classmethod
+    def build(cls, inventory_df, order_df):
+        """在庫（to_frame(detail=True) / load_inventory_file の列）と受注明細から作る"""
+        inventory = inventory_df.assign(商品コード=inventory_df['商品コード'].astype(str))
+        for column in ('入庫予定数', '入数'):
+            if column not in inventory:
+                inventory[column] = 0
+        inventory = inventory.groupby('商品コード', sort=False).agg(
+            倉庫在庫数=('倉庫在庫数', 'sum'), 入庫予定数=('入庫予定数', 'sum'), 入数=('入数', 'first'))
+        orders = order_df.assign(商品コード=order_df['商品コード'].astype(str)).groupby('商品コード').agg(
+            受注合計数=('発注数量', 'sum'), 商品名漢字=('商品名漢字', 'first'), 商品名カナ=('商品名カナ', 'first'))
+        names = orders['商品名漢字'].astype(object).fillna(orders['商品名カナ'].astype(object)).fillna('')
+
+        # 受注のある商品を先に（calculate_allocation と同じ商品コード順）、在庫のみの商品を後ろに並べる
+        codes = orders.index.append(inventory.index.difference(orders.index, sort=False))
+        inventory = inventory.reindex(codes)
+        slips = pd.Categorical(order_df['伝票番号'].astype(str))
+        slip_customers = (pd.Series(order_df['顧客名'].astype(str).to_numpy()).groupby(slips.codes).first()
+                          .reindex(range(len(slips.categories))).fillna('').to_numpy(object))
+        lines = (
+            orders.index.get_indexer(order_df['商品コード'].astype(str)).astype(np.int64),
+            slips.codes.astype(np.int64),
+            slips.categories.to_numpy(object),
+            slip_customers,
+        )
+        stock = inventory['倉庫在庫数'].fillna(0).to_numpy(np.int64)
+        incoming = inventory['入庫予定数'].fillna(0).to_numpy(np.int64)
+        return cls(
+            codes=codes.to_numpy(object),
+            names=names.reindex(codes).fillna('').to_numpy(object),
+            on_hand=stock - incoming,
+            incoming=incoming,
+            packs=inventory['入数'].fillna(0).to_numpy(np.int64),
+            ordered=orders['受注合計数'].reindex(codes).fillna(0).to_numpy(np.int64),
+            n_ordered=len(orders),
+            lines=lines,
+        )
+
+    @classmethod
+    def totals_only(cls):
+        """受注明細の索引を持たない空の状態（set_stock・add_orders でファイル単位に更新する）
+
+        すべての商品を受注のある商品として扱うので、frame には表示する商品の行番号を渡す。
+        伝票別の機能（product_slips・slip_changes）は使えない。
+        """
+        state = cls(codes=[], names=[], on_hand=[], incoming=[], packs=[], ordered=[])
+        state.totals_only = True
+        return state
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _remaining(self, idx, overrides=True):
+        on_hand = self.on_hand[idx]
+        incoming = self.incoming[idx]
+        if overrides:
+            on_hand = np.where(self.has_on_hand_override[idx], self.override_on_hand[idx], on_hand)
+            incoming = np.where(self.has_incoming_override[idx], self.override_incoming[idx], incoming)
+        # 特殊処理: 19005 は品目マスターエラーとして不足扱いにしない
+        return np.where(self.special[idx], 0, on_hand + incoming - self.ordered[idx])
+
+    def recompute(self, idx=None):
+        """引当後在庫を再計算する（idx を指定した場合はその商品だけ）"""
+        if idx is None:
+            idx = slice(None)
+        self.remaining[idx] = self._remaining(idx)
+
+    def shortage_mask(self):
+        return self.remaining < 0
+
+    def _add_products(self, codes):
+        """索引にない商品（受注なし・在庫のみ）を末尾に追加する"""
+        start = len(self.codes)
+        n = len(codes)
+        self.codes = np.concatenate([self.codes, np.asarray(codes, dtype=object)])
+        self.names = np.concatenate([self.names, np.full(n, '', dtype=object)])
+        for name in ('on_hand', 'incoming', 'packs', 'ordered', 'remaining', 'override_on_hand', 'override_incoming'):
+            setattr(self, name, np.concatenate([getattr(self, name), np.zeros(n, dtype=np.int64)]))
+        for name in ('has_on_hand_override', 'has_incoming_override'):
+            setattr(self, name, np.concatenate([getattr(self, name), np.zeros(n, dtype=bool)]))
+        self.special = np.concatenate([self.special, np.asarray(codes, dtype=object) == SPECIAL_CODE])
+        self.index.update({code: start + i for i, code in enumerate(codes)})
+        if self.totals_only:
+            self.n_ordered = len(self.codes)
+            self._set_lines(None)
+
+    def _indexer(self, codes):
+        """商品コード -> 行番号（索引にない商品は末尾に追加する）"""
+        new_codes = [c for c in dict.fromkeys(codes) if c not in self.index]
+        if new_codes:
+            self._add_products(new_codes)
+        return np.fromiter((self.index[c] for c in codes), dtype=np.int64, count=len(codes))
+
+    def set_stock(self, inventory_df):
+        """在庫（combine_inventory_rows の表）で全商品の実在庫・入庫予定数・入数を置き換えて再計算する
+
+        在庫にない商品は 0 にする。
+        """
+        idx = self._indexer(inventory_df['商品コード'].astype(str).tolist())
+        stock = inventory_df['倉庫在庫数'].to_numpy(np.int64)
+        incoming = inventory_df['入庫予定数'].to_numpy(np.int64) if '入庫予定数' in inventory_df else np.zeros(len(idx), dtype=np.int64)
+        for name in ('on_hand', 'incoming', 'packs'):
+            getattr(self, name)[:] = 0
+        self.on_hand[idx] = stock - incoming
+        self.incoming[idx] = incoming
+        if '入数' in inventory_df:
+            self.packs[idx] = inventory_df['入数'].to_numpy(np.int64)
+        self.recompute()
+
+    def add_orders(self, codes, quantities, names=None):
+        """商品ごとの受注合計に quantities を加え（負の数で差し引く）、その商品だけ再計算する
+
+        totals_only の状態で使う。codes は重複のない商品コード、戻り値は codes の各商品の行番号。
+        names を渡すと、商品名がまだない商品に設定する。
+        """
+        if not self.totals_only:
+            raise ValueError("受注明細から作った引当状態には受注合計を足し引きできません。")
+        idx = self._indexer([str(c) for c in codes])
+        self.ordered[idx] += np.asarray(quantities, dtype=np.int64)
+        if names is not None:
+            self.names[idx] = np.where(self.names[idx] == '', np.asarray(names, dtype=object), self.names[idx])
+        self.recompute(idx)
+        return idx
+
+    def apply_delta(self, delta, source=''):
+        """差分（read_delta_file の表）を適用し、影響を受けた商品の行番号を返す
+
+        入庫予定調整はケース数で、差分の入数（なければ保持している入数）を掛けて個数にする。
+        入数が分からない行は適用せず、監査ログに理由を残す。
+        """
+        idx = self._indexer(delta['商品コード'].tolist())
+        stock_delta = delta['在庫調整'].to_numpy(np.int64)
+        case_delta = delta['入庫予定調整'].to_numpy(np.int64)
+        packs = np.where(delta['入数'].to_numpy(np.int64) > 0, delta['入数'].to_numpy(np.int64), self.packs[idx])
+        skipped = (case_delta != 0) & (packs <= 0)
+
+        applied = ~skipped
+        before = self.remaining[idx].copy()
+        # 同じ商品が複数行あっても正しく合算されるよう np.add.at を使う
+        np.add.at(self.on_hand, idx[applied], stock_delta[applied])
+        np.add.at(self.incoming, idx[applied], case_delta[applied] * packs[applied])
+        update_packs = applied & (delta['入数'].to_numpy(np.int64) > 0)
+        self.packs[idx[update_packs]] = packs[update_packs]
+        affected = np.unique(idx[applied])
+        self.recompute(affected)
+
+        applied_at = datetime.now().isoformat(timespec='seconds')
+        for row, i, was, skip in zip(delta.itertuples(index=False), idx, before, skipped):
+            self.audit.append({
+                '適用日時': applied_at,
+                '差分ファイル': source,
+                '商品コード': row.商品コード,
+                '在庫調整': int(row.在庫調整),
+                '入庫予定調整': int(row.入庫予定調整),
+                '入数': int(self.packs[i]),
+                '引当後在庫(前)': int(was),
+                '引当後在庫(後)': int(self.remaining[i]),
+                '状態': '入数不明のため未適用' if skip else '適用',
+            })
+        return affected
+
+    def set_override(self, code, on_hand=None, incoming_cases=None):
+        """What-if: 実在庫（個）・入庫予定（ケース数 × 入数）を上書きし、その商品だけ再計算する
+
+        None の項目は上書きしない（既存の上書きも解除しない）。上書きした商品の行番号を返す。
+        """
+        i = self.index[code]
+        if incoming_cases is not None and self.packs[i] <= 0:
+            raise ValueError(f"商品コード {code} の入数が不明なため、入庫予定を上書きできません。")
+        if on_hand is not None:
+            self.override_on_hand[i] = on_hand
+            self.has_on_hand_override[i] = True
+        if incoming_cases is not None:
+            self.override_incoming[i] = incoming_cases * self.packs[i]
+            self.has_incoming_override[i] = True
+        self.recompute([i])
+        return i
+
+    def clear_overrides(self, codes=None):
+        """What-if の上書きを解除する（codes 省略時はすべて）"""
+        if codes is None:
+            idx = np.flatnonzero(self.has_on_hand_override | self.has_incoming_override)
+        else:
+            idx = np.asarray([self.index[c] for c in codes], dtype=np.int64)
+        self.has_on_hand_override[idx] = False
+        self.has_incoming_override[idx] = False
+        self.recompute(idx)
+        return idx
+
+    def baseline_remaining(self):
+        """上書きを適用しない引当後在庫（全商品）"""
+        return self._remaining(np.arange(len(self.codes)), overrides=False)
+
+    def baseline_shortages(self):
+        """上書きを適用しない場合に不足する商品（受注のある商品）の行番号"""
+        idx = np.arange(self.n_ordered)
+        return idx[self._remaining(idx, overrides=False) < 0]
+
+    def overridden(self):
+        return np.flatnonzero(self.has_on_hand_override | self.has_incoming_override)
+
+    def overrides_frame(self):
+        idx = self.overridden()
+        return pd.DataFrame({
+            '商品コード': self.codes[idx],
+            '商品名': self.names[idx],
+            '実在庫(元)': self.on_hand[idx],
+            '実在庫(上書き)': np.where(self.has_on_hand_override[idx], self.override_on_hand[idx], self.on_hand[idx]),
+            '入庫予定数(元)': self.incoming[idx],
+            '入庫予定数(上書き)': np.where(self.has_incoming_override[idx], self.override_incoming[idx], self.incoming[idx]),
+            '引当後在庫(元)': self._remaining(idx, overrides=False),
+            '引当後在庫(上書き)': self.remaining[idx],
+        })
+
+    @staticmethod
+    def _gather(order, starts, ids):
+        """CSR 索引から ids に属する行番号をまとめて取り出す"""
+        ids = np.asarray(ids, dtype=np.int64)
+        lengths = starts[ids + 1] - starts[ids]
+        if lengths.sum() == 0:
+            return np.zeros(0, dtype=np.int64)
+        offsets = np.repeat(starts[ids] - np.cumsum(lengths) + lengths, lengths)
+        return order[offsets + np.arange(lengths.sum())]
+
+    def product_slips(self, i):
+        """商品（行番号 i）を含む伝票の (伝票番号, 顧客名) のリスト（伝票番号順）"""
+        if i >= self.n_ordered:
+            return []
+        slips = np.unique(self.line_slip[self._gather(self._product_lines, self._product_starts, [i])])
+        return list(zip(self.slip_labels[slips].tolist(), self.slip_customers[slips].tolist()))
+
+    def slip_changes(self, idx=None):
+        """上書き（または idx の商品）に関係する伝票の、上書き前後の不足状態
+
+        状態は「解消」（上書き前は不足・上書き後は充足）、「不足のまま」、「新たに不足」、「充足」。
+        """
+        idx = self.overridden() if idx is None else np.asarray(idx, dtype=np.int64)
+        idx = idx[idx < self.n_ordered]
+        slips = np.unique(self.line_slip[self._gather(self._product_lines, self._product_starts, idx)])
+        if len(slips) == 0:
+            return pd.DataFrame(columns=['伝票番号', '顧客名', '状態', '不足商品(前)', '不足商品(後)'])
+        lines = self._gather(self._slip_lines, self._slip_starts, slips)
+        products = self.line_product[lines]
+        slip_of_line = np.searchsorted(slips, self.line_slip[lines])
+        short_before = self._remaining(products, overrides=False) < 0
+        short_after = self.remaining[products] < 0
+        before = np.bincount(slip_of_line, weights=short_before, minlength=len(slips)) > 0
+        after = np.bincount(slip_of_line, weights=short_after, minlength=len(slips)) > 0
+        status = np.select([before & ~after, before & after, ~before & after], ['解消', '不足のまま', '新たに不足'], '充足')
+
+        def short_codes(mask):
+            codes = pd.Series(self.codes[products[mask]]).groupby(slip_of_line[mask]).agg(lambda c: ', '.join(sorted(set(c))))
+            return codes.reindex(range(len(slips))).fillna('').to_numpy()
+
+        result = pd.DataFrame({
+            '伝票番号': self.slip_labels[slips],
+            '顧客名': self.slip_customers[slips],
+            '状態': status,
+            '不足商品(前)': short_codes(short_before),
+            '不足商品(後)': short_codes(short_after),
+        })
+        order = {'解消': 0, '新たに不足': 1, '不足のまま': 2, '充足': 3}
+        return result.sort_values(['状態', '伝票番号'], key=lambda s: s.map(order) if s.name == '状態' else s).reset_index(drop=True)
+
+    def frame(self, idx=None):
+        """calculate_allocation と同じ列構成の表（What-if の上書きを反映。idx を指定した場合はその商品だけ、受注のある商品のみ）"""
+        if idx is None:
+            idx = np.arange(len(self.codes))
+        idx = np.asarray(idx)
+        idx = idx[idx < self.n_ordered]
+        return pd.DataFrame({
+            '商品コード': self.codes[idx],
+            '受注合計数': self.ordered[idx],
+            '商品名': self.names[idx],
+            '倉庫在庫数': (np.where(self.has_on_hand_override[idx], self.override_on_hand[idx], self.on_hand[idx])
+                       + np.where(self.has_incoming_override[idx], self.override_incoming[idx], self.incoming[idx])),
+            '引当後在庫': self.remaining[idx],
+        })
+
+    def audit_frame(self):
+        return pd.DataFrame(self.audit)
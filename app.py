@@ -5,8 +5,35 @@ import base64
 import numpy as np
 from PIL import Image
 import fitz
-from paddleocr import PaddleOCR
 import re
+import logging
+import time
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import ocr_engine
+import ocr_service
+from pdf_metrics import PdfMetrics, registry as metrics_registry
+from layout_templates import build_template as build_layout_template, layout_fingerprint, store as layout_templates, template_coords, template_regions, trim_regions
+from inventory_store import store as inventory_store
+from profiling import start_profiler
+from run_history import RunHistory
+from allocation_state import AllocationState, RunningTotals, read_delta_file
+from demand_matrix import DemandMatrix
+from rationing import POLICY_LABELS as RATIONING_POLICIES, UNITS as RATIONING_UNITS, ration
+from inbound_schedule import DEFAULT_HORIZON_DAYS, project as project_inbound, read_schedule_file
+import stock_api
+from upload_spool import UploadSpool, detect_encoding, parser_source
+from order_schema import OrderSchemaError, plan_cache as order_plan_cache
+from order_dedup import OrderDeduplicator, file_digest
+from order_frame import compact_order_frame, order_memory_report
+from order_archive import ARCHIVE_MEMORY_BUDGET_MB, archive_report, is_archive, iter_archive_orders
+from job_scheduler import OCR as JOB_OCR, TABULAR as JOB_TABULAR, estimate_job_memory, scheduler
+from ocr_jobs import OcrJobQueue, ACTIVE_STATUSES as OCR_ACTIVE_STATUSES, DONE as OCR_DONE, FAILED as OCR_FAILED, QUEUED as OCR_QUEUED, RUNNING as OCR_RUNNING
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_PARSE_WORKERS = int(os.environ.get('INVENTORY_PARSE_WORKERS', '4'))
 
 # --- UI Custom Styling ---
 def apply_custom_style():
@@ -148,19 +175,22 @@ def apply_custom_style():
         </style>
     """, unsafe_allow_html=True)
 
-def load_inventory_file(file):
-    """速報倉庫在庫ファイルを読み込む"""
+def load_inventory_rows(file):
+    """速報倉庫在庫ファイルを読み込み、引当対象のロケーション行（入数・入庫予定付き）を返す"""
     try:
         file_ext = file.name.split('.')[-1].lower()
+        # 退避済みの大きなファイルはパスから直接読む（メモリ上のコピーを作らない）
+        source = parser_source(file)
         if file_ext == 'csv':
-            df = pd.read_csv(file, header=None, usecols=[1, 4, 8, 10, 13, 22], encoding='cp932')
+            df = pd.read_csv(source, header=None, usecols=[1, 4, 8, 10, 13, 22], encoding='cp932',
+                             memory_map=isinstance(source, str))
             df.columns = ['保管場所', 'ロケーション', '商品コード', '入数', '倉庫在庫数', '入庫予定']
             df = df[df['保管場所'] == 'A309001']
             # ロケーションが9で始まる不良在庫を除外
             df['ロケーション'] = df['ロケーション'].astype(str)
             df = df[~df['ロケーション'].str.startswith('9')]
         elif file_ext in ['xlsx', 'xls']:
-            df = pd.read_excel(file, header=None, usecols=[1, 4, 8, 10, 13, 22])
+            df = pd.read_excel(source, header=None, usecols=[1, 4, 8, 10, 13, 22])
             df.columns = ['保管場所', 'ロケーション', '商品コード', '入数', '倉庫在庫数', '入庫予定']
             df = df[df['保管場所'] == 'A309001']
             # ロケーションが9で始まる不良在庫を除外
@@ -172,191 +202,362 @@ def load_inventory_file(file):
         for col in ['倉庫在庫数', '入数', '入庫予定']:
             df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
         
-        df['倉庫在庫数'] = df['倉庫在庫数'] + (df['入庫予定'] * df['入数'])
         df = df.dropna(subset=['商品コード'])
         df['商品コード'] = df['商品コード'].astype(str).str.lstrip('0')
-        return df[['商品コード', '倉庫在庫数']]
+        return df[['商品コード', 'ロケーション', '入数', '倉庫在庫数', '入庫予定']]
     except Exception as e:
         raise Exception(f"倉庫在庫ファイルの読み込みエラー: {str(e)}")
 
-def process_pdf_order(file):
-    """PDF受注一覧を解析する"""
-    try:
-        # Create fresh OCR instance each time to avoid memory issues
-        ocr = PaddleOCR(use_angle_cls=True, lang='japan')
-        doc = fitz.open(stream=file.read(), filetype="pdf")
-        extracted_data = []
+def load_inventory_file(file):
+    """速報倉庫在庫ファイルを読み込む
+    
+    倉庫在庫数は入庫予定分を加えた実質在庫。差分適用・シミュレーション用に
+    入庫予定数（入庫予定 × 入数）と入数も残す。
+    """
+    df = load_inventory_rows(file)
+    df['入庫予定数'] = df['入庫予定'] * df['入数']
+    df['倉庫在庫数'] = df['倉庫在庫数'] + df['入庫予定数']
+    return df[['商品コード', '倉庫在庫数', '入庫予定数', '入数']]
+
+def find_inventory_conflicts(rows_by_file):
+    """複数ファイル間で食い違う商品コードを検出する
+    
+    - 入数不一致: 同じ商品コードの入数がファイルによって異なる
+    - ロケーション重複: 同じ商品コード・ロケーションの行が複数ファイルにある（二重計上の疑い）
+    """
+    rows = pd.concat(
+        [df[['商品コード', 'ロケーション', '入数']].assign(ファイル=name) for name, df in rows_by_file.items()],
+        ignore_index=True)
+    conflicts = []
+    packs = rows.groupby('商品コード').agg(入数の種類=('入数', 'nunique'), ファイル数=('ファイル', 'nunique'))
+    pack_codes = packs.index[(packs['入数の種類'] > 1) & (packs['ファイル数'] > 1)]
+    if len(pack_codes):
+        conflicts.append(rows[rows['商品コード'].isin(pack_codes)].assign(理由='入数不一致'))
+    per_location = rows.groupby(['商品コード', 'ロケーション'])['ファイル'].transform('nunique')
+    if (per_location > 1).any():
+        conflicts.append(rows[per_location > 1].assign(理由='ロケーション重複'))
+    if not conflicts:
+        return pd.DataFrame(columns=['商品コード', '理由', 'ファイル'])
+    conflicts = pd.concat(conflicts, ignore_index=True)
+    return (conflicts.groupby(['商品コード', '理由'], sort=True)['ファイル']
+            .agg(lambda names: ', '.join(sorted(set(names)))).reset_index())
+
+def load_inventory_files(files, max_workers=INVENTORY_PARSE_WORKERS):
+    """複数の速報倉庫在庫ファイルを並列に読み込み、商品コードごとに合算する
+    
+    ファイル別の読み込み時間（attrs['file_report']）と、ファイル間で食い違う
+    商品コード（attrs['conflicts']）を DataFrame.attrs に付けて返す。
+    """
+    def parse(file):
+        t0 = time.perf_counter()
+        try:
+            rows = load_inventory_rows(file)
+        except Exception as e:
+            raise Exception(f"{file.name}: {str(e)}")
+        return rows, time.perf_counter() - t0
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(files)))) as pool:
+        parsed = list(pool.map(parse, files))
+    
+    # 同名ファイルは番号を付けて区別する
+    names = [f.name for f in files]
+    names = [f"{name} ({i + 1})" if names.count(name) > 1 else name for i, name in enumerate(names)]
+    inventory_df = combine_inventory_rows({name: rows for name, (rows, _) in zip(names, parsed)})
+    inventory_df.attrs['file_report'] = pd.DataFrame({
+        'ファイル': names,
+        '行数': [len(rows) for rows, _ in parsed],
+        '商品数': [rows['商品コード'].nunique() for rows, _ in parsed],
+        '読み込み時間(秒)': [round(seconds, 3) for _, seconds in parsed],
+    })
+    return inventory_df
+
+def combine_inventory_rows(rows_by_file):
+    """ファイル名 -> load_inventory_rows の結果 を商品コードごとに合算する（食い違いは attrs['conflicts']）"""
+    combined = pd.concat(rows_by_file.values(), ignore_index=True)
+    combined['入庫予定数'] = combined['入庫予定'] * combined['入数']
+    combined['倉庫在庫数'] = combined['倉庫在庫数'] + combined['入庫予定数']
+    inventory_df = combined.groupby('商品コード', sort=False, as_index=False).agg(
+        倉庫在庫数=('倉庫在庫数', 'sum'), 入庫予定数=('入庫予定数', 'sum'), 入数=('入数', 'first'))
+    inventory_df.attrs['conflicts'] = find_inventory_conflicts(rows_by_file)
+    return inventory_df
+
+def ocr_regions(ocr, img_np, regions):
+    """画像の指定領域だけをOCRし、ボックスをページ座標に戻した行リストを返す"""
+    regions = [r for r in regions if r[3] > r[1] and r[4] > r[2]]
+    crops = [np.ascontiguousarray(img_np[y0:y1, x0:x1]) for _, x0, y0, x1, y1 in regions]
+    lines = []
+    # 領域はまとめて投入し、同じバッチで推論させる
+    for (_, x0, y0, _, _), crop_lines in zip(regions, ocr.ocr_many(crops)):
+        for box, rec in crop_lines or []:
+            lines.append([[[p[0] + x0, p[1] + y0] for p in box], rec])
+    return lines
+
+def extract_page_rows(lines, width, height, zoom, page_index, page_metrics, metrics, coords=None):
+    """OCR結果から受注行を抽出する（coords 指定時はヘッダー検出を省略）
+
+    戻り値は (行リスト, 学習用テンプレート or None)
+    """
+    boxes = [line[0] for line in lines]
+    texts = [line[1][0] for line in lines]
+    page_metrics['boxes'] = len(boxes)
+    
+    # Helper to find text below
+    def find_below(anchor_pattern, x_range=50, y_limit=100):
+        anchor_idx = -1
+        for i, t in enumerate(texts):
+            if t and re.search(anchor_pattern, t):
+                anchor_idx = i
+                break
+        if anchor_idx == -1: return []
         
-        for page_index in range(len(doc)):
-            page = doc.load_page(page_index)
-            # Higher resolution for OCR
-            zoom = 2.5
-            mat = fitz.Matrix(zoom, zoom)
-            pix = page.get_pixmap(matrix=mat)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            img_np = np.array(img)
-            
-            # OCR execution with error handling
-            try:
-                result = ocr.ocr(img_np)
-            except Exception as ocr_err:
-                st.warning(f"ページ {page_index+1} のOCR処理に失敗しました: {str(ocr_err)}")
-                continue
-                
-            if not result or not result[0]:
-                continue
-                
-            lines = result[0]
-            boxes = [line[0] for line in lines]
-            texts = [line[1][0] for line in lines]
-            
-            # Helper to find text below
-            def find_below(anchor_pattern, x_range=50, y_limit=100):
-                anchor_idx = -1
-                for i, t in enumerate(texts):
-                    if t and re.search(anchor_pattern, t):
-                        anchor_idx = i
-                        break
-                if anchor_idx == -1: return []
-                
-                ax = (boxes[anchor_idx][0][0] + boxes[anchor_idx][1][0]) / 2
-                ab = boxes[anchor_idx][2][1]
-                
-                candidates = []
-                for i, b in enumerate(boxes):
-                    if i == anchor_idx: continue
-                    bx = (b[0][0] + b[1][0]) / 2
-                    bt = b[0][1]
-                    if abs(bx - ax) < x_range and bt > ab and (bt - ab) < y_limit:
-                        candidates.append((i, bt))
-                candidates.sort(key=lambda x: x[1])
-                return [texts[c[0]] for c in candidates]
-
-            # 1. Customer Info
-            cust_texts = find_below("出荷先")
-            customer_code = "不明"
-            customer_name = "不明"
-            for ct in cust_texts:
-                code_match = re.search(r'\d{9}', ct)
-                if code_match:
-                    customer_code = code_match.group()
-                elif customer_code != "不明" and customer_name == "不明":
-                    customer_name = ct
-
-            # 2. Table Headers
+        ax = (boxes[anchor_idx][0][0] + boxes[anchor_idx][1][0]) / 2
+        ab = boxes[anchor_idx][2][1]
+        
+        candidates = []
+        for i, b in enumerate(boxes):
+            if i == anchor_idx: continue
+            bx = (b[0][0] + b[1][0]) / 2
+            bt = b[0][1]
+            if abs(bx - ax) < x_range and bt > ab and (bt - ab) < y_limit:
+                candidates.append((i, bt))
+        candidates.sort(key=lambda x: x[1])
+        return [anchor_idx] + [c[0] for c in candidates]
+
+    with metrics.stage(page_metrics, 'header'):
+        # 1. Customer Info
+        cust_idx = find_below("出荷先")
+        customer_code = "不明"
+        customer_name = "不明"
+        for ct in [texts[i] for i in cust_idx[1:]]:
+            code_match = re.search(r'\d{9}', ct)
+            if code_match:
+                customer_code = code_match.group()
+            elif customer_code != "不明" and customer_name == "不明":
+                customer_name = ct
+
+        # 2. Table Headers
+        if coords is not None:
+            prod_x, qty_x, header_y = coords
+        else:
             prod_x = -1
             qty_x = -1
             header_y = -1
-            print(f"DEBUG Page {page_index+1}: Pix size {pix.width}x{pix.height}")
             for i, t in enumerate(texts):
                 if not t: continue
                 # Fuzzy header check
                 if any(k in t for k in ["受注品目", "品目", "商品"]):
                     prod_x = (boxes[i][0][0] + boxes[i][1][0]) / 2
                     header_y = boxes[i][2][1]
-                    print(f"DEBUG: Found prod_x at {prod_x}, y={header_y} ('{t}')")
+                    prod_header = boxes[i]
+                    logger.debug("page %d: prod_x=%s header_y=%s (%r)", page_index + 1, prod_x, header_y, t)
                 if any(k in t for k in ["数量", "受注数"]):
                     qty_x = (boxes[i][0][0] + boxes[i][1][0]) / 2
-                    print(f"DEBUG: Found qty_x at {qty_x} ('{t}')")
+                    qty_header = boxes[i]
+                    logger.debug("page %d: qty_x=%s (%r)", page_index + 1, qty_x, t)
             
             # If headers are missing, try fallback positions based on common layouts
-            if prod_x == -1: prod_x = pix.width * 0.5 / zoom 
-            if qty_x == -1: qty_x = pix.width * 0.65 / zoom
-            if header_y == -1: header_y = pix.height * 0.25 / zoom
-            print(f"DEBUG: Final Extraction Coords: P_X={prod_x}, Q_X={qty_x}, H_Y={header_y}")
-            
-            # Group lines by row - using a slightly larger variance for hand-scanned notes
-            rows = {}
-            for i, b in enumerate(boxes):
+            if prod_x == -1:
+                prod_x = width * 0.5 / zoom
+                page_metrics['fallback'].append('prod_x')
+            if qty_x == -1:
+                qty_x = width * 0.65 / zoom
+                page_metrics['fallback'].append('qty_x')
+            if header_y == -1:
+                header_y = height * 0.25 / zoom
+                page_metrics['fallback'].append('header_y')
+    
+    page_rows = []
+    prod_used = []
+    qty_used = []
+    with metrics.stage(page_metrics, 'rows'):
+        # Group lines by row - using a slightly larger variance for hand-scanned notes
+        rows = {}
+        for i, b in enumerate(boxes):
+            try:
+                # Validate box structure before accessing
+                if not b or len(b) < 4 or not b[0] or len(b[0]) < 2:
+                    continue
+                top_y = b[0][1]
+                if top_y > (header_y - 10):
+                    matched = False
+                    for r_y in rows.keys():
+                        if abs(top_y - r_y) < 30:
+                            rows[r_y].append(i)
+                            matched = True
+                            break
+                    if not matched:
+                        rows[top_y] = [i]
+            except (IndexError, TypeError):
+                continue
+        
+        for y in sorted(rows.keys()):
+            idx_list = rows[y]
+            p_code = None
+            qty = None
+            p_idx = q_idx = None
+            for idx in idx_list:
                 try:
-                    # Validate box structure before accessing
-                    if not b or len(b) < 4 or not b[0] or len(b[0]) < 2:
+                    box = boxes[idx]
+                    if not box or len(box) < 2:
                         continue
-                    top_y = b[0][1]
-                    if top_y > (header_y - 10):
-                        matched = False
-                        for r_y in rows.keys():
-                            if abs(top_y - r_y) < 30:
-                                rows[r_y].append(i)
-                                matched = True
-                                break
-                        if not matched:
-                            rows[top_y] = [i]
+                    bx = (box[0][0] + box[1][0]) / 2
+                    txt = texts[idx]
                 except (IndexError, TypeError):
                     continue
-            
-            for y in sorted(rows.keys()):
-                idx_list = rows[y]
-                p_code = None
-                qty = None
-                for idx in idx_list:
+                if abs(bx - prod_x) < 200: 
+                    clean_prod = "".join(filter(str.isdigit, txt))
+                    if 4 <= len(clean_prod) <= 12:
+                        p_code = clean_prod
+                        p_idx = idx
+                if abs(bx - qty_x) < 150:
                     try:
-                        box = boxes[idx]
-                        if not box or len(box) < 2:
-                            continue
-                        bx = (box[0][0] + box[1][0]) / 2
-                        txt = texts[idx]
-                    except (IndexError, TypeError):
-                        continue
-                    if abs(bx - prod_x) < 200: 
-                        clean_prod = "".join(filter(str.isdigit, txt))
-                        if 4 <= len(clean_prod) <= 12:
-                            p_code = clean_prod
-                    if abs(bx - qty_x) < 150:
-                        try:
-                            clean_qty = re.sub(r'[^0-9\.]', '', txt)
-                            if clean_qty:
-                                qty = int(float(clean_qty))
-                        except:
-                            pass
+                        clean_qty = re.sub(r'[^0-9\.]', '', txt)
+                        if clean_qty:
+                            qty = int(float(clean_qty))
+                            q_idx = idx
+                    except:
+                        pass
+            
+            if p_code and qty is not None:
+                prod_used.append(boxes[p_idx])
+                qty_used.append(boxes[q_idx])
+                page_rows.append({
+                    '顧客コード': customer_code,
+                    '顧客名': customer_name,
+                    '伝票番号': 'PDF受注',
+                    '商品コード': p_code.lstrip('0'),
+                    '商品名漢字': "PDF抽出商品",
+                    '商品名カナ': "",
+                    '発注数量': qty,
+                    'チェーン店固有エリア': ""
+                })
+    
+    # ヘッダーがすべて見つかったページはレイアウトテンプレートとして学習する
+    template = None
+    if coords is None and not page_metrics['fallback']:
+        template = build_layout_template(width, height, prod_x, qty_x, header_y,
+                                         [boxes[i] for i in cust_idx], prod_used, qty_used, prod_header, qty_header)
+    return page_rows, template
+
+def process_pdf_order(file, metrics=None, on_page=None):
+    """PDF受注一覧を解析する（on_page(処理済みページ数, 総ページ数) で進捗を通知）"""
+    if metrics is None:
+        metrics = PdfMetrics(file.name)
+    try:
+        # セッション共通のOCRサービス（バッチ推論）に投入する
+        ocr = ocr_service.get_client()
+        # ディスク上のPDF（ジョブ入力）はパスから開き、バッファへの読み込みを省く
+        path = getattr(file, 'path', None)
+        doc = fitz.open(path, filetype="pdf") if path else fitz.open(stream=file.read(), filetype="pdf")
+        extracted_data = []
+        
+        for page_index in range(len(doc)):
+            if on_page:
+                on_page(page_index, len(doc))
+            page_metrics = metrics.new_page(page_index)
+            with metrics.stage(page_metrics, 'render'):
+                page = doc.load_page(page_index)
+                # Higher resolution for OCR
+                zoom = 2.5
+                mat = fitz.Matrix(zoom, zoom)
+                pix = page.get_pixmap(matrix=mat)
+                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+                img_np = np.array(img)
+                fingerprint = layout_fingerprint(img_np)
+            page_metrics['width'] = pix.width
+            page_metrics['height'] = pix.height
+            
+            # 既知のレイアウトなら顧客ブロックと商品・数量列だけをOCRする
+            page_rows = None
+            template = layout_templates.match(fingerprint)
+            if template is not None:
+                regions = trim_regions(template_regions(template, pix.width, pix.height), img_np)
+                try:
+                    with metrics.stage(page_metrics, 'ocr'):
+                        lines = ocr_regions(ocr, img_np, regions)
+                    page_metrics['ocr_pixels'] += sum((x1 - x0) * (y1 - y0) for _, x0, y0, x1, y1 in regions)
+                    page_rows, _ = extract_page_rows(
+                        lines, pix.width, pix.height, zoom, page_index, page_metrics, metrics,
+                        coords=template_coords(template, pix.width, pix.height))
+                except Exception as ocr_err:
+                    logger.warning("page %d: テンプレート領域のOCRに失敗しました: %s", page_index + 1, ocr_err)
+                if page_rows:
+                    page_metrics['template'] = True
+                else:
+                    # テンプレートが合わなかった（レイアウト変更など）ので破棄して全面OCRする
+                    layout_templates.forget(fingerprint)
+                    page_rows = None
+            
+            if page_rows is None:
+                # OCR execution with error handling
+                try:
+                    with metrics.stage(page_metrics, 'ocr'):
+                        result = ocr.ocr(img_np)
+                    page_metrics['ocr_pixels'] += pix.width * pix.height
+                except Exception as ocr_err:
+                    # ワーカースレッドで動くので画面には出さず、メトリクス経由でジョブに記録する
+                    page_metrics['ocr_failed'] = True
+                    logger.warning("%s page %d: OCR処理に失敗しました: %s", file.name, page_index + 1, ocr_err)
+                    metrics.warnings.append(f"ページ {page_index+1} のOCR処理に失敗しました: {str(ocr_err)}")
+                    continue
+                    
+                if not result or not result[0]:
+                    continue
                 
-                if p_code and qty is not None:
-                    extracted_data.append({
-                        '顧客コード': customer_code,
-                        '顧客名': customer_name,
-                        '伝票番号': 'PDF受注',
-                        '商品コード': p_code.lstrip('0'),
-                        '商品名漢字': "PDF抽出商品",
-                        '商品名カナ': "",
-                        '発注数量': qty,
-                        'チェーン店固有エリア': ""
-                    })
+                page_rows, learned = extract_page_rows(
+                    result[0], pix.width, pix.height, zoom, page_index, page_metrics, metrics)
+                if learned is not None:
+                    layout_templates.learn(fingerprint, learned)
+            
+            extracted_data.extend(page_rows)
+            page_metrics['rows'] = len(page_rows)
         
+        if on_page:
+            on_page(len(doc), len(doc))
         doc.close()
+        metrics.finish()
         return pd.DataFrame(extracted_data)
     except Exception as e:
-        import traceback
-        st.error(f"詳細エラー:\n{traceback.format_exc()}")
+        metrics.finish(error=str(e))
+        logger.exception("PDFファイルの読み込みに失敗しました: %s", file.name)
         raise Exception(f"PDFファイルの読み込みエラー ({file.name}): {str(e)}")
+    finally:
+        try:
+            metrics.write_jsonl()
+            metrics_registry.write_prometheus()
+        except OSError as write_err:
+            logger.warning("PDFメトリクスの書き込みに失敗しました: %s", write_err)
 
 def load_order_file(file):
     """受注ファイルを読み込む"""
     encodings = ['utf-8-sig', 'utf-8', 'cp932']
-    df = None
-    last_error = None
-    
-    for encoding in encodings:
+    # 文字コードはバッファ（退避済みならメモリマップ）を逐次デコードして判定し、解析は1回だけ行う
+    # 列はヘッダー行の列名から特定する（同じヘッダーのファイルはキャッシュした列計画を使う）
+    with file.getbuffer() as buffer:
+        encoding = detect_encoding(buffer, encodings)
+        if encoding is None:
+            raise Exception(f"受注ファイルの文字コードエラー: 対応しているエンコーディングでの読み込みに失敗しました。")
         try:
-            file.seek(0)
-            df = pd.read_csv(
-                file,
-                encoding=encoding,
-                sep='\t',
-                header=0,
-                usecols=[14, 15, 38, 97, 106, 108, 118, 143]
-            )
-            break
-        except UnicodeDecodeError as e:
-            last_error = e
-            continue
-        except Exception as e:
-            raise Exception(f"受注ファイルの読み込みエラー: {str(e)}")
+            plan = order_plan_cache.plan_for(buffer, encoding)
+        except OrderSchemaError as e:
+            raise Exception(f"受注ファイルの形式エラー: {str(e)}")
     
-    if df is None:
-        raise Exception(f"受注ファイルの文字コードエラー: 対応しているエンコーディングでの読み込みに失敗しました。")
+    source = parser_source(file)
+    try:
+        df = pd.read_csv(
+            source,
+            encoding=encoding,
+            sep='\t',
+            header=None,
+            skiprows=1,
+            usecols=plan.usecols,
+            memory_map=isinstance(source, str)
+        )
+    except Exception as e:
+        raise Exception(f"受注ファイルの読み込みエラー: {str(e)}")
     
     try:
-        df.columns = ['顧客コード', '顧客名', '伝票番号', '商品コード', '商品名漢字', '商品名カナ', '発注数量', 'チェーン店固有エリア']
+        df = pd.DataFrame({field: df[pos] for field, pos in plan.positions.items()})
         df['発注数量'] = pd.to_numeric(df['発注数量'], errors='coerce').fillna(0).astype(int)
         df = df.dropna(subset=['商品コード'])
         df['商品コード'] = df['商品コード'].astype(str).str.lstrip('0')
@@ -367,13 +568,15 @@ def load_order_file(file):
 
 def calculate_allocation(inventory_df, order_df):
     """在庫引当を計算する"""
-    order_summary = order_df.groupby('商品コード').agg({
+    order_summary = order_df.groupby('商品コード', observed=True).agg({
         '発注数量': 'sum',
         '商品名漢字': 'first',
         '商品名カナ': 'first'
     }).reset_index()
     order_summary.columns = ['商品コード', '受注合計数', '商品名漢字', '商品名カナ']
-    order_summary['商品名'] = order_summary['商品名漢字'].fillna(order_summary['商品名カナ']).fillna('')
+    order_summary['受注合計数'] = order_summary['受注合計数'].astype(np.int64)
+    # 受注明細がカテゴリ型（compact_order_frame）でも文字列として扱う
+    order_summary['商品名'] = order_summary['商品名漢字'].astype(object).fillna(order_summary['商品名カナ'].astype(object)).fillna('')
     order_summary = order_summary[['商品コード', '受注合計数', '商品名']]
     order_summary['商品コード'] = order_summary['商品コード'].astype(str)
     
@@ -391,6 +594,37 @@ def calculate_allocation(inventory_df, order_df):
     
     return allocation_df
 
+def build_shortage_table(shortage_df, order_df):
+    """不足商品を伝票番号ごとに1行へ展開した一覧を作る"""
+    columns = ['商品コード', '商品名', '倉庫在庫', '受注合計', '不足数', '伝票番号', '該当顧客名']
+    shortage = shortage_df[['商品コード', '倉庫在庫数', '受注合計数', '引当後在庫']].copy()
+    shortage['不足数'] = shortage['引当後在庫'].abs()
+    
+    # 不足商品の受注明細（商品ごとに伝票番号の重複を除く）
+    details = order_df.loc[order_df['商品コード'].isin(shortage['商品コード']),
+                           ['商品コード', '顧客名', '伝票番号', 'チェーン店固有エリア']]
+    details = details.drop_duplicates(subset=['商品コード', '伝票番号'])
+    result_df = shortage.merge(details, on='商品コード', how='inner')
+    if result_df.empty:
+        return pd.DataFrame(columns=columns)
+    result_df = pd.DataFrame({
+        '商品コード': result_df['商品コード'],
+        '商品名': result_df['チェーン店固有エリア'].astype(str),
+        '倉庫在庫': result_df['倉庫在庫数'],
+        '受注合計': result_df['受注合計数'],
+        '不足数': result_df['不足数'],
+        '伝票番号': result_df['伝票番号'].astype(str),
+        '該当顧客名': result_df['顧客名'].astype(str),
+    })
+    
+    # 伝票番号の昇順ソート
+    result_df = result_df.sort_values('伝票番号', ascending=True, kind='stable').reset_index(drop=True)
+    
+    # 伝票番号の重複チェック（異なる商品で同一伝票番号が存在する場合）
+    slip_counts = result_df['伝票番号'].map(result_df['伝票番号'].value_counts())
+    result_df['重複'] = np.where(slip_counts > 1, '★', '')
+    return result_df
+
 def display_results(allocation_df, order_df):
     """結果を表示する"""
     # 0019005 を抽出
@@ -430,33 +664,7 @@ def display_results(allocation_df, order_df):
     else:
         st.markdown('<div class="section-title">⚠️ 不足商品リスト</div>', unsafe_allow_html=True)
         
-        shortage_df['不足数'] = shortage_df['引当後在庫'].abs()
-        
-        # 伝票番号ごとに1行で展開
-        slip_rows = []
-        for _, row in shortage_df.iterrows():
-            product_code = row['商品コード']
-            order_details = order_df[order_df['商品コード'] == product_code][['顧客名', '伝票番号', 'チェーン店固有エリア']].drop_duplicates(subset=['伝票番号'])
-            for _, detail in order_details.iterrows():
-                slip_rows.append({
-                    '商品コード': product_code,
-                    '商品名': str(detail.get('チェーン店固有エリア', '')),
-                    '倉庫在庫': row['倉庫在庫数'],
-                    '受注合計': row['受注合計数'],
-                    '不足数': row['不足数'],
-                    '伝票番号': str(detail['伝票番号']),
-                    '該当顧客名': str(detail['顧客名'])
-                })
-        
-        result_df = pd.DataFrame(slip_rows)
-        if not result_df.empty:
-            # 伝票番号の昇順ソート
-            result_df = result_df.sort_values('伝票番号', ascending=True).reset_index(drop=True)
-            
-            # 伝票番号の重複チェック（異なる商品で同一伝票番号が存在する場合）
-            slip_counts = result_df['伝票番号'].value_counts()
-            dup_slips = slip_counts[slip_counts > 1].index
-            result_df['重複'] = result_df['伝票番号'].apply(lambda x: '★' if x in dup_slips else '')
+        result_df = build_shortage_table(shortage_df, order_df)
         
         st.dataframe(result_df, use_container_width=True)
 
@@ -478,6 +686,533 @@ def display_results(allocation_df, order_df):
             })
         st.dataframe(pd.DataFrame(special_info), use_container_width=True)
 
+def display_pdf_metrics(pdf_metrics):
+    """PDF処理メトリクスを折りたたみパネルに表示する"""
+    if not pdf_metrics:
+        return
+    with st.expander("⏱️ PDF処理メトリクス", expanded=False):
+        st.dataframe(pd.DataFrame([m.summary() for m in pdf_metrics]), use_container_width=True)
+        page_records = [r for m in pdf_metrics for r in m.to_records() if r.get('page') is not None]
+        if page_records:
+            page_df = pd.DataFrame(page_records)
+            page_df['fallback'] = page_df['fallback'].apply(lambda x: ', '.join(x))
+            st.dataframe(
+                page_df[['file', 'page', 'width', 'height', 'render_s', 'ocr_s', 'header_s', 'rows_s', 'boxes', 'rows', 'fallback', 'template', 'ocr_pixels']],
+                use_container_width=True
+            )
+        metrics_text = metrics_registry.render_prometheus()
+        if not ocr_service.SERVICE_URL:
+            metrics_text += ocr_service.local_batcher().render_prometheus()
+        st.code(metrics_text, language='text')
+
+def display_profile(profiler):
+    """プロファイルモードのステージ別内訳とサンプリング結果を表示する"""
+    if not profiler.enabled or not profiler.stages:
+        return
+    with st.expander("🧪 プロファイル（ステージ別内訳）", expanded=True):
+        stages_df = pd.DataFrame(profiler.records()).rename(columns={
+            'stage': 'ステージ', 'wall_s': '経過時間(秒)', 'cpu_s': 'CPU時間(秒)',
+            'rss_delta_mb': 'メモリ増減(MB)', 'share': '割合'})
+        st.dataframe(stages_df, use_container_width=True, hide_index=True,
+                     column_config={'割合': st.column_config.ProgressColumn('割合', min_value=0.0, max_value=1.0)})
+        st.caption(f"実行全体: {profiler.total_s:.2f} 秒 / サンプル数: {sum(profiler.samples.values()):,}")
+        if profiler.samples:
+            st.download_button(
+                "📥 サンプリングプロファイル（collapsed stacks）",
+                data=profiler.collapsed_stacks().encode('utf-8'),
+                file_name="allocation_profile.collapsed.txt",
+                mime="text/plain"
+            )
+
+def display_ocr_readiness():
+    """OCRエンジンの準備状態を表示する（読み込み中はポーリング）"""
+    loading = ocr_engine.readiness()['status'] not in (ocr_engine.READY, ocr_engine.FAILED)
+
+    def render():
+        state = ocr_engine.readiness()
+        if state['status'] == ocr_engine.READY:
+            st.caption(f"🟢 OCR準備完了（読み込み {state['seconds']:.1f} 秒）")
+        elif state['status'] == ocr_engine.FAILED:
+            st.caption(f"🔴 OCRエンジンの初期化に失敗しました: {state['error']}")
+        else:
+            st.caption("🟡 OCRモデルを読み込み中です（PDFは準備完了後に処理されます）")
+
+    st.fragment(render, run_every=3 if loading else None)()
+
+def scheduled_pdf_order(file, **kwargs):
+    """受付制御（OCR枠）の中で PDF を解析する"""
+    with scheduler.slot(JOB_OCR, estimate_job_memory(JOB_OCR, file.size)):
+        return process_pdf_order(file, **kwargs)
+
+def run_tabular(load_fn, file, status):
+    """受付制御（表形式枠）の中でファイルを読み込む。待ち順位は status に表示する
+    
+    file は複数ファイルのリストでもよい（まとめて1つの枠で読み込む）。
+    """
+    files = file if isinstance(file, list) else [file]
+    names = ', '.join(f.name for f in files)
+    def on_wait(ahead):
+        status.info(f"⏳ 順番待ち: 前に {ahead} 件のジョブがあります（{names}）")
+    try:
+        estimate = estimate_job_memory(JOB_TABULAR, sum(f.size for f in files))
+        with scheduler.slot(JOB_TABULAR, estimate, on_wait=on_wait):
+            status.empty()
+            return load_fn(file)
+    finally:
+        try:
+            scheduler.write_prometheus()
+        except OSError as write_err:
+            logger.warning("受付制御メトリクスの書き込みに失敗しました: %s", write_err)
+
+def display_customer_exposure(top_n=20):
+    """顧客 × 商品の疎行列から、不足の影響が大きい顧客と顧客別の充足率を表示する"""
+    matrix = st.session_state.get('demand_matrix')
+    allocation_df = st.session_state.get('allocation_result')
+    if matrix is None or allocation_df is None:
+        return
+    t0 = time.perf_counter()
+    exposure = matrix.customer_exposure(allocation_df)
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    affected = exposure[exposure['不足明細数'] > 0]
+    if affected.empty:
+        return
+    with st.expander(f"👥 顧客別の不足影響（{len(affected):,} / {len(exposure):,} 顧客）"):
+        st.caption("不足数は商品ごとに各顧客の受注数量で按分した値です（引当順は考慮しません）。")
+        st.dataframe(affected.head(top_n), use_container_width=True, hide_index=True,
+                     column_config={'充足率': st.column_config.ProgressColumn('充足率', min_value=0.0, max_value=1.0)})
+        labels = dict(zip(affected['顧客コード'].head(top_n), affected['顧客名'].head(top_n)))
+        selected = st.selectbox("顧客別の不足商品", options=list(labels),
+                                format_func=lambda c: f"{c} {labels[c]}", key='exposure_customer')
+        if selected is not None:
+            st.dataframe(matrix.customer_shortages(selected, allocation_df), use_container_width=True, hide_index=True)
+        st.download_button(
+            "📥 顧客別の不足影響（全顧客 CSV）",
+            data=exposure.to_csv(index=False).encode('utf-8-sig'),
+            file_name="customer_exposure.csv",
+            mime="text/csv"
+        )
+        st.caption(f"{matrix.shape[0]:,} 顧客 × {matrix.shape[1]:,} 商品 / 集計 {elapsed_ms:.1f} ms")
+
+def display_provisional(placeholder, running, total_files):
+    """受注ファイルを読み込むたびに、それまでの受注で判明した不足を商品単位で表示する"""
+    shortage_df = running.shortages()
+    with placeholder.container():
+        st.markdown(f"**⏱️ 暫定結果（{running.files}/{total_files} ファイル読み込み済み）**")
+        st.caption("受注は加算されるだけなので、ここに出た不足は残りのファイルを読み込んでも解消しません。"
+                   "不足数は残りのファイル分だけ増える可能性があります。")
+        if shortage_df.empty:
+            st.info("現時点で不足している商品はありません。")
+        else:
+            st.dataframe(pd.DataFrame({
+                '商品コード': shortage_df['商品コード'],
+                '商品名': shortage_df['商品名'],
+                '倉庫在庫': shortage_df['倉庫在庫数'],
+                '受注合計(暫定)': shortage_df['受注合計数'],
+                '不足数(暫定)': -shortage_df['引当後在庫'],
+            }), use_container_width=True, hide_index=True)
+
+def display_dedup_report(dedup):
+    """複数の受注ファイルにまたがる重複明細（除外済み）を表示する"""
+    if not dedup.duplicates:
+        return
+    st.warning(f"⚠️ 重複している受注明細 {dedup.duplicates:,} 行を除外しました（二重計上の防止）。")
+    with st.expander("🧾 受注ファイルの重複チェック"):
+        st.dataframe(dedup.report_frame(), use_container_width=True, hide_index=True)
+        st.caption(f"識別キー: {dedup.key}（ORDER_DEDUP_KEY で変更）")
+
+def load_order_archive(file, status):
+    """受注アーカイブを受付制御（表形式枠・メモリ予算分）の中で展開・解析し、メンバーの結果を順に返す"""
+    def on_wait(ahead):
+        status.info(f"⏳ 順番待ち: 前に {ahead} 件のジョブがあります（{file.name}）")
+    with scheduler.slot(JOB_TABULAR, ARCHIVE_MEMORY_BUDGET_MB * 1024 * 1024, on_wait=on_wait):
+        status.empty()
+        yield from iter_archive_orders(file, load_order_file,
+                                       estimate=lambda size: estimate_job_memory(JOB_TABULAR, size))
+
+def display_archive_reports(reports):
+    """アーカイブのメンバーごとの明細数とエラーを表示する"""
+    if not reports:
+        return
+    report = pd.concat(reports, ignore_index=True)
+    errors = report[report['エラー'] != '']
+    if not errors.empty:
+        st.error(f"アーカイブ内の {len(errors):,} ファイルを読み込めませんでした（他のファイルで判定しています）。")
+    with st.expander(f"🗜️ アーカイブの内容（{len(report):,} ファイル / {int(report['明細数'].sum()):,} 明細）"):
+        st.dataframe(report, use_container_width=True, hide_index=True)
+
+def select_inventory_snapshot(inventory_files):
+    """アップロードがない場合に、共有中の在庫スナップショットを選べるようにする"""
+    if inventory_files:
+        return None
+    snapshots = inventory_store.snapshots()
+    if not snapshots:
+        return None
+    labels = {s.version: s.describe() for s in snapshots}
+    return st.selectbox(
+        "共有中の在庫スナップショットを使用",
+        options=[None] + list(labels),
+        format_func=lambda v: "使用しない" if v is None else labels[v],
+        key='inventory_snapshot'
+    )
+
+def load_inventory_snapshot(inventory_files, snapshot_version, status):
+    """在庫スナップショットを取得する（未解析のファイルならここで一度だけ解析する）
+    
+    複数ファイルの場合は並列に読み込んで商品コードごとに合算する。
+    """
+    if len(inventory_files) == 1:
+        snapshot, reused = inventory_store.get_or_load(
+            inventory_files[0], lambda f: run_tabular(load_inventory_file, f, status))
+    elif inventory_files:
+        snapshot, reused = inventory_store.get_or_load(
+            inventory_files, lambda f: run_tabular(load_inventory_files, f, status))
+    else:
+        snapshot, reused = inventory_store.get(snapshot_version), True
+        if snapshot is None:
+            raise Exception("選択した在庫スナップショットは有効期限が切れました。ファイルを再アップロードしてください。")
+    note = "（共有済みのスナップショットを使用）" if reused else ""
+    st.caption(f"📌 在庫: {snapshot.describe()}{note}")
+    display_inventory_merge(snapshot)
+    return snapshot
+
+def display_inventory_merge(snapshot):
+    """複数ファイル合算時のファイル別読み込み時間と、ファイル間の食い違いを表示する"""
+    report = snapshot.attrs.get('file_report')
+    if report is None:
+        return
+    conflicts = snapshot.attrs.get('conflicts')
+    if conflicts is not None and not conflicts.empty:
+        st.warning(f"⚠️ 在庫ファイル間で食い違いのある商品が {conflicts['商品コード'].nunique():,} 件あります（入数不一致・ロケーション重複）。")
+    with st.expander(f"📑 在庫ファイルの合算（{len(report)} ファイル）"):
+        st.dataframe(report, use_container_width=True, hide_index=True)
+        if conflicts is not None and not conflicts.empty:
+            st.dataframe(conflicts, use_container_width=True, hide_index=True)
+
+def get_upload_spool():
+    """セッション専用の一時ファイル置き場（セッション破棄時に一時ファイルも削除される）"""
+    if 'upload_spool' not in st.session_state:
+        st.session_state['upload_spool'] = UploadSpool()
+    return st.session_state['upload_spool']
+
+def spool_uploads(inventory_files, order_files):
+    """大きな在庫・受注ファイルを一時ファイルへ退避する（PDFはOCRジョブ側でディスクに保存される）"""
+    spool = get_upload_spool()
+    spool.retain(inventory_files + order_files)
+    inventory_files = [spool.spool(f) for f in inventory_files]
+    order_files = [f if f.name.lower().endswith('.pdf') else spool.spool(f) for f in order_files]
+    return inventory_files, order_files
+
+@st.cache_resource
+def get_run_history():
+    """プロセス共通の実行履歴（起動時に保持期間を過ぎた明細を整理する）"""
+    history = RunHistory()
+    try:
+        history.compact()
+    except Exception as e:
+        logger.warning("実行履歴の整理に失敗しました: %s", e)
+    return history
+
+def browser_owner():
+    """このブラウザの所有者ID（OCRジョブ・在庫照会APIの結果の持ち主）。URL の ?owner= に保持するので、再読み込みしても変わらない"""
+    owner = st.query_params.get('owner')
+    if not owner:
+        owner = uuid.uuid4().hex
+        st.query_params['owner'] = owner
+    return owner
+
+@st.cache_resource
+def get_stock_api():
+    """プロセス共通の在庫照会API（STOCK_API_PORT=off で無効）"""
+    return stock_api.start_server()
+
+def publish_allocation(state, label):
+    """在庫照会APIが返すこのブラウザの結果を差し替える"""
+    try:
+        stock_api.publish(state, label, owner=browser_owner())
+    except Exception as e:
+        logger.warning("在庫照会APIへの公開に失敗しました: %s", e)
+
+def record_run_history(allocation_df, order_df, snapshot, order_files, pdf_metrics):
+    """今回の引当結果を実行履歴に追記する（失敗しても判定結果の表示は妨げない）"""
+    names = [f.name for f in order_files if not f.name.lower().endswith('.pdf')] + [m.file_name for m in pdf_metrics]
+    try:
+        get_run_history().record_run(allocation_df, order_df, inventory=snapshot.label, order_files=names)
+    except Exception as e:
+        logger.warning("実行履歴の記録に失敗しました: %s", e)
+
+def display_watch_report():
+    """監視フォルダのデーモン（watch_daemon.py）が書き出した最新の不足一覧を表示する"""
+    report_dir = os.environ.get('WATCH_REPORT_DIR')
+    if not report_dir:
+        return
+    from watch_daemon import read_report
+    status, table = read_report(report_dir)
+    if status is None:
+        return
+    with st.expander(f"📂 監視フォルダの最新結果（{status['updated_at'].replace('T', ' ')} 時点）"):
+        col_files, col_lines, col_short = st.columns(3)
+        col_files.metric("受注ファイル", f"{len(status['order_files']):,}")
+        col_lines.metric("受注明細", f"{status['order_lines']:,}")
+        col_short.metric("不足商品", f"{status['shortages']:,}")
+        if not status['inventory_files']:
+            st.warning("監視フォルダに在庫ファイルがないため、不足は判定していません。")
+        for name, message in status['errors'].items():
+            st.error(f"{name}: {message}")
+        if status.get('duplicate_lines'):
+            st.warning(f"⚠️ 重複している受注明細 {status['duplicate_lines']:,} 行を除外しました（二重計上の防止）。")
+        if table.empty:
+            st.info("現時点で不足している商品はありません。")
+        else:
+            st.dataframe(table, use_container_width=True, hide_index=True)
+        st.caption(f"監視フォルダ: {status['directory']} / 在庫ファイル: {', '.join(status['inventory_files']) or 'なし'}")
+
+def display_delta_panel():
+    """在庫の差分ファイルを直近の判定結果に適用し、影響を受けた商品だけ再判定する"""
+    state = st.session_state.get('allocation_state')
+    if state is None:
+        return
+    with st.expander("🩹 在庫差分の適用（再アップロードなし）"):
+        st.caption("商品コードと在庫調整（個数）・入庫予定調整（ケース数）・入数の列を持つ CSV / Excel を適用します。")
+        delta_file = st.file_uploader("差分ファイル", type=['csv', 'txt', 'xlsx'], key='inventory_delta')
+        applied = st.session_state.setdefault('applied_deltas', set())
+        if delta_file and st.button("差分を適用", key='apply_delta'):
+            if delta_file.file_id in applied:
+                st.warning(f"{delta_file.name} は適用済みです。")
+            else:
+                try:
+                    delta = read_delta_file(delta_file)
+                    t0 = time.perf_counter()
+                    affected = state.apply_delta(delta, source=delta_file.name)
+                    elapsed_ms = (time.perf_counter() - t0) * 1000
+                    applied.add(delta_file.file_id)
+                    publish_allocation(state, f"差分適用: {delta_file.name}")
+                    st.success(f"{len(delta):,} 行を適用し、{len(affected):,} 商品を再判定しました（{elapsed_ms:.2f} ms）。")
+                    affected_df = state.frame(affected)
+                    shortage_df = affected_df[(affected_df['引当後在庫'] < 0) & (affected_df['商品コード'] != '19005')]
+                    st.markdown("**影響を受けた商品**")
+                    st.dataframe(affected_df, use_container_width=True, hide_index=True)
+                    if not shortage_df.empty:
+                        st.markdown("**適用後も不足している商品（伝票別）**")
+                        st.dataframe(build_shortage_table(shortage_df, st.session_state['allocation_orders']),
+                                     use_container_width=True)
+                except Exception as e:
+                    st.error(f"差分ファイルの適用エラー: {str(e)}")
+        st.caption(f"現在の不足商品: {int(state.shortage_mask().sum()):,} 件")
+        if state.audit:
+            st.markdown("**適用履歴**")
+            st.dataframe(state.audit_frame(), use_container_width=True, hide_index=True)
+
+def display_whatif_panel():
+    """入庫予定・在庫を商品ごとに上書きし、どの伝票の不足が解消するかを即座に確認する"""
+    state = st.session_state.get('allocation_state')
+    if state is None:
+        return
+    with st.expander("🔮 What-if シミュレーション（入庫予定・在庫の上書き）"):
+        short_idx = state.baseline_shortages()
+        is_short = np.zeros(state.n_ordered, dtype=bool)
+        is_short[short_idx] = True
+        options = list(state.codes[short_idx]) + list(state.codes[:state.n_ordered][~is_short])
+        if not options:
+            st.caption("受注のある商品がありません。")
+            return
+        col_code, col_stock, col_incoming = st.columns([2, 1, 1])
+        with col_code:
+            code = st.selectbox("商品コード（不足商品が先頭）", options=options, key='whatif_code',
+                                format_func=lambda c: f"{c} {state.names[state.index[c]]}")
+        i = state.index[code]
+        # 在庫ファイルには負の在庫・入庫予定（戻し・調整）もあるので下限は設けない
+        with col_stock:
+            on_hand = st.number_input("実在庫（個）", value=int(state.on_hand[i]), step=1, key=f'whatif_stock_{code}')
+        with col_incoming:
+            pack = int(state.packs[i])
+            cases = st.number_input(f"入庫予定（ケース × 入数 {pack}）", step=1, disabled=pack <= 0,
+                                    value=int(state.incoming[i] // pack) if pack > 0 else 0, key=f'whatif_cases_{code}')
+        col_apply, col_reset = st.columns(2)
+        if col_apply.button("上書きを適用", key='whatif_apply', use_container_width=True):
+            t0 = time.perf_counter()
+            state.set_override(code, on_hand=on_hand, incoming_cases=cases if pack > 0 else None)
+            st.session_state['whatif_elapsed_us'] = (time.perf_counter() - t0) * 1e6
+        if col_reset.button("すべて元に戻す", key='whatif_reset', use_container_width=True):
+            state.clear_overrides()
+            st.session_state.pop('whatif_elapsed_us', None)
+        
+        if not len(state.overridden()):
+            st.caption("上書き中の商品はありません。")
+            return
+        st.markdown("**上書き中の商品**")
+        st.dataframe(state.overrides_frame(), use_container_width=True, hide_index=True)
+        changes = state.slip_changes()
+        cleared = int((changes['状態'] == '解消').sum())
+        st.markdown(f"**関係する伝票**（解消 {cleared:,} 件）")
+        st.dataframe(changes, use_container_width=True, hide_index=True)
+        current = state.frame(np.flatnonzero(state.shortage_mask()))
+        st.caption(f"上書き後の不足商品: {len(current):,} 件 / 再計算: {st.session_state.get('whatif_elapsed_us', 0):.0f} µs")
+
+def display_rationing_panel():
+    """不足商品の在庫を方針に従って伝票・顧客へ配分し、伝票ごとの割当数と不足数を表示する"""
+    state = st.session_state.get('allocation_state')
+    if state is None or not state.shortage_mask().any():
+        return
+    with st.expander("⚖️ 不足商品の配分（伝票・顧客ごとの割当）"):
+        st.caption("不足している商品の在庫（倉庫在庫 + 入庫予定）を方針に従って配分します。差分・What-if の上書きを反映します。")
+        col_policy, col_unit = st.columns(2)
+        policy = col_policy.radio("配分方針", options=list(RATIONING_POLICIES), format_func=RATIONING_POLICIES.get,
+                                  key='rationing_policy', horizontal=True)
+        unit = col_unit.radio("配分の単位", options=list(RATIONING_UNITS), key='rationing_unit', horizontal=True,
+                              format_func=lambda u: '伝票' if u == '伝票番号' else '顧客')
+        priority, minimum = (), 1
+        if policy == 'priority':
+            text = st.text_area("優先顧客コード（1行に1つ、上ほど優先）", key='rationing_priority')
+            priority = [line.strip() for line in text.splitlines() if line.strip()]
+        elif policy == 'minimum':
+            minimum = st.number_input("最低数（個）", min_value=1, value=1, step=1, key='rationing_minimum')
+        try:
+            t0 = time.perf_counter()
+            result = ration(state.frame(), st.session_state['allocation_orders'], policy=policy, unit=unit,
+                            priority=priority, minimum=int(minimum))
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+        except Exception as e:
+            st.error(f"配分の計算エラー: {str(e)}")
+            return
+        st.dataframe(result, use_container_width=True, hide_index=True)
+        st.download_button(
+            "📥 配分結果（CSV）",
+            data=result.to_csv(index=False).encode('utf-8-sig'),
+            file_name=f"rationing_{policy}.csv",
+            mime="text/csv"
+        )
+        st.caption(f"{result['商品コード'].nunique():,} 商品 / {len(result):,} 行 / 計算 {elapsed_ms:.1f} ms")
+
+def display_inbound_projection():
+    """日付付きの入庫予定から、不足商品ごとに不足が解消する日を表示する"""
+    state = st.session_state.get('allocation_state')
+    if state is None:
+        return
+    with st.expander("📅 入庫予定日による解消見込み"):
+        st.caption("商品コード・入庫日・入庫数（またはケース数）の列を持つ CSV / Excel を読み込みます。"
+                   "予定がある商品は在庫ファイルの入庫予定を予定日ごとの入庫で置き換えます。")
+        schedule_file = st.file_uploader("入庫予定ファイル", type=['csv', 'txt', 'xlsx'], key='inbound_schedule')
+        if not schedule_file:
+            return
+        col_start, col_horizon = st.columns(2)
+        start = col_start.date_input("開始日", key='inbound_start')
+        horizon = col_horizon.slider("期間（日）", min_value=7, max_value=90, value=DEFAULT_HORIZON_DAYS, key='inbound_horizon')
+        try:
+            schedule = read_schedule_file(schedule_file)
+            t0 = time.perf_counter()
+            projection = project_inbound(state, schedule, start=start, horizon=horizon)
+            result = projection.shortages_frame()
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+        except Exception as e:
+            st.error(f"入庫予定ファイルの読み込みエラー: {str(e)}")
+            return
+        if projection.unknown_codes:
+            st.warning(f"在庫・受注にない商品コード {len(projection.unknown_codes):,} 件は除外しました: "
+                       + ", ".join(projection.unknown_codes[:10]))
+        if result.empty:
+            st.info("開始日に不足している商品はありません。")
+            return
+        never = int(result['解消日'].isna().sum())
+        st.markdown(f"**不足商品 {len(result):,} 件**（期間内に解消しない商品 {never:,} 件）")
+        st.dataframe(result, use_container_width=True, hide_index=True)
+        code = st.selectbox("商品別の推移", options=list(result['商品コード']), key='inbound_code',
+                            format_func=lambda c: f"{c} {state.names[state.index[c]]}")
+        if code is not None:
+            st.line_chart(projection.product_frame(code))
+        st.download_button(
+            "📥 解消見込み（CSV）",
+            data=result.to_csv(index=False).encode('utf-8-sig'),
+            file_name="inbound_projection.csv",
+            mime="text/csv"
+        )
+        st.caption(f"{len(state):,} 商品 × {horizon + 1} 日 / 予定 {len(schedule):,} 行 / 計算 {elapsed_ms:.1f} ms")
+
+def display_run_history():
+    """過去の実行から、繰り返し不足している商品と顧客別の影響を表示する"""
+    with st.expander("📈 不足履歴"):
+        days = st.selectbox("期間", options=[7, 14, 30, 90], format_func=lambda d: f"直近 {d} 日", key='history_days')
+        history = get_run_history()
+        t0 = time.perf_counter()
+        recurring = history.recurring_shortages(days=days)
+        impact = history.customer_impact(days=days)
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        st.markdown("**繰り返し不足している商品**")
+        if recurring.empty:
+            st.caption("該当する商品はありません。")
+        else:
+            st.dataframe(recurring, use_container_width=True, hide_index=True)
+        st.markdown("**顧客別の不足影響**")
+        if impact.empty:
+            st.caption("該当する顧客はありません。")
+        else:
+            st.dataframe(impact, use_container_width=True, hide_index=True)
+        st.caption(f"実行日数: {history.run_days(days)} 日 / 検索時間: {elapsed_ms:.1f} ms")
+
+@st.cache_resource
+def get_ocr_job_queue():
+    """プロセス共通のOCRジョブキュー（起動時に保持期間を過ぎたジョブを整理する）"""
+    queue = OcrJobQueue(scheduled_pdf_order, metrics_factory=PdfMetrics)
+    try:
+        queue.compact()
+    except Exception as e:
+        logger.warning("OCRジョブの整理に失敗しました: %s", e)
+    return queue
+
+def submit_pdf_jobs(order_files):
+    """アップロードされたPDFをOCRジョブとして登録し、job_id のリストを返す"""
+    submitted = st.session_state.setdefault('ocr_jobs', {})
+    job_ids = []
+    for o_file in order_files:
+        if not o_file.name.lower().endswith('.pdf'):
+            continue
+        if o_file.file_id not in submitted:
+            submitted[o_file.file_id] = get_ocr_job_queue().submit(o_file.name, o_file.getbuffer(), owner=browser_owner())
+        job_ids.append(submitted[o_file.file_id])
+    return job_ids
+
+def select_restored_jobs(current_job_ids):
+    """このブラウザで再読み込み前に登録したOCRジョブを判定に含められるようにする"""
+    jobs = [j for j in get_ocr_job_queue().list_jobs(browser_owner())
+            if j['job_id'] not in current_job_ids and j['status'] != OCR_FAILED]
+    if not jobs:
+        return []
+    labels = {j['job_id']: f"{j['file_name']} ({j['created_at']} / {j['status']})" for j in jobs}
+    return st.multiselect(
+        "以前に登録したPDF（OCRジョブ）を含める",
+        options=list(labels),
+        format_func=labels.get,
+        key='restored_ocr_jobs'
+    )
+
+def has_active_jobs(job_ids):
+    queue = get_ocr_job_queue()
+    return any((queue.get(j) or {}).get('status') in OCR_ACTIVE_STATUSES for j in job_ids)
+
+def display_ocr_jobs(job_ids):
+    """OCRジョブの進捗を表示する（処理中のジョブがある間はポーリング）"""
+    polling = has_active_jobs(job_ids)
+
+    def render():
+        queue = get_ocr_job_queue()
+        labels = {OCR_QUEUED: '待機中', OCR_RUNNING: '処理中', OCR_DONE: '完了', OCR_FAILED: '失敗'}
+        for job_id in job_ids:
+            job = queue.get(job_id)
+            if job is None:
+                continue
+            total = job['pages_total']
+            ratio = job['pages_done'] / total if total else 0.0
+            if job['status'] == OCR_DONE:
+                ratio = 1.0
+            label = labels[job['status']]
+            if job['status'] == OCR_QUEUED:
+                label += f"・前に {queue.position(job_id)} 件"
+            st.progress(ratio, text=f"📄 {job['file_name']} — {label} ({job['pages_done']}/{total} ページ)")
+        # すべて完了したらアプリ全体を再実行して結果を取り込む
+        if polling and not has_active_jobs(job_ids):
+            st.rerun()
+
+    st.fragment(render, run_every=2 if polling else None)()
+
 def main():
     st.set_page_config(
         page_title="不足確認 | Smart Allocation v3",
@@ -486,6 +1221,7 @@ def main():
     )
     
     apply_custom_style()
+    get_stock_api()
     
     # Header Section
     st.markdown("""
@@ -496,6 +1232,10 @@ def main():
         </div>
     """, unsafe_allow_html=True)
     
+    # OCRモデルはバックグラウンドで事前に読み込んでおく
+    ocr_engine.start_warm_up()
+    display_ocr_readiness()
+    
     # File Uploader Section
     col1, col2 = st.columns(2)
     
@@ -503,12 +1243,14 @@ def main():
         st.markdown("""
             <div class="upload-title">📑 速報倉庫在庫ファイル</div>
         """, unsafe_allow_html=True)
-        inventory_file = st.file_uploader(
-            "Excel / CSV を選択",
+        inventory_files = st.file_uploader(
+            "Excel / CSV を選択 (複数可)",
             type=['xlsx', 'xls', 'csv'],
             key='inventory',
+            accept_multiple_files=True,
             label_visibility="collapsed"
         )
+        snapshot_version = select_inventory_snapshot(inventory_files)
     
     with col2:
         st.markdown("""
@@ -516,47 +1258,157 @@ def main():
         """, unsafe_allow_html=True)
         order_files = st.file_uploader(
             "ファイルを選択 (複数可)",
-            type=['txt', 'pdf'],
+            type=['txt', 'pdf', 'zip', 'gz', 'tgz', 'tar'],
             key='order',
             accept_multiple_files=True,
             label_visibility="collapsed"
         )
     
+    # 大きなファイルはメモリ上で複製せず、一時ファイルからパス・メモリマップで読む
+    inventory_files, order_files = spool_uploads(inventory_files or [], order_files or [])
+    
+    # PDFはアップロード時点でバックグラウンドOCRジョブとして登録する
+    pdf_job_ids = submit_pdf_jobs(order_files or [])
+    restored_job_ids = select_restored_jobs(pdf_job_ids)
+    job_ids = pdf_job_ids + restored_job_ids
+    if job_ids:
+        display_ocr_jobs(job_ids)
+    
     st.markdown("<br>", unsafe_allow_html=True)
     
     # Action Button
-    if st.button("🔍 不足確認", type="primary", use_container_width=True):
-        if not inventory_file:
+    clicked = st.button("🔍 不足確認", type="primary", use_container_width=True)
+    # OCR完了待ちの判定は、ジョブ完了後に自動で再実行する
+    auto_recheck = st.session_state.get('ocr_recheck', False) and not has_active_jobs(job_ids)
+    if clicked or auto_recheck:
+        st.session_state['ocr_recheck'] = False
+        if not inventory_files and not snapshot_version:
             st.error("倉庫在庫ファイルをアップロードしてください。")
             return
-        if not order_files:
+        if not order_files and not restored_job_ids:
             st.error("受注ファイルを1つ以上アップロードしてください。")
             return
         
+        # プロファイルモード（ALLOCATION_PROFILE=1 / ?profile=1）ではステージごとに計測する
+        profiler = start_profiler(st.query_params)
         try:
             with st.spinner("データを解析中..."):
-                # 倉庫在庫読み込み
-                inventory_df = load_inventory_file(inventory_file)
+                # 同時実行数とメモリを見て順番に読み込む
+                wait_status = st.empty()
                 
-                # 受注ファイル読み込み（複数対応）
+                # 倉庫在庫読み込み（同じファイルは全セッションで共有のスナップショットを使う）
+                with profiler.stage('在庫読み込み'):
+                    snapshot = load_inventory_snapshot(inventory_files, snapshot_version, wait_status)
+                    inventory_df = snapshot.to_frame()
+                
+                # 受注ファイル読み込み（複数対応）。1ファイルごとに暫定の不足を表示する
+                tabular_files = [f for f in order_files if not f.name.lower().endswith('.pdf')]
+                running = RunningTotals(inventory_df)
+                dedup = OrderDeduplicator()
+                provisional = st.empty()
+                # アーカイブはメンバー数が分かった時点で数に加える
+                total_files = sum(not is_archive(f.name) for f in tabular_files) + len(job_ids)
                 order_dfs = []
-                for o_file in order_files:
-                    if o_file.name.lower().endswith('.pdf'):
-                        order_dfs.append(process_pdf_order(o_file))
-                    else:
-                        order_dfs.append(load_order_file(o_file))
+                archive_reports = []
+                with profiler.stage('受注読み込み'):
+                    for o_file in tabular_files:
+                        if is_archive(o_file.name):
+                            members = []
+                            for member in load_order_archive(o_file, wait_status):
+                                members.append(member)
+                                if member.df is None:
+                                    continue
+                                total_files += 1
+                                order_dfs.append(dedup.add(member.df, f"{o_file.name}/{member.name}", member.digest))
+                                running.add(order_dfs[-1])
+                                display_provisional(provisional, running, total_files)
+                            archive_reports.append(archive_report(o_file.name, members))
+                            continue
+                        order_df = run_tabular(load_order_file, o_file, wait_status)
+                        order_dfs.append(dedup.add(order_df, o_file.name, file_digest(o_file)))
+                        running.add(order_dfs[-1])
+                        display_provisional(provisional, running, total_files)
                 
-                # 受注データの結合
-                combined_order_df = pd.concat(order_dfs, ignore_index=True)
+                # 完了済みOCRジョブの結果を取り込む
+                queue = get_ocr_job_queue()
+                pdf_metrics = []
+                pending = []
+                with profiler.stage('OCR結果取り込み'):
+                    for job_id in job_ids:
+                        job = queue.get(job_id)
+                        if job is None:
+                            continue
+                        if job['status'] == OCR_DONE:
+                            if job['error']:
+                                # 完了したジョブの error はページ単位の警告（OCRに失敗したページなど）
+                                st.warning(f"PDFファイル（{job['file_name']}）:  \n" + job['error'].replace('\n', '  \n'))
+                            job_metrics = queue.take_metrics(job_id)
+                            if job_metrics is not None:
+                                pdf_metrics.append(job_metrics)
+                            result_df = queue.result(job_id)
+                            if result_df.empty:
+                                st.warning(f"PDFファイル（{job['file_name']}）から受注明細を抽出できませんでした。")
+                                continue
+                            # 同じ内容のPDFは同じジョブになるので、job_id をダイジェストとして使う
+                            order_dfs.append(dedup.add(result_df, job['file_name'], f"ocr:{job_id}"))
+                            running.add(order_dfs[-1])
+                            display_provisional(provisional, running, total_files)
+                        elif job['status'] == OCR_FAILED:
+                            queue.take_metrics(job_id)
+                            st.error(f"PDFファイルの読み込みエラー ({job['file_name']}): {job['error']}")
+                        else:
+                            pending.append(job['file_name'])
                 
-                # 引当計算
-                allocation_df = calculate_allocation(inventory_df, combined_order_df)
+                display_archive_reports(archive_reports)
+                display_dedup_report(dedup)
+                if pending:
+                    st.session_state['ocr_recheck'] = True
+                if not order_dfs:
+                    st.info("PDFのOCR処理が完了すると自動で不足確認を実行します。")
+                    return
+                if pending:
+                    st.warning(f"OCR処理中のPDF（{', '.join(pending)}）を除いて判定しています。完了後に自動で再判定します。")
                 
-            # 結果表示
-            display_results(allocation_df, combined_order_df)
+                # 受注データの結合・引当計算
+                with profiler.stage('引当計算'):
+                    # 結合した受注明細はセッションにも残すので、カテゴリ型・int32 で保持する
+                    raw_order_df = pd.concat(order_dfs, ignore_index=True)
+                    combined_order_df = compact_order_frame(raw_order_df)
+                    report = order_memory_report(raw_order_df, combined_order_df)
+                    logger.info("受注明細 %s 行: %.0f -> %.0f バイト/明細", f"{report['明細数']:,}",
+                                report['変換前(バイト/明細)'], report['変換後(バイト/明細)'])
+                    del raw_order_df
+                    allocation_df = calculate_allocation(inventory_df, combined_order_df)
+                
+            # 結果表示（暫定結果は確定結果に置き換える）
+            provisional.empty()
+            with profiler.stage('結果表示'):
+                display_results(allocation_df, combined_order_df)
+            display_pdf_metrics(pdf_metrics)
+            record_run_history(allocation_df, combined_order_df, snapshot, order_files, pdf_metrics)
+            
+            # 差分適用・シミュレーション用に、引当状態を配列としてセッションに保持する
+            st.session_state['allocation_state'] = AllocationState.build(snapshot.to_frame(detail=True), combined_order_df)
+            st.session_state['allocation_orders'] = combined_order_df
+            st.session_state['applied_deltas'] = set()
+            # 顧客別の不足影響は受注の疎行列から求める（1回の判定につき1回作る）
+            st.session_state['demand_matrix'] = DemandMatrix.build(combined_order_df)
+            st.session_state['allocation_result'] = allocation_df
+            publish_allocation(st.session_state['allocation_state'], snapshot.label)
             
         except Exception as e:
             st.error(f"エラー: {str(e)}")
+        finally:
+            profiler.stop()
+            display_profile(profiler)
+    
+    display_watch_report()
+    display_delta_panel()
+    display_whatif_panel()
+    display_rationing_panel()
+    display_inbound_projection()
+    display_customer_exposure()
+    display_run_history()
     
     # Documentation
     with st.expander("📖 システム仕様・使用方法"):
@@ -565,8 +1417,8 @@ def main():
         このツールは、最新の倉庫在庫データと1つ以上の受注ファイルを照合し、在庫が不足している商品を即座に特定します。
         
         ### 📂 対応ファイル形式
-        - **倉庫在庫**: `.xlsx`, `.csv` (保管場所 `A309001` が対象)
-        - **受注ファイル**: `.txt` (タブ区切り形式, 複数ファイルの一括処理に対応)
+        - **倉庫在庫**: `.xlsx`, `.csv` (保管場所 `A309001` が対象, エリア別の複数ファイルは商品コードごとに合算)
+        - **受注ファイル**: `.txt` (タブ区切り形式, 複数ファイルの一括処理に対応。`.zip` / `.tar.gz` にまとめた `.txt` も可。列はヘッダーの列名で特定し、見つからない項目は従来の列位置を使用)
         
         ### 🛠️ 自動処理プロセス
         1. **入庫予定加算**: `倉庫在庫数 + (入庫予定 × 入数)` で実質在庫を算出
@@ -574,6 +1426,24 @@ def main():
         3. **特定商品除外**: 商品コード `30126` を自動的に除外
         4. **正規化**: 商品コードの先頭ゼロを自動削除し、突合精度を向上
         5. **一括集計**: 複数アップロードされた受注ファイル内の同一商品を自動で合算
+        6. **重複除外**: 同じ受注ファイルや、伝票番号・商品コードが重複する明細は1回だけ計上
+
+        ### ⚖️ 不足商品の配分
+        不足商品の在庫を、受注数量に比例・優先顧客順・最低数を確保して比例 のいずれかで伝票（または顧客）ごとに配分し、割当数と不足数を表示します。
+
+        ### 📅 入庫予定日による解消見込み
+        判定後に入庫予定ファイル（商品コード・入庫日・入庫数またはケース数）を読み込むと、不足商品ごとに不足が解消する日を表示します。
+
+        ### 📂 監視フォルダ
+        `python watch_daemon.py <フォルダ>` を起動すると、フォルダに届いた在庫（`.csv` / `.xlsx`）・受注（`.txt`）ファイルを
+        新規・更新分だけ取り込み、不足一覧を `<フォルダ>/report` に書き出します。`WATCH_REPORT_DIR` にその出力先を設定すると、ここに最新結果を表示します。
+
+        ### 📡 在庫照会API
+        直近の判定結果（差分適用後）を `http://<ホスト>:8766/stock/<商品コード>?owner=<所有者ID>` で照会できます
+        （所有者IDはこの画面の URL の `owner=` の値。公開中の結果が1つだけなら省略可）。
+        一括照会は `POST /stock/lookup` に `{"codes": [...]}` を送信します（`STOCK_API_PORT` / `STOCK_API_HOST` で変更、`off` で無効）。
+        Cloud Run ではアプリのポート（8080）しか公開されないため、このAPIは社内サーバー・Docker で
+        `-p 8766:8766` と `STOCK_API_HOST=0.0.0.0` を指定した場合に利用できます。
         """)
 
 if __name__ == "__main__":
@@ -0,0 +1,207 @@
+"""TSV/Excel 引当パスのスループットベンチマーク
+
+synth_data で生成した受注TSV・在庫ファイルを規模ごとに用意し（bench_data/ にキャッシュ）、
+load_inventory_file / load_order_file / calculate_allocation / build_shortage_table の
+経過時間とピークRSS（ステージ中の最大値 - 開始時の値）を計測する。
+ベースラインと比較し、閾値を超えて劣化した場合、または不足商品が正解と一致しない場合は
+終了コード 1 で失敗する。計測した規模のベースラインがない場合は、比較できないので終了コード 2 で失敗する。
+
+時間・RSS はマシンに依存するので、ベースラインはリポジトリに含めない。計測するマシン（CI なら同じ
+ランナー）で --update-baseline により作成し、--baseline または BENCH_ALLOCATION_BASELINE で
+その場所を指定する（CI ではキャッシュ・アーティファクトから復元したファイルを渡す）。
+既定は bench_allocation_baseline.json（ocr_benchmark.py と同じ扱い）。
+
+    python bench_allocation.py                          # 10k / 100k / 1M 行
+    python bench_allocation.py --scales 10000000 --skus 200000
+    python bench_allocation.py --update-baseline
+    BENCH_ALLOCATION_BASELINE=/cache/bench_allocation_baseline.json python bench_allocation.py
+"""
+import argparse
+import json
+import mmap
+import os
+import sys
+import threading
+import time
+
+from profiling import current_rss_bytes
+from synth_data import generate_dataset
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.environ.get('BENCH_ALLOCATION_BASELINE', os.path.join(BASE_DIR, 'bench_allocation_baseline.json'))
+DATA_DIR = os.path.join(BASE_DIR, 'bench_data')
+DEFAULT_SCALES = (10_000, 100_000, 1_000_000)
+STAGES = ('load_inventory_file', 'load_order_file', 'calculate_allocation', 'build_shortage_table')
+
+# 劣化とみなす閾値（相対増加）。小さい規模はぶれが大きいので時間の下限も設ける
+DEFAULT_THRESHOLDS = {
+    'seconds_increase': 0.30,
+    'rss_increase': 0.30,
+    'min_seconds': 0.05,
+    'min_rss_mb': 16,
+}
+
+
+class LocalFile:
+    """UploadedFile 互換（ディスク上のファイルをパス・メモリマップで読む。退避済みアップロードと同じ経路）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = os.path.getsize(path)
+
+    def getbuffer(self):
+        with open(self.path, 'rb') as f:
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class PeakRss:
+    """ステージ中の RSS をサンプリングし、開始時からの最大増加量を記録する"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak_delta = 0
+
+    def __enter__(self):
+        self._start = current_rss_bytes() or 0
+        self._peak = self._start
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, current_rss_bytes() or 0)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._peak = max(self._peak, current_rss_bytes() or 0)
+        self.peak_delta = self._peak - self._start
+        return False
+
+
+def measure(fn, *args):
+    with PeakRss() as rss:
+        t0 = time.perf_counter()
+        result = fn(*args)
+        seconds = time.perf_counter() - t0
+    return result, {'seconds': seconds, 'peak_rss_mb': rss.peak_delta / 1024 / 1024}
+
+
+def dataset_for(scale, skus, seed, inventory_format):
+    n_skus = skus or max(1_000, scale // 50)
+    # 生成済みなら再利用する（正解は別ファイルに保存）
+    truth_path = os.path.join(DATA_DIR, f'expected_{scale}_{n_skus}_{seed}.json')
+    if os.path.exists(truth_path):
+        with open(truth_path, encoding='utf-8') as f:
+            dataset = json.load(f)
+        if all(os.path.exists(dataset[k]) for k in ('orders', 'inventory')) and dataset['inventory'].endswith(inventory_format):
+            return dataset
+    dataset = generate_dataset(DATA_DIR, scale, n_skus, seed=seed, inventory_format=inventory_format)
+    with open(truth_path, 'w', encoding='utf-8') as f:
+        json.dump(dataset, f, ensure_ascii=False)
+    return dataset
+
+
+def run_scale(scale, skus=None, seed=0, inventory_format='csv'):
+    from app import build_shortage_table, calculate_allocation, load_inventory_file, load_order_file
+
+    dataset = dataset_for(scale, skus, seed, inventory_format)
+    stages = {}
+    inventory_df, stages['load_inventory_file'] = measure(load_inventory_file, LocalFile(dataset['inventory']))
+    order_df, stages['load_order_file'] = measure(load_order_file, LocalFile(dataset['orders']))
+    allocation_df, stages['calculate_allocation'] = measure(calculate_allocation, inventory_df, order_df)
+    shortage_df = allocation_df[(allocation_df['引当後在庫'] < 0) & (allocation_df['商品コード'] != '19005')]
+    table, stages['build_shortage_table'] = measure(build_shortage_table, shortage_df, order_df)
+    total = sum(s['seconds'] for s in stages.values())
+    return {
+        'rows': scale,
+        'inventory_format': inventory_format,
+        'stages': stages,
+        'seconds': total,
+        'rows_per_sec': scale / total if total else 0.0,
+        'shortages': len(shortage_df),
+        'shortage_lines': len(table),
+        'correct': sorted(shortage_df['商品コード']) == dataset['expected_shortages'],
+    }
+
+
+def find_regressions(results, baseline, thresholds=None):
+    """規模・ステージごとにベースラインと比較し、劣化のメッセージ一覧を返す"""
+    thresholds = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+    failures = []
+    for result in results:
+        if not result['correct']:
+            failures.append(f"{result['rows']:,} rows: shortage list does not match the generated truth")
+        base = baseline.get('scales', {}).get(str(result['rows']))
+        if not base:
+            continue
+        for stage, now in result['stages'].items():
+            before = base['stages'].get(stage)
+            if not before:
+                continue
+            limit = max(before['seconds'] * (1 + thresholds['seconds_increase']), thresholds['min_seconds'])
+            if now['seconds'] > limit:
+                failures.append(f"{result['rows']:,} rows {stage}: {now['seconds']:.3f}s (baseline {before['seconds']:.3f}s)")
+            limit = max(before['peak_rss_mb'] * (1 + thresholds['rss_increase']), thresholds['min_rss_mb'])
+            if now['peak_rss_mb'] > limit:
+                failures.append(f"{result['rows']:,} rows {stage}: {now['peak_rss_mb']:.1f}MB (baseline {before['peak_rss_mb']:.1f}MB)")
+    return failures
+
+
+def print_report(results):
+    print(f"{'rows':>12}  {'stage':<22}{'sec':>9}{'peak MB':>10}")
+    for result in results:
+        for stage in STAGES:
+            s = result['stages'][stage]
+            print(f"{result['rows']:>12,}  {stage:<22}{s['seconds']:>9.3f}{s['peak_rss_mb']:>10.1f}")
+        print(f"{'':>12}  {'total':<22}{result['seconds']:>9.3f}  ({result['rows_per_sec']:,.0f} rows/s, "
+              f"{result['shortages']:,} shortages, correct={result['correct']})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='TSV/Excel allocation throughput benchmark')
+    parser.add_argument('--scales', type=int, nargs='+', default=list(DEFAULT_SCALES), help='受注行数（複数可）')
+    parser.add_argument('--skus', type=int, help='SKU 数（既定は行数 / 50、最低 1000）')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv', help='在庫ファイルの形式')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = [run_scale(scale, args.skus, args.seed, args.format) for scale in args.scales]
+    print_report(results)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    if args.update_baseline:
+        scales = baseline.setdefault('scales', {})
+        for result in results:
+            scales[str(result['rows'])] = {'stages': result['stages'], 'inventory_format': result['inventory_format']}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"baseline updated: {args.baseline}")
+        return 0
+
+    failures = find_regressions(results, baseline, baseline.get('thresholds'))
+    if failures:
+        print("REGRESSION:")
+        for msg in failures:
+            print(f"  {msg}")
+        return 1
+    missing = [result['rows'] for result in results if str(result['rows']) not in baseline.get('scales', {})]
+    if missing:
+        # 比較できないまま成功扱いにすると、CI で劣化を見逃す
+        print(f"baseline not found for {', '.join(f'{rows:,}' for rows in missing)} rows in {args.baseline}; "
+              "run with --update-baseline to create one")
+        return 2
+    print("OK: no regression against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""顧客 × 商品の疎行列（demand_matrix.DemandMatrix）のベンチマーク
+
+合成した受注明細（既定 200 万行、10 万顧客 × 5 万商品、10 商品に 1 つが受注の半分だけ不足）から、
+行列の作成と顧客別の不足影響（customer_exposure）にかかる時間を計測する。
+次の条件を満たさない場合は終了コード 1。
+
+- 行列の形が 顧客数 × 商品数
+- 顧客別の結果が不足明細数の多い順
+- 按分した不足数の合計が商品ごとの不足数の合計と一致する（丸め誤差の範囲）
+- customer_exposure の計測時間が --max-seconds 以内
+
+    python bench_demand_matrix.py
+    python bench_demand_matrix.py --lines 10000000 --customers 500000 --max-seconds 5
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from demand_matrix import DemandMatrix
+
+
+def make_data(n_lines, n_customers, n_skus, seed=0):
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(0, n_skus, n_lines)
+    order_df = pd.DataFrame({
+        '顧客コード': rng.integers(0, n_customers, n_lines),
+        '顧客名': '顧客',
+        '商品コード': codes,
+        '発注数量': rng.integers(1, 10, n_lines),
+    })
+    ordered = np.bincount(codes, weights=order_df['発注数量'], minlength=n_skus)
+    allocation_df = pd.DataFrame({
+        '商品コード': np.arange(n_skus).astype(str),
+        '受注合計数': ordered,
+        '引当後在庫': np.where(np.arange(n_skus) % 10 == 0, -ordered // 2, 1),
+    })
+    return order_df, allocation_df
+
+
+def check(matrix, exposure, allocation_df, n_skus):
+    failures = []
+    if matrix.shape[1] != n_skus or len(exposure) != matrix.shape[0]:
+        failures.append(f"行列の形が {matrix.shape}、結果が {len(exposure):,} 行です（商品数 {n_skus:,}）")
+    if not (np.diff(exposure['不足明細数'].to_numpy()) <= 0).all():
+        failures.append("顧客別の結果が不足明細数の多い順になっていません")
+    expected = -allocation_df['引当後在庫'].clip(upper=0).sum()
+    # 顧客ごとに小数 1 桁で丸めるので、誤差は顧客数 × 0.05 まで
+    if abs(exposure['不足数(按分)'].sum() - expected) > 0.05 * len(exposure) + 1e-6:
+        failures.append(f"按分した不足数の合計 {exposure['不足数(按分)'].sum():,.1f} が不足数の合計 {expected:,.0f} と一致しません")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='demand matrix customer exposure benchmark')
+    parser.add_argument('--lines', type=int, default=2_000_000)
+    parser.add_argument('--customers', type=int, default=100_000)
+    parser.add_argument('--skus', type=int, default=50_000)
+    parser.add_argument('--max-seconds', type=float, default=1.0, help='customer_exposure の許容時間（秒）')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    order_df, allocation_df = make_data(args.lines, args.customers, args.skus, args.seed)
+    t0 = time.perf_counter()
+    matrix = DemandMatrix.build(order_df)
+    build_seconds = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    exposure = matrix.customer_exposure(allocation_df)
+    seconds = time.perf_counter() - t0
+    print(f"明細: {args.lines:,} 行 / 顧客: {matrix.shape[0]:,} / 商品: {matrix.shape[1]:,}")
+    print(f"build             {build_seconds:>8.3f} 秒")
+    print(f"customer_exposure {seconds:>8.3f} 秒  不足のある顧客 {(exposure['不足明細数'] > 0).sum():,}")
+
+    failures = check(matrix, exposure, allocation_df, args.skus)
+    if seconds > args.max_seconds:
+        failures.append(f"計測時間 {seconds:.3f} 秒が上限 {args.max_seconds:.3f} 秒を超えています")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""入庫予定による在庫推移（inbound_schedule.project）のベンチマーク
+
+合成した商品（既定 10 万商品、1 商品 1 明細）と入庫予定（既定 20 万行、開始日から 40 日の範囲）から、
+推移の計算と不足一覧の作成にかかる時間を計測する。次の条件を満たさない場合は終了コード 1。
+
+- 推移の配列が 商品数 × (期間 + 1) 日
+- 解消日のある不足商品は、解消までの日数が 1 日以上（当日に解消するなら不足ではない）
+- 計測時間が --max-seconds 以内
+
+    python bench_inbound_schedule.py
+    python bench_inbound_schedule.py --products 1000000 --schedule-rows 2000000 --max-seconds 10
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from allocation_state import AllocationState
+from inbound_schedule import DEFAULT_HORIZON_DAYS, project
+
+START = '2026-10-19'
+
+
+def make_data(n_products, n_schedule_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    codes = np.arange(n_products).astype(str)
+    inventory_df = pd.DataFrame({'商品コード': codes, '商品名カナ': 'ｼｮｳﾋﾝ', '倉庫在庫数': rng.integers(0, 50, n_products),
+                                 '入庫予定数': 0, '入数': 6})
+    order_df = pd.DataFrame({'伝票番号': '5001', '顧客名': '顧客', '商品コード': codes,
+                             '商品名漢字': '商品', '商品名カナ': 'ｼｮｳﾋﾝ', '発注数量': rng.integers(1, 60, n_products)})
+    state = AllocationState.build(inventory_df, order_df)
+    schedule = pd.DataFrame({
+        '商品コード': codes[rng.integers(0, n_products, n_schedule_rows)],
+        '入庫日': pd.Timestamp(START) + pd.to_timedelta(rng.integers(0, 40, n_schedule_rows), unit='D'),
+        '入庫数': 0,
+        'ケース数': rng.integers(1, 5, n_schedule_rows),
+    })
+    return state, schedule
+
+
+def check(projection, result, n_products, horizon):
+    failures = []
+    if projection.stock.shape != (n_products, horizon + 1):
+        failures.append(f"推移の配列の形が {projection.stock.shape} です（期待値 {(n_products, horizon + 1)}）")
+    cleared = result.dropna(subset=['解消までの日数'])
+    if not (cleared['解消までの日数'] > 0).all():
+        failures.append("当日に解消する商品が不足一覧に含まれています")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='inbound schedule projection benchmark')
+    parser.add_argument('--products', type=int, default=100_000)
+    parser.add_argument('--schedule-rows', type=int, default=200_000)
+    parser.add_argument('--horizon', type=int, default=DEFAULT_HORIZON_DAYS)
+    parser.add_argument('--max-seconds', type=float, default=1.0, help='許容する計測時間（秒）')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    state, schedule = make_data(args.products, args.schedule_rows, args.seed)
+    t0 = time.perf_counter()
+    projection = project(state, schedule, start=START, horizon=args.horizon)
+    result = projection.shortages_frame()
+    seconds = time.perf_counter() - t0
+    print(f"商品数: {args.products:,} / 予定: {args.schedule_rows:,} 行 / {args.horizon + 1} 日")
+    print(f"project + shortages_frame {seconds:>8.3f} 秒  不足商品 {len(result):,}")
+
+    failures = check(projection, result, args.products, args.horizon)
+    if seconds > args.max_seconds:
+        failures.append(f"計測時間 {seconds:.3f} 秒が上限 {args.max_seconds:.3f} 秒を超えています")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
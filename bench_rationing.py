@@ -0,0 +1,88 @@
+"""不足商品の配分（rationing.ration）のベンチマーク
+
+合成した受注明細（既定 100 万明細）と、受注のある商品の shortage_rate（既定 10%）が
+不足になる在庫表から、方針ごとの配分時間を計測する。次の条件を満たさない場合は終了コード 1。
+
+- 割当数は 0 以上かつ受注数以下
+- 商品ごとの割当数の合計 = 利用可能な在庫（不足商品なので在庫はすべて配分される）
+
+    python bench_rationing.py
+    python bench_rationing.py --rows 5000000 --skus 100000 --unit 顧客コード
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from app import calculate_allocation
+from rationing import MINIMUM, POLICY_LABELS, PRIORITY, UNITS, ration
+
+
+def make_data(n_rows, n_skus, shortage_rate=0.1, lines_per_slip=8, seed=0):
+    rng = np.random.default_rng(seed)
+    n_customers = max(100, n_rows // 200)
+    slip = np.arange(n_rows) // lines_per_slip
+    customer = rng.integers(0, n_customers, n_rows // lines_per_slip + 1)[slip]
+    sku = rng.integers(0, n_skus, n_rows)
+    quantity = rng.integers(1, 24, n_rows)
+    order_df = pd.DataFrame({
+        '顧客コード': pd.Categorical(np.char.add('C', customer.astype(str))),
+        '顧客名': pd.Categorical(np.char.add('顧客', customer.astype(str))),
+        '伝票番号': pd.Categorical((500000 + slip).astype(str)),
+        '商品コード': pd.Categorical((100000 + sku).astype(str)),
+        '商品名漢字': '商品',
+        '商品名カナ': 'ｼｮｳﾋﾝ',
+        '発注数量': quantity.astype(np.int32),
+    })
+    totals = np.bincount(sku, weights=quantity, minlength=n_skus).astype(np.int64)
+    short = rng.random(n_skus) < shortage_rate
+    stock = np.where(short, (totals * rng.uniform(0, 0.9, n_skus)).astype(np.int64), totals + rng.integers(0, 50, n_skus))
+    inventory_df = pd.DataFrame({'商品コード': (100000 + np.arange(n_skus)).astype(str), '倉庫在庫数': stock})
+    return inventory_df, order_df
+
+
+def check(result, allocation_df):
+    failures = []
+    if (result['割当数'] < 0).any() or (result['割当数'] > result['受注数']).any():
+        failures.append("割当数が 0 未満または受注数を超えています")
+    short = allocation_df[(allocation_df['引当後在庫'] < 0) & (allocation_df['商品コード'] != '19005')]
+    allocated = result.groupby('商品コード')['割当数'].sum()
+    expected = short.set_index('商品コード')['倉庫在庫数'].clip(lower=0)
+    if not allocated.reindex(expected.index, fill_value=0).equals(expected.astype(allocated.dtype)):
+        failures.append("商品ごとの割当数の合計が利用可能な在庫と一致しません")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='rationed allocation benchmark')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--skus', type=int, default=20_000)
+    parser.add_argument('--shortage-rate', type=float, default=0.1)
+    parser.add_argument('--unit', choices=UNITS, default='伝票番号')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    inventory_df, order_df = make_data(args.rows, args.skus, args.shortage_rate, seed=args.seed)
+    allocation_df = calculate_allocation(inventory_df, order_df)
+    n_short = int(((allocation_df['引当後在庫'] < 0) & (allocation_df['商品コード'] != '19005')).sum())
+    print(f"明細数: {len(order_df):,} / 商品数: {args.skus:,} / 不足商品: {n_short:,}")
+
+    priority = [f'C{i}' for i in range(0, 1000, 7)]
+    failures = []
+    for policy in POLICY_LABELS:
+        t0 = time.perf_counter()
+        result = ration(allocation_df, order_df, policy=policy, unit=args.unit,
+                        priority=priority if policy == PRIORITY else (), minimum=2 if policy == MINIMUM else 1)
+        seconds = time.perf_counter() - t0
+        print(f"{policy:<13}{seconds:>8.3f} 秒  {len(result):,} 行  不足数 {int(result['不足数'].sum()):,}")
+        failures += [f"{policy}: {message}" for message in check(result, allocation_df)]
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""顧客 × 商品の受注数量の疎行列と、顧客別の不足影響
+
+不足確認のたびに受注明細から 顧客コード × 商品コード の疎行列（受注数量・明細数）を1回作り、
+商品ごとの不足率のベクトルとの積で顧客別の影響を求める。不足数は商品ごとに、
+各顧客の受注数量に比例して割り当てた按分値（引当順は考慮しない）。
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+SPECIAL_CODE = '19005'
+
+
+def _factorize(values):
+    """(行番号, 文字列の値一覧) を返す。カテゴリ型（compact_order_frame）は整数コードをそのまま使う"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.cat.remove_unused_categories()
+        labels = values.cat.categories.astype(str)
+        if labels.is_unique and not values.isna().any():
+            return values.cat.codes.to_numpy(np.int32), labels.to_numpy(object)
+    codes, labels = pd.factorize(values.astype(str), sort=True)
+    return codes.astype(np.int32), np.asarray(labels, dtype=object)
+
+
+class DemandMatrix:
+    """顧客 × 商品の受注数量（quantity）と明細数（lines）"""
+
+    def __init__(self, customers, customer_names, products, quantity, lines):
+        self.customers = customers
+        self.customer_names = customer_names
+        self.products = products
+        self.quantity = quantity
+        self.lines = lines
+        # 顧客が商品を注文しているか（0/1）
+        self.presence = lines.copy()
+        self.presence.data[:] = 1
+        self.product_index = pd.Index(products)
+
+    @classmethod
+    def build(cls, order_df):
+        rows, customers = _factorize(order_df['顧客コード'])
+        cols, products = _factorize(order_df['商品コード'])
+        shape = (len(customers), len(products))
+        # 同じ顧客・商品の明細は COO -> CSR 変換で合算される
+        quantity = sparse.csr_matrix((order_df['発注数量'].to_numpy(np.int64), (rows, cols)), shape=shape)
+        lines = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=shape)
+        names = (pd.Series(order_df['顧客名'].astype(str).to_numpy()).groupby(rows).first()
+                 .reindex(range(shape[0])).fillna('').to_numpy(object))
+        return cls(customers, names, products, quantity, lines)
+
+    @property
+    def shape(self):
+        return self.quantity.shape
+
+    def shortage_vectors(self, allocation_df):
+        """商品ごとの (不足あり, 不足率 = 不足数 / 受注合計数) を行列の列順で返す"""
+        short = allocation_df[(allocation_df['引当後在庫'] < 0) & (allocation_df['商品コード'] != SPECIAL_CODE)]
+        idx = self.product_index.get_indexer(short['商品コード'].astype(str))
+        found = idx >= 0
+        is_short = np.zeros(self.shape[1], dtype=bool)
+        ratio = np.zeros(self.shape[1])
+        is_short[idx[found]] = True
+        ratio[idx[found]] = (-short['引当後在庫'].to_numpy(float) / short['受注合計数'].to_numpy(float))[found]
+        return is_short, np.minimum(ratio, 1.0)
+
+    def customer_exposure(self, allocation_df):
+        """顧客別の不足影響（不足明細数・按分不足数の多い順）"""
+        is_short, ratio = self.shortage_vectors(allocation_df)
+        ordered = np.asarray(self.quantity.sum(axis=1)).ravel()
+        short_qty = self.quantity @ ratio
+        short_lines = self.lines @ is_short.astype(np.int32)
+        short_products = self.presence @ is_short.astype(np.int32)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fill_rate = np.where(ordered > 0, 1 - short_qty / ordered, 1.0)
+        result = pd.DataFrame({
+            '顧客コード': self.customers,
+            '顧客名': self.customer_names,
+            '受注明細数': np.asarray(self.lines.sum(axis=1)).ravel(),
+            '受注数量': ordered,
+            '不足商品数': short_products,
+            '不足明細数': short_lines,
+            '不足数(按分)': np.round(short_qty, 1),
+            '充足率': fill_rate,
+        })
+        return result.sort_values(['不足明細数', '不足数(按分)', '顧客コード'], ascending=[False, False, True],
+                                  kind='stable').reset_index(drop=True)
+
+    def customer_shortages(self, customer_code, allocation_df):
+        """1顧客の不足商品ごとの受注数量と按分不足数"""
+        row = np.flatnonzero(self.customers == str(customer_code))
+        if len(row) == 0:
+            return pd.DataFrame(columns=['商品コード', '受注数量', '不足数(按分)'])
+        is_short, ratio = self.shortage_vectors(allocation_df)
+        demand = self.quantity.getrow(row[0])
+        cols, qty = demand.indices, demand.data
+        mask = is_short[cols]
+        return pd.DataFrame({
+            '商品コード': self.products[cols[mask]],
+            '受注数量': qty[mask],
+            '不足数(按分)': np.round(qty[mask] * ratio[cols[mask]], 1),
+        }).sort_values('不足数(按分)', ascending=False).reset_index(drop=True)
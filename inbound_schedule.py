@@ -0,0 +1,152 @@
+"""入庫予定日による在庫の推移と不足の解消見込み
+
+日付付きの入庫予定（商品コード・入庫日・入庫数またはケース数）を読み込み、
+商品 × 日 の配列で入庫の累計（cumsum）と受注の累計を求め、不足商品ごとに
+不足が解消する最初の日を返す。
+
+在庫ファイルの入庫予定（日付なし）は、日付付きの予定がある商品では予定で置き換え、
+予定のない商品では従来どおり当日に入庫する扱いにする。受注はすべて当日の需要。
+入庫日が開始日より前の予定は当日入庫、期間外の予定は推移に含めない。
+"""
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+# 入庫予定ファイルの列名（別名を含む）。入庫数は受注数量などと取り違えないよう「数量」では認めない
+SCHEDULE_COLUMNS = {
+    '商品コード': ('商品コード', '品目コード', 'code'),
+    '入庫日': ('入庫日', '入庫予定日', '入荷日', '入荷予定日', '納期', 'date'),
+    '入庫数': ('入庫数', '入荷数'),
+    'ケース数': ('ケース数', '入庫予定', '入庫ケース数', 'cases'),
+}
+
+DEFAULT_HORIZON_DAYS = 30
+
+
+class ScheduleError(ValueError):
+    """入庫予定ファイルの形式エラー"""
+
+
+def read_schedule_file(file):
+    """入庫予定ファイル（csv / txt / xlsx、ヘッダー付き）を 商品コード・入庫日・入庫数・ケース数 の表にする
+
+    入庫数は個数、ケース数は入数を掛けて個数にする（両方ある行は合計）。
+    """
+    name = file.name.lower()
+    if name.endswith(('.xlsx', '.xls')):
+        raw = pd.read_excel(file, dtype=str)
+    else:
+        raw = None
+        for encoding in ('utf-8-sig', 'cp932'):
+            try:
+                if hasattr(file, 'seek'):
+                    file.seek(0)
+                raw = pd.read_csv(file, dtype=str, sep=None, engine='python', encoding=encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+        if raw is None:
+            raise ScheduleError("入庫予定ファイルの文字コードを判別できません。")
+    raw.columns = [str(c).strip() for c in raw.columns]
+    found = {column: next((a for a in aliases if a in raw.columns), None) for column, aliases in SCHEDULE_COLUMNS.items()}
+    if found['商品コード'] is None or found['入庫日'] is None:
+        raise ScheduleError("入庫予定ファイルに「商品コード」と「入庫日」の列が必要です。")
+    if found['入庫数'] is None and found['ケース数'] is None:
+        raise ScheduleError("入庫予定ファイルに「入庫数」または「ケース数」列がありません。")
+    schedule = pd.DataFrame({
+        '商品コード': raw[found['商品コード']].astype(str).str.strip().str.lstrip('0'),
+        '入庫日': pd.to_datetime(raw[found['入庫日']], errors='coerce', format='mixed').dt.normalize(),
+    })
+    for column in ('入庫数', 'ケース数'):
+        values = raw[found[column]] if found[column] else None
+        schedule[column] = pd.to_numeric(values, errors='coerce').fillna(0).astype(np.int64) if values is not None else 0
+    invalid = schedule['入庫日'].isna() | (schedule['商品コード'] == '')
+    if invalid.all() and len(schedule):
+        raise ScheduleError("入庫日を日付として読み取れる行がありません。")
+    return schedule[~invalid].reset_index(drop=True)
+
+
+class Projection:
+    """商品 × 日（0 = 開始日）の在庫・受注累計・過不足"""
+
+    def __init__(self, codes, names, start, stock, demand, outside, unknown_codes=()):
+        self.codes = codes
+        self.names = names
+        self.start = start
+        self.stock = stock
+        self.demand = demand
+        self.balance = stock - demand
+        # 期間外（開始日 + horizon より後）の入庫数
+        self.outside = outside
+        # 在庫・受注のどちらにもない商品コード（推移に含めない）
+        self.unknown_codes = list(unknown_codes)
+
+    @property
+    def days(self):
+        return pd.date_range(self.start, periods=self.stock.shape[1], freq='D')
+
+    def clear_day(self):
+        """商品ごとの、過不足が 0 以上になる最初の日（期間内に解消しなければ -1）"""
+        ok = self.balance >= 0
+        first = ok.argmax(axis=1)
+        return np.where(ok.any(axis=1), first, -1)
+
+    def shortages_frame(self):
+        """開始日に不足している商品と解消見込み日（解消の遅い順、期間内に解消しないものが先頭）"""
+        short = np.flatnonzero(self.balance[:, 0] < 0)
+        first = self.clear_day()[short]
+        horizon = self.stock.shape[1] - 1
+        clear_dates = np.where(first >= 0, self.days.values[np.maximum(first, 0)], np.datetime64('NaT'))
+        result = pd.DataFrame({
+            '商品コード': self.codes[short],
+            '商品名': self.names[short],
+            '受注合計数': self.demand[short, -1],
+            '当日在庫': self.stock[short, 0],
+            '当日不足数': -self.balance[short, 0],
+            '期間内入庫数': self.stock[short, -1] - self.stock[short, 0],
+            '解消日': pd.to_datetime(clear_dates).date,
+            '解消までの日数': pd.Series(first).where(first >= 0).astype('Int64').to_numpy(),
+            f'{horizon}日後の過不足': self.balance[short, -1],
+            '期間外入庫数': self.outside[short],
+        })
+        order = np.lexsort((result['商品コード'].to_numpy(), -np.where(first >= 0, first, horizon + 1)))
+        return result.iloc[order].reset_index(drop=True)
+
+    def product_frame(self, code):
+        """1商品の日別の在庫・受注累計"""
+        i = np.flatnonzero(self.codes == code)[0]
+        return pd.DataFrame({'在庫': self.stock[i], '受注累計': self.demand[i]}, index=self.days)
+
+
+def project(state, schedule, start=None, horizon=DEFAULT_HORIZON_DAYS, demand_by_day=None):
+    """AllocationState（What-if の上書きは含まない）と入庫予定から在庫の推移を求める
+
+    demand_by_day を指定する場合は 商品番号 × 日 の受注数量（省略時は受注合計を開始日に計上）。
+    """
+    start = pd.Timestamp(start or date.today()).normalize()
+    n, width = len(state), horizon + 1
+    idx = np.fromiter((state.index.get(c, -1) for c in schedule['商品コード']), dtype=np.int64, count=len(schedule))
+    packs = np.where(idx >= 0, state.packs[np.maximum(idx, 0)], 0)
+    quantity = schedule['入庫数'].to_numpy(np.int64) + schedule['ケース数'].to_numpy(np.int64) * packs
+    day = ((schedule['入庫日'] - start).dt.days.to_numpy(np.int64)).clip(min=0)
+    known = idx >= 0
+    inside = known & (day < width)
+
+    inbound = np.zeros((n, width), dtype=np.int64)
+    np.add.at(inbound, (idx[inside], day[inside]), quantity[inside])
+    outside = np.bincount(idx[known & ~inside], weights=quantity[known & ~inside], minlength=n).astype(np.int64)
+
+    # 日付付きの予定がある商品は、在庫ファイルの入庫予定（日付なし）を予定で置き換える
+    scheduled = np.zeros(n, dtype=bool)
+    scheduled[idx[known]] = True
+    today = state.on_hand + np.where(scheduled, 0, state.incoming)
+    stock = today[:, None] + np.cumsum(inbound, axis=1)
+    if demand_by_day is None:
+        demand = np.broadcast_to(state.ordered[:, None], (n, width))
+    else:
+        demand = np.cumsum(demand_by_day, axis=1)
+    # 19005 は不足扱いにしない
+    demand = np.where(state.special[:, None], 0, demand)
+    return Projection(state.codes, state.names, start, stock, demand, outside,
+                      unknown_codes=sorted(set(schedule['商品コード'][~known])))
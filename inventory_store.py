@@ -0,0 +1,155 @@
+"""セッション共通の在庫スナップショット
+
+同じ速報倉庫在庫ファイル（内容のダイジェストで判定）は最初のアップロード時に一度だけ
+解析し、読み取り専用のコンパクトな表（商品コードはカテゴリ型、在庫数は int32）として
+公開する。以降のセッションは再解析せずにそのスナップショットを参照する。
+スナップショットにはバージョン名・公開時刻があり、TTL を過ぎると破棄される。
+"""
+import hashlib
+import itertools
+import os
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_TTL_HOURS = float(os.environ.get('INVENTORY_SNAPSHOT_TTL_HOURS', '12'))
+
+
+def _readonly(values):
+    values = np.asarray(values)
+    values.flags.writeable = False
+    return values
+
+
+class InventorySnapshot:
+    """解析済み在庫の読み取り専用スナップショット"""
+
+    def __init__(self, version, digest, file_name, label, inventory_df, created_at, expires_at):
+        self.version = version
+        self.digest = digest
+        self.file_name = file_name
+        self.label = label
+        self.created_at = created_at
+        self.expires_at = expires_at
+        codes = pd.Categorical(inventory_df['商品コード'].astype(str))
+        stock = inventory_df['倉庫在庫数'].to_numpy()
+        dtype = np.int32 if stock.size == 0 or (stock.min() >= np.iinfo(np.int32).min and stock.max() <= np.iinfo(np.int32).max) else np.int64
+        self._categories = codes.categories
+        self._codes = _readonly(codes.codes.copy())
+        self._stock = _readonly(stock.astype(dtype))
+        # 差分適用・シミュレーション用の内訳（入庫予定数は個数）。ない場合は None
+        self._incoming = _readonly(inventory_df['入庫予定数'].to_numpy().astype(dtype)) if '入庫予定数' in inventory_df else None
+        self._packs = _readonly(inventory_df['入数'].to_numpy().astype(np.int32)) if '入数' in inventory_df else None
+        # 読み込み時の付帯情報（複数ファイル合算時のファイル別レポートなど）
+        self.attrs = dict(inventory_df.attrs)
+
+    def __len__(self):
+        return len(self._codes)
+
+    @property
+    def nbytes(self):
+        extra = sum(a.nbytes for a in (self._incoming, self._packs) if a is not None)
+        return self._codes.nbytes + self._stock.nbytes + extra + self._categories.memory_usage(deep=True)
+
+    @property
+    def as_of(self):
+        return self.created_at.strftime('%Y-%m-%d %H:%M')
+
+    def expired(self, now=None):
+        return (now or datetime.now()) >= self.expires_at
+
+    def to_frame(self, detail=False):
+        """商品コード・倉庫在庫数の DataFrame（配列は共有・読み取り専用）
+
+        detail=True なら入庫予定数・入数（保持している場合）も含める。
+        """
+        codes = pd.Categorical.from_codes(self._codes, categories=self._categories)
+        columns = {'商品コード': codes, '倉庫在庫数': self._stock}
+        if detail and self._incoming is not None:
+            columns['入庫予定数'] = self._incoming
+        if detail and self._packs is not None:
+            columns['入数'] = self._packs
+        return pd.DataFrame(columns, copy=False)
+
+    def describe(self):
+        return f"{self.label} [{self.version}]（{self.as_of} 時点・{len(self):,} 行）"
+
+
+def _digest(files):
+    """ファイル（または複数ファイル）の内容ダイジェスト（複数の場合は順序に依存しない）"""
+    if not isinstance(files, (list, tuple)):
+        with files.getbuffer() as buffer:
+            return hashlib.sha256(buffer).hexdigest()
+    return hashlib.sha256(''.join(sorted(_digest(f) for f in files)).encode()).hexdigest()
+
+
+class InventorySnapshotStore:
+    """ダイジェスト -> スナップショットのプロセス共通ストア"""
+
+    def __init__(self, ttl_hours=SNAPSHOT_TTL_HOURS):
+        self.ttl = timedelta(hours=ttl_hours)
+        self._lock = threading.Lock()
+        self._by_digest = {}
+        self._loading = {}
+        self._versions = itertools.count(1)
+
+    def _purge(self, now):
+        for digest in [d for d, s in self._by_digest.items() if s.expired(now)]:
+            del self._by_digest[digest]
+
+    def snapshots(self):
+        """有効なスナップショット（新しい順）"""
+        with self._lock:
+            self._purge(datetime.now())
+            return sorted(self._by_digest.values(), key=lambda s: s.created_at, reverse=True)
+
+    def get(self, version):
+        return next((s for s in self.snapshots() if s.version == version), None)
+
+    def get_or_load(self, file, loader, label=None):
+        """同じ内容のスナップショットがあれば再利用し、なければ loader(file) で解析して公開する
+
+        file は複数ファイルのリストでもよい（同じ組み合わせなら再利用する）。
+        戻り値は (スナップショット, 再利用したかどうか)
+        """
+        digest = _digest(file)
+        with self._lock:
+            self._purge(datetime.now())
+            if digest in self._by_digest:
+                return self._by_digest[digest], True
+            # 同じファイルを別セッションが解析中なら、その完了を待つ
+            event = self._loading.get(digest)
+            owner = event is None
+            if owner:
+                event = self._loading[digest] = threading.Event()
+        if not owner:
+            event.wait()
+            with self._lock:
+                if digest in self._by_digest:
+                    return self._by_digest[digest], True
+            return self.get_or_load(file, loader, label)
+        try:
+            inventory_df = loader(file)
+            now = datetime.now()
+            file_name = ', '.join(f.name for f in file) if isinstance(file, (list, tuple)) else file.name
+            snapshot = InventorySnapshot(
+                version=f"v{next(self._versions)}-{digest[:8]}",
+                digest=digest,
+                file_name=file_name,
+                label=label or file_name,
+                inventory_df=inventory_df,
+                created_at=now,
+                expires_at=now + self.ttl,
+            )
+            with self._lock:
+                self._by_digest[digest] = snapshot
+            return snapshot, False
+        finally:
+            with self._lock:
+                self._loading.pop(digest, None)
+            event.set()
+
+
+store = InventorySnapshotStore()
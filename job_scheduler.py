@@ -0,0 +1,226 @@
+"""プロセス全体のジョブ受付制御
+
+OCRジョブ（process_pdf_order）と表形式ジョブ（load_order_file / load_inventory_file）の
+同時実行数を種類ごとに制限し、空きメモリを見て受け付ける。待ちは種類ごとの
+FIFO キューで、待ち順位（「前に3件」）を呼び出し元に通知する。
+キューが満杯の場合や、どう見積もってもメモリに収まらないジョブは拒否する。
+"""
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+MAX_OCR_JOBS = int(os.environ.get('MAX_OCR_JOBS', '1'))
+MAX_TABULAR_JOBS = int(os.environ.get('MAX_TABULAR_JOBS', '2'))
+MAX_QUEUED_JOBS = int(os.environ.get('MAX_QUEUED_JOBS', '20'))
+MEMORY_HEADROOM_MB = int(os.environ.get('MEMORY_HEADROOM_MB', '256'))
+
+OCR, TABULAR = 'ocr', 'tabular'
+
+# 見積もり係数（ファイルサイズに対するピークメモリの目安）
+TABULAR_MEMORY_FACTOR = 6
+OCR_BASE_MEMORY = 300 * 1024 * 1024
+OCR_MEMORY_FACTOR = 3
+
+
+class AdmissionRejected(Exception):
+    """ジョブを受け付けられない（混雑・メモリ不足）"""
+
+
+def _read_int(path):
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else None
+
+
+def memory_limit_bytes():
+    """コンテナ（cgroup）またはホストのメモリ上限"""
+    limit = _read_int('/sys/fs/cgroup/memory.max') or _read_int('/sys/fs/cgroup/memory/memory.limit_in_bytes')
+    total = None
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    total = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass
+    candidates = [v for v in (limit, total) if v]
+    return min(candidates) if candidates else None
+
+
+def available_memory_bytes():
+    """現在使えるメモリの見積もり（cgroup の上限 - 使用量 と MemAvailable の小さい方）"""
+    values = []
+    limit = _read_int('/sys/fs/cgroup/memory.max')
+    usage = _read_int('/sys/fs/cgroup/memory.current')
+    if limit and usage is not None:
+        values.append(limit - usage)
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    values.append(int(line.split()[1]) * 1024)
+                    break
+    except OSError:
+        pass
+    return min(values) if values else None
+
+
+def estimate_job_memory(kind, file_size):
+    """ジョブのピークメモリの見積もり（バイト）"""
+    if kind == OCR:
+        return OCR_BASE_MEMORY + file_size * OCR_MEMORY_FACTOR
+    return file_size * TABULAR_MEMORY_FACTOR
+
+
+class JobScheduler:
+    """種類別の同時実行数制限とメモリを考慮した FIFO 受付"""
+
+    def __init__(self, limits=None, max_queued=MAX_QUEUED_JOBS, headroom_bytes=MEMORY_HEADROOM_MB * 1024 * 1024,
+                 available_memory=available_memory_bytes, memory_limit=memory_limit_bytes):
+        self.limits = limits or {OCR: MAX_OCR_JOBS, TABULAR: MAX_TABULAR_JOBS}
+        self.max_queued = max_queued
+        self.headroom = headroom_bytes
+        self.available_memory = available_memory
+        self.memory_limit = memory_limit
+        self._cond = threading.Condition()
+        self._tickets = itertools.count()
+        self._queues = {kind: [] for kind in self.limits}
+        self._running = {kind: 0 for kind in self.limits}
+        self._reserved = 0
+        self.admitted = {kind: 0 for kind in self.limits}
+        self.rejected = {}
+        self.wait_seconds = {kind: 0.0 for kind in self.limits}
+        self.max_wait_seconds = {kind: 0.0 for kind in self.limits}
+
+    def _reject(self, kind, reason, message):
+        self.rejected[(kind, reason)] = self.rejected.get((kind, reason), 0) + 1
+        raise AdmissionRejected(message)
+
+    def _fits_in_memory(self, estimate):
+        if not any(self._running.values()):
+            # 何も実行していなければ必ず1件は通す（進行を止めない）
+            return True
+        available = self.available_memory()
+        if available is None:
+            return True
+        return estimate <= available - self.headroom - self._reserved
+
+    def position(self, kind, ticket):
+        """自分より前にいるジョブ数（実行中を含む）"""
+        with self._cond:
+            return self._position(kind, ticket)
+
+    def _position(self, kind, ticket):
+        queue = self._queues[kind]
+        return (queue.index(ticket) if ticket in queue else 0) + self._running[kind]
+
+    def queued(self, kind):
+        with self._cond:
+            return len(self._queues[kind])
+
+    @contextmanager
+    def slot(self, kind, estimate_bytes=0, on_wait=None, timeout=None):
+        """実行枠を確保する。待っている間は on_wait(前にいるジョブ数) を呼ぶ
+
+        枠が取れないまま timeout 秒経つか、受付できない場合は AdmissionRejected を送出する。
+        """
+        with self._cond:
+            if sum(len(q) for q in self._queues.values()) >= self.max_queued:
+                self._reject(kind, 'queue_full', "現在混雑しています。しばらくしてから再実行してください。")
+            limit = self.memory_limit()
+            if limit and estimate_bytes > limit - self.headroom:
+                self._reject(kind, 'memory', "ファイルが大きすぎるため処理できません（メモリ上限を超えます）。")
+            ticket = next(self._tickets)
+            self._queues[kind].append(ticket)
+            enqueued_at = time.perf_counter()
+            last_position = None
+            try:
+                while True:
+                    head = self._queues[kind][0] == ticket
+                    if head and self._running[kind] < self.limits[kind] and self._fits_in_memory(estimate_bytes):
+                        break
+                    position = self._position(kind, ticket)
+                    if on_wait and position != last_position:
+                        last_position = position
+                        # コールバック中はロックを外す（UI更新で他のジョブを止めない）
+                        self._cond.release()
+                        try:
+                            on_wait(position)
+                        finally:
+                            self._cond.acquire()
+                        continue
+                    if timeout is not None and time.perf_counter() - enqueued_at > timeout:
+                        self._reject(kind, 'timeout', "待ち時間が上限を超えました。しばらくしてから再実行してください。")
+                    # メモリ待ちは解放通知が来ないこともあるので定期的に再確認する
+                    self._cond.wait(timeout=1.0)
+            except BaseException:
+                self._queues[kind].remove(ticket)
+                self._cond.notify_all()
+                raise
+            self._queues[kind].pop(0)
+            self._running[kind] += 1
+            self._reserved += estimate_bytes
+            waited = time.perf_counter() - enqueued_at
+            self.admitted[kind] += 1
+            self.wait_seconds[kind] += waited
+            self.max_wait_seconds[kind] = max(self.max_wait_seconds[kind], waited)
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running[kind] -= 1
+                self._reserved -= estimate_bytes
+                self._cond.notify_all()
+
+    def render_prometheus(self):
+        with self._cond:
+            lines = [
+                '# HELP scheduler_running_jobs Jobs currently running.',
+                '# TYPE scheduler_running_jobs gauge',
+            ]
+            lines += [f'scheduler_running_jobs{{kind="{k}"}} {v}' for k, v in self._running.items()]
+            lines += [
+                '# HELP scheduler_queued_jobs Jobs waiting for a slot.',
+                '# TYPE scheduler_queued_jobs gauge',
+            ]
+            lines += [f'scheduler_queued_jobs{{kind="{k}"}} {len(q)}' for k, q in self._queues.items()]
+            lines += [
+                '# HELP scheduler_admitted_total Jobs that got a slot.',
+                '# TYPE scheduler_admitted_total counter',
+            ]
+            lines += [f'scheduler_admitted_total{{kind="{k}"}} {v}' for k, v in self.admitted.items()]
+            lines += [
+                '# HELP scheduler_queue_wait_seconds_total Time spent waiting for a slot.',
+                '# TYPE scheduler_queue_wait_seconds_total counter',
+            ]
+            lines += [f'scheduler_queue_wait_seconds_total{{kind="{k}"}} {v:.6f}' for k, v in self.wait_seconds.items()]
+            lines += [
+                '# HELP scheduler_queue_wait_seconds_max Longest wait for a slot.',
+                '# TYPE scheduler_queue_wait_seconds_max gauge',
+            ]
+            lines += [f'scheduler_queue_wait_seconds_max{{kind="{k}"}} {v:.6f}' for k, v in self.max_wait_seconds.items()]
+            lines += [
+                '# HELP scheduler_rejected_total Jobs rejected at admission.',
+                '# TYPE scheduler_rejected_total counter',
+            ]
+            lines += [f'scheduler_rejected_total{{kind="{k}",reason="{r}"}} {v}' for (k, r), v in sorted(self.rejected.items())]
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path=None):
+        path = path or os.path.join(os.environ.get('PDF_METRICS_DIR', 'metrics'), 'scheduler.prom')
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+        return path
+
+
+scheduler = JobScheduler()
@@ -0,0 +1,200 @@
+"""PDF受注一覧のレイアウトテンプレート
+
+ページ上部（タイトル・出荷先・表ヘッダー）の差分ハッシュでレイアウトを識別し、
+一度ヘッダー位置が見つかったレイアウトについて「顧客ブロック」「商品コード列」
+「数量列」の領域をテンプレートとして保存する。同じレイアウトの以降のページでは
+その領域だけを（列は表の下の余白を詰めてから）OCRすることで、認識する画素数を大幅に減らす。
+
+座標はすべてページ画像の幅・高さに対する比率で保持する（ズーム倍率に依存しない）。
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+TEMPLATE_DIR = os.environ.get('LAYOUT_TEMPLATE_DIR', '.layout_templates')
+# フィンガープリントの一致とみなすハミング距離（256ビット中）
+MATCH_DISTANCE = int(os.environ.get('LAYOUT_MATCH_DISTANCE', '24'))
+
+# フィンガープリントに使うページ上部の割合（明細行を含めない）
+FINGERPRINT_REGION = 0.28
+HASH_SIZE = 16
+# 領域の余白（画素）
+REGION_PADDING = 16
+# 列の帯の左右の余白（画素）。学習したページより長い商品コード・大きい数量の分
+COLUMN_MARGIN = 24
+# 文字のある行とみなす暗い画素の割合と、続く行数
+INK_ROW_RATIO = 0.03
+INK_ROW_RUN = 5
+# 列領域の決め方を変えたら上げる（古い版のテンプレートは読み込み時に捨てて学習し直す）
+TEMPLATE_VERSION = 3
+
+
+def layout_fingerprint(img_np):
+    """ページ上部の差分ハッシュ（16x16 = 256ビット）を16進文字列で返す"""
+    height = img_np.shape[0]
+    top = img_np[:max(1, int(height * FINGERPRINT_REGION))]
+    img = Image.fromarray(top).convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    pixels = np.asarray(img, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    aspect = round(img_np.shape[1] / img_np.shape[0], 2)
+    return f"{aspect:.2f}:" + np.packbits(bits).tobytes().hex()
+
+
+def fingerprint_distance(a, b):
+    aspect_a, hash_a = a.split(':')
+    aspect_b, hash_b = b.split(':')
+    if aspect_a != aspect_b:
+        return None
+    xor = np.bitwise_xor(np.frombuffer(bytes.fromhex(hash_a), dtype=np.uint8),
+                         np.frombuffer(bytes.fromhex(hash_b), dtype=np.uint8))
+    return int(np.unpackbits(xor).sum())
+
+
+def _span(boxes, width, height):
+    """ボックス群を囲む矩形（比率）"""
+    xs = [p[0] for b in boxes for p in b]
+    ys = [p[1] for b in boxes for p in b]
+    return [
+        max(0.0, (min(xs) - REGION_PADDING) / width),
+        max(0.0, (min(ys) - REGION_PADDING) / height),
+        min(1.0, (max(xs) + REGION_PADDING) / width),
+        min(1.0, (max(ys) + REGION_PADDING) / height),
+    ]
+
+
+def build_template(width, height, prod_x, qty_x, header_y, customer_boxes, prod_boxes, qty_boxes,
+                   prod_header=None, qty_header=None):
+    """全面OCRの結果からテンプレートを作る（必要なボックスがなければ None）
+
+    商品コード列・数量列は、見出しと学習したページの値のボックスを囲む幅に COLUMN_MARGIN を足した帯にする
+    （以降のページのより長い値が切れないように）。行数はページごとに違うので、帯はページ下端までとり、
+    OCR の前に trim_regions で表の下の余白を詰める。
+    """
+    if not customer_boxes or not prod_boxes or not qty_boxes:
+        return None
+    top = max(0.0, (header_y - 10) / height - 0.005)
+
+    def column(boxes, header):
+        xs = [p[0] for b in list(boxes) + ([header] if header is not None else []) for p in b]
+        return [max(0.0, (min(xs) - COLUMN_MARGIN) / width), top, min(1.0, (max(xs) + COLUMN_MARGIN) / width), 1.0]
+
+    return {
+        'prod_x': prod_x / width,
+        'qty_x': qty_x / width,
+        'header_y': header_y / height,
+        'customer': _span(customer_boxes, width, height),
+        'product': column(prod_boxes, prod_header),
+        'quantity': column(qty_boxes, qty_header),
+        'version': TEMPLATE_VERSION,
+    }
+
+
+def template_regions(template, width, height):
+    """テンプレートのOCR対象領域を画素座標 (name, x0, y0, x1, y1) で返す（重なる列は結合）"""
+    def to_px(rect):
+        return [int(rect[0] * width), int(rect[1] * height),
+                int(np.ceil(rect[2] * width)), int(np.ceil(rect[3] * height))]
+
+    regions = [('customer', *to_px(template['customer']))]
+    prod = to_px(template['product'])
+    qty = to_px(template['quantity'])
+    if prod[0] <= qty[2] and qty[0] <= prod[2]:
+        regions.append(('columns', min(prod[0], qty[0]), min(prod[1], qty[1]),
+                        max(prod[2], qty[2]), max(prod[3], qty[3])))
+    else:
+        regions.append(('product', *prod))
+        regions.append(('quantity', *qty))
+    return regions
+
+
+def trim_regions(regions, img_np):
+    """列の領域の下端を、商品コード列で文字のある最後の行（+ 余白）まで詰める
+
+    暗い画素の割合が INK_ROW_RATIO を超える行が INK_ROW_RUN 行続く所を文字とみなす（スキャンの点状の
+    ノイズは数えない）。数量は商品コードと同じ行にあるので、数量列も同じ下端で詰める。
+    文字が見つからない場合はそのまま返す。
+    """
+    anchor = next((r for r in regions if r[0] in ('product', 'columns')), None)
+    if anchor is None or anchor[3] <= anchor[1] or anchor[4] - anchor[2] < INK_ROW_RUN:
+        return regions
+    _, x0, y0, x1, y1 = anchor
+    crop = img_np[y0:y1, x0:x1]
+    gray = crop.mean(axis=2) if crop.ndim == 3 else crop
+    inked = (gray < 128).mean(axis=1) > INK_ROW_RATIO
+    runs = np.flatnonzero(np.lib.stride_tricks.sliding_window_view(inked, INK_ROW_RUN).all(axis=1))
+    if not len(runs):
+        return regions
+    bottom = y0 + int(runs[-1]) + INK_ROW_RUN + REGION_PADDING
+    return [(name, rx0, ry0, rx1, ry1 if name == 'customer' else min(ry1, bottom))
+            for name, rx0, ry0, rx1, ry1 in regions]
+
+
+def template_coords(template, width, height):
+    """テンプレートのヘッダー座標 (prod_x, qty_x, header_y) を画素で返す"""
+    return template['prod_x'] * width, template['qty_x'] * width, template['header_y'] * height
+
+
+class LayoutTemplateStore:
+    """フィンガープリント -> テンプレートの永続ストア"""
+
+    def __init__(self, template_dir=TEMPLATE_DIR, max_distance=MATCH_DISTANCE):
+        self.path = os.path.join(template_dir, 'layout_templates.json')
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._templates = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self._templates = json.load(f)
+            except (OSError, ValueError):
+                self._templates = {}
+            self._templates = {fp: t for fp, t in self._templates.items() if t.get('version') == TEMPLATE_VERSION}
+
+    def __len__(self):
+        return len(self._templates)
+
+    def match(self, fingerprint):
+        """最も近いテンプレートを返す（閾値内になければ None）"""
+        with self._lock:
+            if fingerprint in self._templates:
+                return self._templates[fingerprint]
+            best, best_distance = None, None
+            for fp, template in self._templates.items():
+                distance = fingerprint_distance(fingerprint, fp)
+                if distance is None or distance > self.max_distance:
+                    continue
+                if best_distance is None or distance < best_distance:
+                    best, best_distance = template, distance
+            return best
+
+    def learn(self, fingerprint, template):
+        template = dict(template, learned_at=datetime.now().isoformat(timespec='seconds'))
+        with self._lock:
+            self._templates[fingerprint] = template
+            self._save()
+
+    def forget(self, fingerprint):
+        """テンプレートで行が取れなかった場合に呼ぶ（近いテンプレートも含めて破棄）"""
+        with self._lock:
+            stale = []
+            for fp in self._templates:
+                distance = fingerprint_distance(fingerprint, fp)
+                if distance is not None and distance <= self.max_distance:
+                    stale.append(fp)
+            for fp in stale:
+                del self._templates[fp]
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._templates, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+store = LayoutTemplateStore()
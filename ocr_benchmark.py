@@ -0,0 +1,291 @@
+"""OCR精度・スループットのオフラインベンチマーク
+
+正解データ付きの合成「受注一覧」PDF（出荷先の顧客ブロック、受注品目/数量の表、
+ノイズ・回転）を生成し、`PDF ファイル/` のサンプルPDFとあわせて
+process_pdf_order に通す。pages/s・ピークRSS・行単位の適合率/再現率
+（商品コード+発注数量）を報告し、ベースラインから閾値を超えて劣化した場合は
+終了コード 1、ベースラインがない場合は比較できないので終了コード 2 で失敗する。
+
+pages/s・RSS はマシンに依存するので、ベースラインはリポジトリに含めない。計測するマシン（CI なら
+同じランナー）で --update-baseline により作成し、--baseline または OCR_BENCHMARK_BASELINE で
+その場所を指定する（CI ではキャッシュ・アーティファクトから復元したファイルを渡す）。
+既定は ocr_benchmark_baseline.json（bench_allocation.py と同じ扱い）。
+
+    python ocr_benchmark.py                  # 実行してベースラインと比較
+    python ocr_benchmark.py --update-baseline
+    OCR_BENCHMARK_BASELINE=/cache/ocr_benchmark_baseline.json python ocr_benchmark.py
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import resource
+import sys
+import time
+from collections import Counter
+from io import BytesIO
+
+import fitz
+import numpy as np
+from PIL import Image
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_PDF_DIR = os.path.join(BASE_DIR, 'PDF ファイル')
+BASELINE_PATH = os.environ.get('OCR_BENCHMARK_BASELINE', os.path.join(BASE_DIR, 'ocr_benchmark_baseline.json'))
+
+# 劣化とみなす閾値
+DEFAULT_THRESHOLDS = {
+    'pages_per_sec_drop': 0.20,   # スループットの相対低下
+    'precision_drop': 0.02,       # 適合率の絶対低下
+    'recall_drop': 0.02,          # 再現率の絶対低下
+}
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 (pt)
+
+
+class NamedBytesIO(BytesIO):
+    """UploadedFile 互換（name 属性付き）のバッファ"""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def make_ground_truth(rng, n_rows):
+    customer_code = ''.join(rng.choice('0123456789') for _ in range(9))
+    rows = []
+    used = set()
+    while len(rows) < n_rows:
+        code = str(rng.randint(10000, 99999))
+        if code in used:
+            continue
+        used.add(code)
+        rows.append({'商品コード': code, '発注数量': rng.randint(1, 240)})
+    return {
+        '顧客コード': customer_code,
+        '顧客名': f'テスト店舗{rng.randint(1, 99):02d}',
+        'rows': rows,
+    }
+
+
+def draw_order_page(page, truth):
+    """受注一覧のレイアウトでページを描画する"""
+    page.insert_text((220, 60), '受注一覧', fontname='japan', fontsize=20)
+    page.insert_text((60, 110), '出荷先', fontname='japan', fontsize=11)
+    page.insert_text((52, 130), truth['顧客コード'], fontname='japan', fontsize=11)
+    page.insert_text((52, 148), truth['顧客名'], fontname='japan', fontsize=11)
+
+    header_y = 210
+    page.insert_text((60, header_y), 'No', fontname='japan', fontsize=11)
+    page.insert_text((250, header_y), '受注品目', fontname='japan', fontsize=11)
+    page.insert_text((380, header_y), '数量', fontname='japan', fontsize=11)
+    page.draw_line((50, header_y + 6), (545, header_y + 6))
+
+    for i, row in enumerate(truth['rows']):
+        y = header_y + 30 + i * 24
+        page.insert_text((62, y), str(i + 1), fontname='japan', fontsize=11)
+        page.insert_text((255, y), row['商品コード'], fontname='japan', fontsize=11)
+        page.insert_text((384, y), str(row['発注数量']), fontname='japan', fontsize=11)
+
+
+def degrade_page(pdf_bytes, rng, noise=0.02, max_rotation=1.5, dpi_zoom=2.0):
+    """ページをラスタ化してノイズと回転を加え、スキャン画像のPDFにする"""
+    src = fitz.open(stream=pdf_bytes, filetype='pdf')
+    out = fitz.open()
+    for page in src:
+        pix = page.get_pixmap(matrix=fitz.Matrix(dpi_zoom, dpi_zoom))
+        img = Image.frombytes('RGB', [pix.width, pix.height], pix.samples).convert('L')
+        angle = rng.uniform(-max_rotation, max_rotation)
+        img = img.rotate(angle, resample=Image.BILINEAR, expand=False, fillcolor=255)
+        arr = np.array(img)
+        np_rng = np.random.default_rng(rng.randint(0, 2**31))
+        mask = np_rng.random(arr.shape)
+        arr[mask < noise / 2] = 0
+        arr[mask > 1 - noise / 2] = 255
+        buf = BytesIO()
+        Image.fromarray(arr).save(buf, format='PNG')
+        new_page = out.new_page(width=page.rect.width, height=page.rect.height)
+        new_page.insert_image(new_page.rect, stream=buf.getvalue())
+    data = out.tobytes()
+    out.close()
+    src.close()
+    return data
+
+
+def generate_synthetic_pdf(seed, n_pages=1, rows_per_page=12, noise=0.02, max_rotation=1.5):
+    """合成受注一覧PDFを生成し、(PDFバイト列, 正解データ) を返す"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    truths = []
+    for _ in range(n_pages):
+        truth = make_ground_truth(rng, rows_per_page)
+        draw_order_page(doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT), truth)
+        truths.append(truth)
+    clean = doc.tobytes()
+    doc.close()
+    if noise > 0 or max_rotation > 0:
+        return degrade_page(clean, rng, noise=noise, max_rotation=max_rotation), truths
+    return clean, truths
+
+
+def expected_rows(truths):
+    rows = []
+    for truth in truths:
+        for row in truth['rows']:
+            rows.append((row['商品コード'].lstrip('0'), int(row['発注数量'])))
+    return rows
+
+
+def score_rows(expected, actual):
+    """行単位（商品コード+発注数量の組）の適合率・再現率（多重集合で照合）"""
+    expected_counts = Counter(expected)
+    actual_counts = Counter(actual)
+    matched = sum((expected_counts & actual_counts).values())
+    precision = matched / len(actual) if actual else (1.0 if not expected else 0.0)
+    recall = matched / len(expected) if expected else 1.0
+    code_matched = sum((Counter(c for c, _ in expected) & Counter(c for c, _ in actual)).values())
+    return {
+        'expected_rows': len(expected),
+        'extracted_rows': len(actual),
+        'matched_rows': matched,
+        'precision': precision,
+        'recall': recall,
+        'code_recall': code_matched / len(expected) if expected else 1.0,
+    }
+
+
+def peak_rss_mb():
+    # Linux の ru_maxrss は KB 単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(name, pdf_bytes, truths=None):
+    from app import process_pdf_order
+    from pdf_metrics import PdfMetrics
+
+    metrics = PdfMetrics(name)
+    t0 = time.perf_counter()
+    df = process_pdf_order(NamedBytesIO(pdf_bytes, name), metrics=metrics)
+    elapsed = time.perf_counter() - t0
+    result = {
+        'name': name,
+        'pages': len(metrics.pages),
+        'seconds': elapsed,
+        'stages': {k: v for k, v in metrics.summary().items() if k.endswith('(秒)')},
+    }
+    actual = []
+    if not df.empty:
+        actual = list(zip(df['商品コード'].astype(str), df['発注数量'].astype(int)))
+    if truths is not None:
+        result.update(score_rows(expected_rows(truths), actual))
+    else:
+        result['extracted_rows'] = len(actual)
+    return result
+
+
+def run_benchmark(n_synthetic=6, pages_per_pdf=2, seed=0, include_samples=True):
+    cases = []
+    for i in range(n_synthetic):
+        pdf_bytes, truths = generate_synthetic_pdf(seed + i, n_pages=pages_per_pdf)
+        cases.append(run_case(f'synthetic_{i:02d}.pdf', pdf_bytes, truths))
+
+    if include_samples:
+        for path in sorted(glob.glob(os.path.join(SAMPLE_PDF_DIR, '受注一覧*.pdf'))):
+            with open(path, 'rb') as f:
+                cases.append(run_case(os.path.basename(path), f.read()))
+
+    scored = [c for c in cases if 'matched_rows' in c]
+    total_pages = sum(c['pages'] for c in cases)
+    total_seconds = sum(c['seconds'] for c in cases)
+    expected = sum(c['expected_rows'] for c in scored)
+    extracted = sum(c['extracted_rows'] for c in scored)
+    matched = sum(c['matched_rows'] for c in scored)
+    return {
+        'pages': total_pages,
+        'seconds': total_seconds,
+        'pages_per_sec': total_pages / total_seconds if total_seconds else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'precision': matched / extracted if extracted else 0.0,
+        'recall': matched / expected if expected else 0.0,
+        'cases': cases,
+    }
+
+
+def find_regressions(summary, baseline, thresholds=None):
+    """ベースラインと比較し、閾値を超えた劣化のメッセージ一覧を返す"""
+    thresholds = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+    failures = []
+    base_pps = baseline.get('pages_per_sec')
+    if base_pps:
+        drop = 1 - summary['pages_per_sec'] / base_pps
+        if drop > thresholds['pages_per_sec_drop']:
+            failures.append(f"pages/s: {summary['pages_per_sec']:.3f} (baseline {base_pps:.3f}, -{drop:.0%})")
+    for key in ('precision', 'recall'):
+        if key in baseline and baseline[key] - summary[key] > thresholds[f'{key}_drop']:
+            failures.append(f"{key}: {summary[key]:.3f} (baseline {baseline[key]:.3f})")
+    return failures
+
+
+def print_report(summary):
+    print(f"{'case':<32}{'pages':>6}{'sec':>9}{'rows':>7}{'prec':>7}{'recall':>8}")
+    for c in summary['cases']:
+        prec = f"{c['precision']:.3f}" if 'precision' in c else '-'
+        rec = f"{c['recall']:.3f}" if 'recall' in c else '-'
+        print(f"{c['name']:<32}{c['pages']:>6}{c['seconds']:>9.2f}{c['extracted_rows']:>7}{prec:>7}{rec:>8}")
+    print('-' * 69)
+    print(f"pages/s     : {summary['pages_per_sec']:.3f}")
+    print(f"peak RSS    : {summary['peak_rss_mb']:.1f} MB")
+    print(f"precision   : {summary['precision']:.3f}")
+    print(f"recall      : {summary['recall']:.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='OCR accuracy/throughput benchmark')
+    parser.add_argument('--synthetic', type=int, default=6, help='合成PDFの数')
+    parser.add_argument('--pages', type=int, default=2, help='合成PDFあたりのページ数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-samples', action='store_true', help='PDF ファイル/ のサンプルを使わない')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--save-pdfs', metavar='DIR', help='生成した合成PDFと正解データを保存する')
+    args = parser.parse_args(argv)
+
+    if args.save_pdfs:
+        os.makedirs(args.save_pdfs, exist_ok=True)
+        for i in range(args.synthetic):
+            pdf_bytes, truths = generate_synthetic_pdf(args.seed + i, n_pages=args.pages)
+            base = os.path.join(args.save_pdfs, f'synthetic_{i:02d}')
+            with open(base + '.pdf', 'wb') as f:
+                f.write(pdf_bytes)
+            with open(base + '.json', 'w', encoding='utf-8') as f:
+                json.dump(truths, f, ensure_ascii=False, indent=2)
+
+    summary = run_benchmark(args.synthetic, args.pages, args.seed, include_samples=not args.no_samples)
+    print_report(summary)
+
+    if args.update_baseline:
+        baseline = {k: summary[k] for k in ('pages_per_sec', 'peak_rss_mb', 'precision', 'recall')}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"baseline updated: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        # 比較できないまま成功扱いにすると、CI で劣化を見逃す
+        print(f"baseline not found: {args.baseline}; run with --update-baseline to create one")
+        return 2
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    failures = find_regressions(summary, baseline, baseline.get('thresholds'))
+    if failures:
+        print("REGRESSION:")
+        for msg in failures:
+            print(f"  {msg}")
+        return 1
+    print("OK: no regression against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""PaddleOCR エンジンの生成・ウォームアップ
+
+モデルはコンテナのビルド時に `python ocr_engine.py` で取得してイメージに
+同梱し（保存先は PADDLE_PDX_CACHE_HOME / PADDLE_OCR_BASE_DIR）、実行時は
+ネットワークに接続せずに読み込む。アプリ起動時にバックグラウンドでモデルを読み込み、
+ダミー画像で1回推論しておくことで、最初のPDFも定常状態と同じ速度で処理できる。
+"""
+import logging
+import sys
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+logger = logging.getLogger(__name__)
+
+COLD, LOADING, READY, FAILED = 'cold', 'loading', 'ready', 'failed'
+
+_lock = threading.Lock()
+_engine = None
+_state = {'status': COLD, 'error': None, 'seconds': None}
+
+
+class SharedOcr:
+    """プロセス共通の PaddleOCR インスタンス（推論は直列化する）"""
+
+    def __init__(self, ocr):
+        self._ocr = ocr
+        self._infer_lock = threading.Lock()
+
+    def ocr(self, img_np):
+        with self._infer_lock:
+            return self._ocr.ocr(img_np)
+
+    def ocr_batch(self, images):
+        """複数画像をまとめて推論し、画像ごとの行リスト [[box, (text, score)], ...] を返す"""
+        with self._infer_lock:
+            if hasattr(self._ocr, 'predict'):
+                # PaddleOCR 3.x はリスト入力をまとめて推論できる
+                return [_lines_from_prediction(r) for r in self._ocr.predict(images)]
+            results = [self._ocr.ocr(img) for img in images]
+        return [(r[0] or []) if r else [] for r in results]
+
+
+def _lines_from_prediction(result):
+    """PaddleOCR 3.x の予測結果を 2.x の行形式に変換する"""
+    return [
+        [np.asarray(poly).tolist(), (text, float(score))]
+        for poly, text, score in zip(result['rec_polys'], result['rec_texts'], result['rec_scores'])
+    ]
+
+
+def create_ocr():
+    from paddleocr import PaddleOCR
+    return PaddleOCR(use_angle_cls=True, lang='japan')
+
+
+def get_ocr():
+    """共有OCRインスタンスを返す（未初期化ならここで読み込む）"""
+    global _engine
+    with _lock:
+        if _engine is None:
+            _state.update(status=LOADING, error=None)
+            try:
+                _engine = SharedOcr(create_ocr())
+            except Exception as e:
+                _state.update(status=FAILED, error=str(e))
+                raise
+        return _engine
+
+
+def dummy_page():
+    """ウォームアップ用の小さな帳票風画像"""
+    img = Image.new('RGB', (640, 200), 'white')
+    draw = ImageDraw.Draw(img)
+    draw.text((20, 30), 'ORDER 0123456789', fill='black')
+    draw.text((20, 90), '12345    24', fill='black')
+    draw.line((10, 70, 630, 70), fill='black', width=2)
+    return np.array(img)
+
+
+def warm_up():
+    """モデルを読み込み、ダミー推論を1回実行する"""
+    t0 = time.perf_counter()
+    try:
+        get_ocr().ocr(dummy_page())
+    except Exception as e:
+        _state.update(status=FAILED, error=str(e))
+        logger.exception("OCRエンジンのウォームアップに失敗しました")
+        return False
+    _state.update(status=READY, error=None, seconds=time.perf_counter() - t0)
+    logger.info("OCRエンジンの準備が完了しました (%.1f 秒)", _state['seconds'])
+    return True
+
+
+def start_warm_up():
+    """バックグラウンドでウォームアップを開始する（多重起動しない）"""
+    with _lock:
+        if _state['status'] != COLD:
+            return
+        _state['status'] = LOADING
+    threading.Thread(target=warm_up, name='ocr-warm-up', daemon=True).start()
+
+
+def readiness():
+    """準備状態 {'status', 'error', 'seconds'} を返す"""
+    return dict(_state)
+
+
+def main():
+    # イメージのビルド時に実行すると、モデルがキャッシュに保存される
+    logging.basicConfig(level=logging.INFO)
+    return 0 if warm_up() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
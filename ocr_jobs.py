@@ -0,0 +1,250 @@
+"""PDF受注解析のバックグラウンドジョブキュー
+
+PDFのOCRをワーカースレッドで実行し、ジョブの状態（queued / running / done / failed）と
+進捗（処理済みページ数 / 総ページ数）を SQLite のジョブテーブルに永続化する。
+ジョブには登録したブラウザの所有者ID（owner）を記録し、同じ所有者の同じ内容のPDFは
+ダイジェストで既存ジョブに紐付けるため、ブラウザを再読み込みしても処理中・処理済みの
+ジョブを引き継げる（一覧 list_jobs も所有者ごと）。
+完了したジョブの error には、ページ単位の警告（metrics.warnings）を改行区切りで残す。
+保持期間（OCR_JOB_RETENTION_HOURS）を過ぎた完了・失敗ジョブは、抽出結果（result_json）ごと
+compact() で削除する。
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta
+from io import StringIO
+
+import pandas as pd
+
+from order_schema import ORDER_FIELDS
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = os.environ.get('OCR_JOBS_DIR', '.ocr_jobs')
+JOB_WORKERS = int(os.environ.get('OCR_JOB_WORKERS', '1'))
+JOB_RETENTION_HOURS = int(os.environ.get('OCR_JOB_RETENTION_HOURS', '48'))
+# 取り出されないまま残る計測結果（画面を閉じたセッションのジョブなど）の上限
+MAX_PENDING_METRICS = 256
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_jobs (
+    job_id      TEXT PRIMARY KEY,
+    owner       TEXT,
+    file_name   TEXT NOT NULL,
+    digest      TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    pages_done  INTEGER NOT NULL DEFAULT 0,
+    pages_total INTEGER NOT NULL DEFAULT 0,
+    error       TEXT,
+    result_json TEXT,
+    created_at  TEXT NOT NULL,
+    updated_at  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ocr_jobs_digest ON ocr_jobs (digest);
+CREATE INDEX IF NOT EXISTS idx_ocr_jobs_status ON ocr_jobs (status, created_at);
+"""
+
+
+class _JobFile:
+    """ワーカーに渡す UploadedFile 互換の入力（ディスク上のPDFをパスで渡す）"""
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.size = os.path.getsize(path)
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class OcrJobQueue:
+    """永続ジョブテーブル付きのローカルOCRワーカー"""
+
+    def __init__(self, process_fn, jobs_dir=JOBS_DIR, workers=JOB_WORKERS, metrics_factory=None):
+        # process_fn(file, metrics=..., on_page=...) -> DataFrame
+        self.process_fn = process_fn
+        self.metrics_factory = metrics_factory
+        self.jobs_dir = jobs_dir
+        os.makedirs(jobs_dir, exist_ok=True)
+        self.db_path = os.path.join(jobs_dir, 'ocr_jobs.sqlite3')
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopped = False
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            # 所有者の列がない版のジョブ表に追加する（追加前のジョブはどのブラウザにも引き継がない）
+            if 'owner' not in {row['name'] for row in conn.execute("PRAGMA table_info(ocr_jobs)")}:
+                conn.execute("ALTER TABLE ocr_jobs ADD COLUMN owner TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_jobs_owner ON ocr_jobs (owner, created_at)")
+            # 前回プロセスの実行中ジョブは再実行する
+            conn.execute("UPDATE ocr_jobs SET status = ?, pages_done = 0, updated_at = ? WHERE status = ?",
+                         (QUEUED, _now(), RUNNING))
+        self._threads = []
+        for i in range(max(1, workers)):
+            t = threading.Thread(target=self._worker, name=f'ocr-job-worker-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _input_path(self, job_id):
+        return os.path.join(self.jobs_dir, f'{job_id}.pdf')
+
+    def submit(self, file_name, data, owner=None):
+        """PDF（bytes / memoryview）をジョブとして登録し、job_id を返す（同じ所有者の同一内容の未失敗ジョブがあれば再利用）"""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT job_id FROM ocr_jobs WHERE digest = ? AND owner IS ? AND status != ? "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (digest, owner, FAILED)).fetchone()
+                if row:
+                    return row['job_id']
+                job_id = uuid.uuid4().hex
+                with open(self._input_path(job_id), 'wb') as f:
+                    f.write(data)
+                now = _now()
+                conn.execute(
+                    "INSERT INTO ocr_jobs (job_id, owner, file_name, digest, status, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, owner, file_name, digest, QUEUED, now, now))
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT job_id, file_name, status, pages_done, pages_total, error, created_at, updated_at "
+                "FROM ocr_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def position(self, job_id):
+        """このジョブより前に待機・実行中のジョブ数"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT created_at, status FROM ocr_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if not row or row['status'] != QUEUED:
+                return 0
+            return conn.execute(
+                "SELECT COUNT(*) FROM ocr_jobs WHERE job_id != ? AND "
+                "(status = ? OR (status = ? AND created_at <= ?))",
+                (job_id, RUNNING, QUEUED, row['created_at'])).fetchone()[0]
+
+    def list_jobs(self, owner, since_hours=24):
+        """所有者が直近に登録したジョブ（新しい順）"""
+        since = (datetime.now() - timedelta(hours=since_hours)).isoformat(timespec='seconds')
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT job_id, file_name, status, pages_done, pages_total, error, created_at, updated_at "
+                "FROM ocr_jobs WHERE owner = ? AND created_at >= ? ORDER BY created_at DESC", (owner, since)).fetchall()
+        return [dict(r) for r in rows]
+
+    def compact(self, retention_hours=JOB_RETENTION_HOURS, now=None):
+        """保持期間を過ぎた完了・失敗ジョブを削除する（削除したジョブ数を返す）"""
+        cutoff = ((now or datetime.now()) - timedelta(hours=retention_hours)).isoformat(timespec='seconds')
+        with self._lock, self._connect() as conn:
+            removed = conn.execute("DELETE FROM ocr_jobs WHERE status IN (?, ?) AND updated_at < ?",
+                                   (DONE, FAILED, cutoff)).rowcount
+        if removed:
+            with self._connect() as conn:
+                conn.execute("VACUUM")
+        return removed
+
+    def result(self, job_id):
+        """完了ジョブの抽出結果を DataFrame で返す（未完了なら None）"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT status, result_json FROM ocr_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if not row or row['status'] != DONE:
+            return None
+        df = pd.read_json(StringIO(row['result_json']), orient='records', dtype=False)
+        if df.empty:
+            # 行が抽出できなかったPDFは '[]' として保存されるので、受注明細の列だけ持つ空の表にする
+            df = pd.DataFrame({field: pd.Series(dtype=object) for field in ORDER_FIELDS}).astype({'発注数量': 'int64'})
+        for col in ['顧客コード', '伝票番号', '商品コード']:
+            if col in df.columns:
+                df[col] = df[col].astype(str)
+        return df
+
+    def take_metrics(self, job_id):
+        """ジョブの計測結果を取り出す（取り出した分は保持しない。なければ None）"""
+        with self._lock:
+            return self.metrics.pop(job_id, None)
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = _now()
+        assignments = ', '.join(f'{k} = ?' for k in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE ocr_jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def _claim_next(self):
+        with self._lock:
+            while not self._stopped:
+                with self._connect() as conn:
+                    row = conn.execute(
+                        "SELECT job_id, file_name FROM ocr_jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                        (QUEUED,)).fetchone()
+                    if row:
+                        conn.execute("UPDATE ocr_jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+                                     (RUNNING, _now(), row['job_id']))
+                        return row['job_id'], row['file_name']
+                self._wakeup.wait(timeout=5)
+        return None
+
+    def _worker(self):
+        while True:
+            claimed = self._claim_next()
+            if claimed is None:
+                return
+            job_id, file_name = claimed
+            self._run(job_id, file_name)
+
+    def _run(self, job_id, file_name):
+        path = self._input_path(job_id)
+        try:
+            file = _JobFile(path, file_name)
+
+            def on_page(done, total):
+                self._update(job_id, pages_done=done, pages_total=total)
+
+            kwargs = {'on_page': on_page}
+            if self.metrics_factory is not None:
+                kwargs['metrics'] = self.metrics_factory(file_name)
+                with self._lock:
+                    self.metrics[job_id] = kwargs['metrics']
+                    # 古いものから捨てる（dict は登録順）
+                    while len(self.metrics) > MAX_PENDING_METRICS:
+                        self.metrics.pop(next(iter(self.metrics)))
+            df = self.process_fn(file, **kwargs)
+            # 完了したジョブでは error にページ単位の警告を残す（画面表示はメインスレッドで行う）
+            warnings = getattr(kwargs.get('metrics'), 'warnings', None)
+            self._update(job_id, status=DONE, result_json=df.to_json(orient='records', force_ascii=False),
+                         error='\n'.join(warnings) if warnings else None)
+        except Exception as e:
+            logger.exception("OCRジョブ %s が失敗しました", job_id)
+            self._update(job_id, status=FAILED, error=str(e))
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._wakeup.notify_all()
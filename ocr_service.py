@@ -0,0 +1,307 @@
+"""セッション横断でOCRをまとめて実行するローカルサービス
+
+各セッションのページ画像を1つのキューで受け付け、短い時間窓（既定 30ms）に
+集まったものをまとめてバッチ推論し、結果をリクエストごとに返す。
+プロセス内で起動するほか、サイドカーとして単独でも起動できる。
+
+    python ocr_service.py --port 8765        # サイドカー起動
+    OCR_SERVICE_URL=http://127.0.0.1:8765    # アプリ側はこの環境変数で接続先を指定
+
+HTTP インターフェース:
+    POST /ocr       本文: np.save 形式の画像配列 -> {"lines": [[box, [text, score]], ...]}
+    GET  /metrics   Prometheus 形式のキュー長・バッチサイズ
+    GET  /healthz   OCRエンジンの準備状態
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SERVICE_URL = os.environ.get('OCR_SERVICE_URL')
+BATCH_WINDOW_MS = float(os.environ.get('OCR_BATCH_WINDOW_MS', '30'))
+MAX_BATCH_SIZE = int(os.environ.get('OCR_MAX_BATCH_SIZE', '8'))
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+
+def default_engine(images):
+    import ocr_engine
+    return ocr_engine.get_ocr().ocr_batch(images)
+
+
+class OcrBatcher:
+    """時間窓内に届いた画像をまとめて engine_fn(images) -> [lines, ...] に渡す"""
+
+    def __init__(self, engine_fn=default_engine, window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH_SIZE):
+        self.engine_fn = engine_fn
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._metrics_lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self.max_queue_depth = 0
+        self.wait_seconds = 0.0
+        self.batch_size_counts = {b: 0 for b in BATCH_SIZE_BUCKETS}
+        self.batch_size_sum = 0
+        self._thread = threading.Thread(target=self._loop, name='ocr-batcher', daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, img_np):
+        future = Future()
+        self._queue.put((img_np, future, time.perf_counter()))
+        with self._metrics_lock:
+            self.requests += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return future
+
+    def ocr(self, img_np):
+        """1枚の画像をOCRする（バッチ化されるまで待つ）"""
+        return self.submit(img_np).result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                results = list(self.engine_fn([item[0] for item in batch]))
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+                if len(results) != len(batch):
+                    # 結果が足りない分を未解決のまま残すと呼び出し側が待ち続ける
+                    raise RuntimeError(f"OCRエンジンの結果数が入力と一致しません（入力 {len(batch)} / 結果 {len(results)}）")
+            except Exception as e:
+                logger.exception("OCRバッチの処理に失敗しました")
+                with self._metrics_lock:
+                    self.errors += 1
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            self._observe(batch, started)
+
+    def _observe(self, batch, started):
+        with self._metrics_lock:
+            self.batches += 1
+            self.batch_size_sum += len(batch)
+            self.wait_seconds += sum(started - queued_at for _, _, queued_at in batch)
+            for bucket in BATCH_SIZE_BUCKETS:
+                if len(batch) <= bucket:
+                    self.batch_size_counts[bucket] += 1
+
+    def render_prometheus(self):
+        with self._metrics_lock:
+            lines = [
+                '# HELP ocr_service_queue_depth Page images waiting for a batch.',
+                '# TYPE ocr_service_queue_depth gauge',
+                f'ocr_service_queue_depth {self.queue_depth}',
+                '# HELP ocr_service_queue_depth_max Highest queue depth observed.',
+                '# TYPE ocr_service_queue_depth_max gauge',
+                f'ocr_service_queue_depth_max {self.max_queue_depth}',
+                '# HELP ocr_service_requests_total Page images submitted.',
+                '# TYPE ocr_service_requests_total counter',
+                f'ocr_service_requests_total {self.requests}',
+                '# HELP ocr_service_errors_total Batches that failed.',
+                '# TYPE ocr_service_errors_total counter',
+                f'ocr_service_errors_total {self.errors}',
+                '# HELP ocr_service_queue_wait_seconds_total Time images spent queued before their batch ran.',
+                '# TYPE ocr_service_queue_wait_seconds_total counter',
+                f'ocr_service_queue_wait_seconds_total {self.wait_seconds:.6f}',
+                '# HELP ocr_service_batch_size Images per recognition batch.',
+                '# TYPE ocr_service_batch_size histogram',
+            ]
+            for bucket in BATCH_SIZE_BUCKETS:
+                lines.append(f'ocr_service_batch_size_bucket{{le="{bucket}"}} {self.batch_size_counts[bucket]}')
+            lines += [
+                f'ocr_service_batch_size_bucket{{le="+Inf"}} {self.batches}',
+                f'ocr_service_batch_size_sum {self.batch_size_sum}',
+                f'ocr_service_batch_size_count {self.batches}',
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+def encode_image(img_np):
+    buf = BytesIO()
+    np.save(buf, np.ascontiguousarray(img_np), allow_pickle=False)
+    return buf.getvalue()
+
+
+def decode_image(data):
+    return np.load(BytesIO(data), allow_pickle=False)
+
+
+def _to_json_lines(lines):
+    """OCR結果を JSON に変換できる形（numpy を含まない list）にする"""
+    if not lines:
+        return []
+    return [[[[float(x), float(y)] for x, y in box], [str(rec[0]), float(rec[1])]] for box, rec in lines]
+
+
+def make_handler(batcher):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body, content_type='application/json'):
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path != '/ocr':
+                self._reply(404, json.dumps({'error': 'not found'}))
+                return
+            try:
+                img_np = decode_image(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                lines = batcher.ocr(img_np)
+            except Exception as e:
+                self._reply(500, json.dumps({'error': str(e)}, ensure_ascii=False))
+                return
+            self._reply(200, json.dumps({'lines': _to_json_lines(lines)}, ensure_ascii=False))
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._reply(200, batcher.render_prometheus(), 'text/plain; version=0.0.4')
+            elif self.path == '/healthz':
+                import ocr_engine
+                self._reply(200, json.dumps(ocr_engine.readiness(), ensure_ascii=False))
+            else:
+                self._reply(404, json.dumps({'error': 'not found'}))
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    return Handler
+
+
+class OcrService:
+    """OcrBatcher を HTTP で公開するサーバー（port=0 で空きポートを使う）"""
+
+    def __init__(self, batcher=None, host='127.0.0.1', port=0):
+        self.batcher = batcher or OcrBatcher()
+        self.server = ThreadingHTTPServer((host, port), make_handler(self.batcher))
+        self.server.daemon_threads = True
+        self.url = f'http://{host}:{self.server.server_address[1]}'
+        self._thread = threading.Thread(target=self.server.serve_forever, name='ocr-service', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class OcrServiceClient:
+    """HTTP 経由で OCR サービスを呼ぶクライアント（ocr.ocr() 互換）"""
+
+    def __init__(self, url, timeout=300):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def ocr(self, img_np):
+        request = urllib.request.Request(
+            self.url + '/ocr', data=encode_image(img_np),
+            headers={'Content-Type': 'application/x-npy'}, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            lines = json.loads(response.read().decode('utf-8'))['lines']
+        # PaddleOCR と同じく [ページの行リスト] の形で返す
+        return [[[box, tuple(rec)] for box, rec in lines]]
+
+    def ocr_many(self, images):
+        """複数画像を並行して送信し、サービス側で同じバッチにまとめさせる（失敗した送信の例外はそのまま送出する）"""
+        if not images:
+            return []
+        with ThreadPoolExecutor(max_workers=len(images), thread_name_prefix='ocr-client') as executor:
+            futures = [executor.submit(self.ocr, img) for img in images]
+            return [future.result()[0] for future in futures]
+
+
+class _BatcherClient:
+    """プロセス内の OcrBatcher を直接呼ぶクライアント（ocr.ocr() 互換）"""
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    def ocr(self, img_np):
+        return [self.batcher.ocr(img_np)]
+
+    def ocr_many(self, images):
+        futures = [self.batcher.submit(img) for img in images]
+        return [f.result() for f in futures]
+
+
+_client_lock = threading.Lock()
+_client = None
+_local_batcher = None
+
+
+def local_batcher():
+    """プロセス内のバッチャー（必要になった時点で起動）"""
+    global _local_batcher
+    with _client_lock:
+        if _local_batcher is None:
+            _local_batcher = OcrBatcher()
+        return _local_batcher
+
+
+def get_client():
+    """OCR_SERVICE_URL があればサイドカー、なければプロセス内バッチャーを使うクライアント"""
+    global _client
+    if _client is None:
+        client = OcrServiceClient(SERVICE_URL) if SERVICE_URL else _BatcherClient(local_batcher())
+        with _client_lock:
+            if _client is None:
+                _client = client
+    return _client
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batching OCR service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('OCR_SERVICE_PORT', '8765')))
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    import ocr_engine
+    ocr_engine.warm_up()
+    service = OcrService(host=args.host, port=args.port)
+    logger.info("OCR service listening on %s", service.url)
+    try:
+        service.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""受注ファイルのアーカイブ（.zip / .tar.gz / .tgz / .tar）の取り込み
+
+アーカイブはディスクに展開せず、メンバーを1つずつ伸長しながらメモリ上で読み込み、
+解析（load_order_file 相当）はスレッドプールで並列に行う。伸長済み・解析中のメンバーの
+見積もりメモリの合計は memory_budget 以内に抑え、超える場合は先に投入したメンバーの
+解析完了を待つ。1メンバーだけで予算を超えるものは解析せずエラーとして報告する。
+
+解析した表はメンバーごとに compact_order_frame で省メモリ表現にしてから保持する。
+"""
+import hashlib
+import logging
+import os
+import tarfile
+import threading
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pandas as pd
+
+from order_frame import compact_order_frame
+from upload_spool import parser_source
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar.gz', '.tgz', '.tar')
+MEMBER_SUFFIXES = ('.txt',)
+ARCHIVE_MEMORY_BUDGET_MB = int(os.environ.get('ARCHIVE_MEMORY_BUDGET_MB', '512'))
+ARCHIVE_PARSE_WORKERS = int(os.environ.get('ARCHIVE_PARSE_WORKERS', '4'))
+
+REPORT_COLUMNS = ['アーカイブ', 'メンバー', 'サイズ(バイト)', '明細数', 'エラー']
+
+
+def is_archive(name):
+    return name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+class MemberFile(BytesIO):
+    """アーカイブのメンバー（UploadedFile 互換）"""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+class MemberResult:
+    """メンバーごとの解析結果（失敗時は df が None で error に理由）"""
+
+    def __init__(self, name, size, df=None, digest=None, error=None):
+        self.name = name
+        self.size = size
+        self.df = df
+        self.digest = digest
+        self.error = error
+
+    @property
+    def lines(self):
+        return 0 if self.df is None else len(self.df)
+
+
+class MemoryBudget:
+    """見積もりバイト数の予約（合計が上限を超える間は待つ）"""
+
+    def __init__(self, limit_bytes):
+        self.limit = limit_bytes
+        self.in_use = 0
+        self.peak = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes):
+        with self._cond:
+            while self.in_use and self.in_use + nbytes > self.limit:
+                self._cond.wait()
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+
+    def release(self, nbytes):
+        with self._cond:
+            self.in_use -= nbytes
+            self._cond.notify_all()
+
+
+def _is_order_member(name):
+    base = os.path.basename(name)
+    return (name.lower().endswith(MEMBER_SUFFIXES) and not base.startswith('.')
+            and not name.startswith('__MACOSX/'))
+
+
+def iter_members(file):
+    """(メンバー名, 伸長後サイズ, 読み出し関数) を格納順に返す（tar は先頭から順に読むストリーム）"""
+    source = parser_source(file)
+    name = file.name.lower()
+    if name.endswith('.zip'):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _is_order_member(info.filename):
+                    yield info.filename, info.file_size, lambda info=info: archive.read(info)
+    else:
+        kwargs = {'name': source} if isinstance(source, str) else {'fileobj': source}
+        with tarfile.open(mode='r|*', **kwargs) as archive:
+            for member in archive:
+                if member.isfile() and _is_order_member(member.name):
+                    yield member.name, member.size, lambda member=member: archive.extractfile(member).read()
+
+
+def iter_archive_orders(file, load_fn, memory_budget=ARCHIVE_MEMORY_BUDGET_MB * 1024 * 1024,
+                        estimate=lambda size: size, max_workers=ARCHIVE_PARSE_WORKERS):
+    """アーカイブ内の受注ファイルを解析し、MemberResult を格納順に返す（解析が済んだものから順次）"""
+    budget = MemoryBudget(memory_budget)
+
+    def parse(member_name, data, reserved):
+        try:
+            digest = hashlib.sha256(data).hexdigest()
+            df = compact_order_frame(load_fn(MemberFile(data, os.path.basename(member_name))))
+            return MemberResult(member_name, len(data), df, digest)
+        except Exception as e:
+            return MemberResult(member_name, len(data), error=str(e))
+        finally:
+            budget.release(reserved)
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='archive-parse') as executor:
+        try:
+            for member_name, size, read in iter_members(file):
+                reserved = estimate(size)
+                if reserved > budget.limit:
+                    pending.append(MemberResult(member_name, size, error=(
+                        f"メモリ上限（{budget.limit // 1024 // 1024} MB）を超えるため解析できません。")))
+                    continue
+                budget.acquire(reserved)
+                try:
+                    data = read()
+                except BaseException:
+                    budget.release(reserved)
+                    raise
+                pending.append(executor.submit(parse, member_name, data, reserved))
+                del data
+                while pending and (isinstance(pending[0], MemberResult) or pending[0].done()):
+                    head = pending.popleft()
+                    yield head if isinstance(head, MemberResult) else head.result()
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError, zlib.error, OSError) as e:
+            pending.append(MemberResult('', 0, error=f"アーカイブの読み込みエラー: {e}"))
+        while pending:
+            head = pending.popleft()
+            yield head if isinstance(head, MemberResult) else head.result()
+    logger.debug("archive %s: peak reserved %d bytes", file.name, budget.peak)
+
+
+def archive_report(archive_name, results):
+    return pd.DataFrame([
+        {'アーカイブ': archive_name, 'メンバー': r.name, 'サイズ(バイト)': r.size, '明細数': r.lines, 'エラー': r.error or ''}
+        for r in results
+    ], columns=REPORT_COLUMNS)
@@ -0,0 +1,140 @@
+"""受注明細の重複除去（複数ファイルにまたがる同一明細の二重計上を防ぐ）
+
+受注ファイルを取り込むたびに、まずファイル内容のダイジェストで同一ファイルを除き、
+次に明細の識別キーを 64 ビットハッシュにして既出のハッシュ集合と照合する。
+ハッシュ集合はソート済みの uint64 配列なので、1 明細あたり 8 バイトで済む。
+
+識別キー（ORDER_DEDUP_KEY）:
+    line          顧客コード + 伝票番号 + 商品コード + 出現番号（同じ伝票・商品の何行目か）。既定
+    slip_product  顧客コード + 伝票番号 + 商品コード（同じ伝票の同じ商品は1行とみなす）
+    file          ファイル単位の重複のみ除く
+    off           重複除去しない
+
+伝票番号のない明細（PDF の 'PDF受注' や空欄）は明細単位では照合せず、ファイル単位の重複のみ除く。
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+DEDUP_KEYS = ('line', 'slip_product', 'file', 'off')
+DEDUP_KEY = os.environ.get('ORDER_DEDUP_KEY', 'line')
+
+REPORT_COLUMNS = ['ファイル名', '明細数', '重複明細数', '重複分の発注数量', '状態']
+
+# 実際の伝票番号ではない値（PDF の明細はすべてこの伝票番号になる）
+SYNTHETIC_SLIPS = ('PDF受注',)
+
+
+def file_digest(file):
+    with file.getbuffer() as buffer:
+        return hashlib.sha256(buffer).hexdigest()
+
+
+def _unchecked(order_df):
+    """伝票番号のない明細（明細単位では照合しない。別の顧客・別の PDF の明細を重複とみなさないように）"""
+    slips = order_df['伝票番号']
+    return (slips.isna() | slips.astype(str).isin(SYNTHETIC_SLIPS)).to_numpy()
+
+
+def line_hashes(order_df, key='line'):
+    """明細ごとの識別キーの 64 ビットハッシュ"""
+    keys = pd.DataFrame({
+        '顧客コード': (order_df['顧客コード'].astype(str) if '顧客コード' in order_df else pd.Series('', index=order_df.index)).to_numpy(),
+        '伝票番号': order_df['伝票番号'].astype(str).to_numpy(),
+        '商品コード': order_df['商品コード'].astype(str).to_numpy(),
+    })
+    if key == 'line':
+        keys['出現番号'] = keys.groupby(['顧客コード', '伝票番号', '商品コード']).cumcount().to_numpy()
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy(np.uint64)
+
+
+class OrderDeduplicator:
+    """取り込み済みの受注明細のハッシュ集合"""
+
+    def __init__(self, key=DEDUP_KEY):
+        if key not in DEDUP_KEYS:
+            raise ValueError(f"ORDER_DEDUP_KEY は {', '.join(DEDUP_KEYS)} のいずれかです: {key}")
+        self.key = key
+        self.digests = {}
+        self._seen = np.zeros(0, dtype=np.uint64)
+        self.report = []
+
+    def _record(self, name, lines, duplicates, quantity, status):
+        self.report.append({'ファイル名': name, '明細数': lines, '重複明細数': duplicates,
+                            '重複分の発注数量': quantity, '状態': status})
+
+    def hashes(self, order_df):
+        """識別キーのハッシュ（明細単位で照合しない key では None）。add_mask・discard に渡して再計算を省く"""
+        return line_hashes(order_df, self.key) if self.key in ('line', 'slip_product') else None
+
+    def add(self, order_df, name, digest=None):
+        """受注明細を取り込み、既出の明細を除いた表を返す"""
+        kept = self.add_mask(order_df, name, digest)
+        return order_df if kept.all() else order_df[kept]
+
+    def add_mask(self, order_df, name, digest=None, hashes=None):
+        """add と同じく取り込み、残す明細の真偽値配列を返す"""
+        if self.key == 'off':
+            self._record(name, len(order_df), 0, 0, '取り込み')
+            return np.ones(len(order_df), dtype=bool)
+        if digest is not None:
+            if digest in self.digests:
+                self._record(name, len(order_df), len(order_df), int(order_df['発注数量'].sum()),
+                             f"{self.digests[digest]} と同一ファイル")
+                return np.zeros(len(order_df), dtype=bool)
+            self.digests[digest] = name
+        if self.key == 'file':
+            self._record(name, len(order_df), 0, 0, '取り込み')
+            return np.ones(len(order_df), dtype=bool)
+
+        if hashes is None:
+            hashes = line_hashes(order_df, self.key)
+        unchecked = _unchecked(order_df)
+        if self.key == 'slip_product':
+            # ファイル内の重複も除く（最初の行を残す）
+            _, first = np.unique(hashes, return_index=True)
+            fresh = np.zeros(len(hashes), dtype=bool)
+            fresh[first] = True
+        else:
+            fresh = np.ones(len(hashes), dtype=bool)
+        if len(self._seen):
+            pos = np.minimum(np.searchsorted(self._seen, hashes), len(self._seen) - 1)
+            fresh &= self._seen[pos] != hashes
+        fresh |= unchecked
+        # 新しいハッシュだけをソートし、既出の集合へ挿入位置を求めて併合する（集合全体は並べ直さない）
+        new = np.unique(hashes[fresh & ~unchecked])
+        self._seen = np.insert(self._seen, np.searchsorted(self._seen, new), new)
+        duplicates = int((~fresh).sum())
+        self._record(name, len(order_df), duplicates, int(order_df['発注数量'].to_numpy()[~fresh].sum()),
+                     '一部重複' if duplicates else '取り込み')
+        return fresh
+
+    def discard(self, order_df, kept, name, digest=None, hashes=None):
+        """add_mask で取り込んだファイルを取り消す（kept はそのときの戻り値）
+
+        このファイルだけが持ち込んだハッシュとダイジェストを除くので、以降に取り込むファイルの明細は
+        このファイルと重複しているとはみなされない。
+        """
+        self.report = [r for r in self.report if r['ファイル名'] != name]
+        if digest is not None and self.digests.get(digest) == name:
+            del self.digests[digest]
+        if self.key not in ('line', 'slip_product') or not kept.any():
+            return
+        if hashes is None:
+            hashes = line_hashes(order_df, self.key)
+        mine = np.unique(hashes[kept & ~_unchecked(order_df)])
+        pos = np.searchsorted(self._seen, mine)
+        self._seen = np.delete(self._seen, pos[self._seen[np.minimum(pos, len(self._seen) - 1)] == mine])
+
+    @property
+    def duplicates(self):
+        return sum(r['重複明細数'] for r in self.report)
+
+    @property
+    def nbytes(self):
+        return self._seen.nbytes
+
+    def report_frame(self):
+        return pd.DataFrame(self.report, columns=REPORT_COLUMNS)
@@ -0,0 +1,52 @@
+"""受注明細の省メモリ表現
+
+結合した受注明細は顧客名・商品名・チェーン店固有エリアなど同じ文字列が大量に繰り返されるため、
+文字列の列をカテゴリ型（辞書 + 整数コード）にし、発注数量を 32 ビット整数にする。
+商品コード・伝票番号もカテゴリ型にする（他の処理は文字列として比較・並べ替えするので、
+値は文字列のまま、内部の保持だけを整数コードにする）。
+"""
+import numpy as np
+import pandas as pd
+
+CATEGORY_COLUMNS = ['顧客コード', '顧客名', '伝票番号', '商品コード', '商品名漢字', '商品名カナ', 'チェーン店固有エリア']
+
+
+def _string_category(values):
+    """文字列のカテゴリ型にする（数値の列は辞書側だけを文字列にする。欠損は欠損のまま）"""
+    values = values.astype('category')
+    categories = values.cat.categories
+    if categories.dtype == object and all(isinstance(c, str) for c in categories):
+        return values
+    labels = categories.astype(str)
+    if labels.is_unique:
+        return values.cat.rename_categories(labels)
+    # 1 と '1' のように文字列にすると重なる値が混在する場合
+    return values.astype(object).where(values.isna(), values.astype(str)).astype('category')
+
+
+def compact_order_frame(order_df):
+    """受注明細をカテゴリ型・int32 にした表を返す（列の並びと値は変えない）"""
+    columns = {}
+    for column in order_df.columns:
+        values = order_df[column]
+        if column in CATEGORY_COLUMNS and not isinstance(values.dtype, pd.CategoricalDtype):
+            values = _string_category(values)
+        elif column == '発注数量':
+            values = values.astype(np.int32)
+        columns[column] = values
+    return pd.DataFrame(columns, index=order_df.index)
+
+
+def order_memory_report(before, after):
+    """変換前後のメモリ使用量（文字列の実体を含む）"""
+    lines = max(len(before), 1)
+    before_bytes = int(before.memory_usage(deep=True, index=False).sum())
+    after_bytes = int(after.memory_usage(deep=True, index=False).sum())
+    return {
+        '明細数': len(before),
+        '変換前(バイト)': before_bytes,
+        '変換後(バイト)': after_bytes,
+        '変換前(バイト/明細)': before_bytes / lines,
+        '変換後(バイト/明細)': after_bytes / lines,
+        '削減率': 1 - after_bytes / before_bytes if before_bytes else 0.0,
+    }
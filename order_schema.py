@@ -0,0 +1,167 @@
+"""受注TSVの列の特定（ヘッダー名 -> 列位置）
+
+受注ファイルはヘッダー行の列名から必要な項目の位置を求め、読み込みではその列だけを
+指定して解析する。求めた列の対応（列計画）はヘッダー行のフィンガープリントごとに
+キャッシュするので、同じレイアウトのファイルはヘッダーを1行読むだけで済む。
+
+列名で見つからない項目は従来の固定位置（LEGACY_POSITIONS）を使い、警告をログに出す。
+固定位置の列が別の項目の列名だった場合や、列数が足りない場合は OrderSchemaError。
+
+従来のエクスポートと同じ列数（LEGACY_COLUMN_COUNT）のファイルでは、「数量」「商品名」のような
+一般的な列名（GENERIC_ALIASES）は固定位置の列にある場合だけ使う（144列のうち別の列が
+同じ名前のことがある）。固定位置と異なる列を列名で使った項目は警告をログに出す。
+"""
+import hashlib
+import logging
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# 項目名: 列名の候補（優先順。NFKC 正規化・空白除去後に完全一致で比較する）
+ORDER_FIELDS = {
+    '顧客コード': ('顧客コード', '得意先コード', '出荷先コード', '取引先コード', '店舗コード'),
+    '顧客名': ('顧客名', '得意先名', '出荷先名', '取引先名', '店舗名'),
+    '伝票番号': ('伝票番号', '伝票No', '伝票NO', '伝票No.', '受注番号'),
+    '商品コード': ('商品コード', '品目コード', '受注品目コード', '品番'),
+    '商品名漢字': ('商品名漢字', '商品名(漢字)', '品名漢字', '商品名'),
+    '商品名カナ': ('商品名カナ', '商品名(カナ)', '品名カナ'),
+    '発注数量': ('発注数量', '受注数量', '発注数', '数量'),
+    'チェーン店固有エリア': ('チェーン店固有エリア', '固有エリア'),
+}
+
+# 従来のエクスポートでの列位置（0始まり）
+LEGACY_POSITIONS = {
+    '顧客コード': 14,
+    '顧客名': 15,
+    '伝票番号': 38,
+    '商品コード': 97,
+    '商品名漢字': 106,
+    '商品名カナ': 108,
+    '発注数量': 118,
+    'チェーン店固有エリア': 143,
+}
+
+LEGACY_COLUMN_COUNT = 144
+
+# 別の項目の列にも使われうる列名
+GENERIC_ALIASES = ('数量', '商品名', '品番', '受注番号', '店舗コード', '店舗名')
+
+HEADER_SCAN_BYTES = 1 << 20
+
+
+class OrderSchemaError(ValueError):
+    """受注ファイルの列を特定できない"""
+
+
+class ColumnPlan:
+    """項目ごとの列位置と、その求め方（'header' / 'legacy'）
+
+    moved は従来レイアウトの列数のファイルで、固定位置と異なる列を列名で使った項目。
+    """
+
+    def __init__(self, positions, sources, fingerprint='', moved=()):
+        self.positions = positions
+        self.sources = sources
+        self.fingerprint = fingerprint
+        self.moved = list(moved)
+
+    @property
+    def usecols(self):
+        return sorted(set(self.positions.values()))
+
+    @property
+    def fallback_fields(self):
+        return [field for field, source in self.sources.items() if source == 'legacy']
+
+
+def _normalize(name):
+    return ''.join(unicodedata.normalize('NFKC', str(name)).split()).strip('"')
+
+
+_ALIASES = {field: [_normalize(a) for a in aliases] for field, aliases in ORDER_FIELDS.items()}
+_GENERIC = {_normalize(a) for a in GENERIC_ALIASES}
+
+
+def header_line(buffer):
+    """バッファ（bytes / memoryview）の先頭行（改行を含まない bytes）"""
+    head = bytes(buffer[:HEADER_SCAN_BYTES])
+    return head.split(b'\n', 1)[0].rstrip(b'\r')
+
+
+def header_fingerprint(line, encoding):
+    return hashlib.sha1(encoding.encode('ascii') + b'\0' + line).hexdigest()[:16]
+
+
+def resolve_plan(names, fingerprint=''):
+    """ヘッダーの列名リストから列計画を作る"""
+    first_position = {}
+    for i, name in enumerate(names):
+        first_position.setdefault(_normalize(name), i)
+    legacy_layout = len(names) == LEGACY_COLUMN_COUNT
+    positions, sources = {}, {}
+    claimed = {}
+    moved = []
+    for field, aliases in _ALIASES.items():
+        # 候補の順に優先する（同じ列名が複数あれば左側の列）
+        candidates = [(a, first_position[a]) for a in aliases if a in first_position and first_position[a] not in claimed]
+        if legacy_layout:
+            candidates = [(a, pos) for a, pos in candidates if a not in _GENERIC or pos == LEGACY_POSITIONS[field]]
+        if candidates:
+            pos = candidates[0][1]
+            positions[field], sources[field] = pos, 'header'
+            claimed[pos] = field
+            if legacy_layout and pos != LEGACY_POSITIONS[field]:
+                moved.append(field)
+    for field, pos in LEGACY_POSITIONS.items():
+        if field in positions:
+            continue
+        if pos >= len(names):
+            raise OrderSchemaError(
+                f"受注ファイルに「{field}」列が見つかりません（列名の候補: {', '.join(ORDER_FIELDS[field])}）。")
+        if pos in claimed:
+            raise OrderSchemaError(
+                f"「{field}」列が見つかりません。従来の位置（{pos + 1}列目）は「{claimed[pos]}」列です。")
+        positions[field], sources[field] = pos, 'legacy'
+    return ColumnPlan(positions, sources, fingerprint, moved)
+
+
+class PlanCache:
+    """ヘッダーのフィンガープリント -> 列計画"""
+
+    def __init__(self):
+        self._plans = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def plan_for(self, buffer, encoding):
+        """バッファの先頭行から列計画を求める（同じヘッダーならキャッシュを使う）"""
+        line = header_line(buffer)
+        fingerprint = header_fingerprint(line, encoding)
+        with self._lock:
+            plan = self._plans.get(fingerprint)
+            if plan is not None:
+                self.hits += 1
+                return plan
+        names = line.decode(encoding).split('\t')
+        plan = resolve_plan(names, fingerprint)
+        if plan.fallback_fields:
+            logger.warning("受注ファイルの列名が見つからないため従来の列位置を使います: %s",
+                           ', '.join(f"{f}={plan.positions[f] + 1}列目" for f in plan.fallback_fields))
+        if plan.moved:
+            logger.warning("受注ファイルの列が従来の位置と異なります: %s",
+                           ', '.join(f"{f}={plan.positions[f] + 1}列目（従来 {LEGACY_POSITIONS[f] + 1}列目）"
+                                     for f in plan.moved))
+        with self._lock:
+            self._plans[fingerprint] = plan
+            self.misses += 1
+        return plan
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.hits = self.misses = 0
+
+
+plan_cache = PlanCache()
@@ -0,0 +1,196 @@
+"""PDF受注解析のステージ別・ページ別計測
+
+process_pdf_order の各ステージ（レンダリング / OCR / ヘッダー検出 / 行抽出）の
+所要時間とボックス数・抽出行数・フォールバック座標の使用状況を記録し、
+JSON Lines と Prometheus 形式のテキストとして出力する。
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+STAGES = ('render', 'ocr', 'header', 'rows')
+FALLBACK_COORDS = ('prod_x', 'qty_x', 'header_y')
+
+# 出力先ディレクトリ（環境変数で変更可能）
+METRICS_DIR = os.environ.get('PDF_METRICS_DIR', 'metrics')
+
+
+class PdfMetrics:
+    """1ファイル分の計測結果"""
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self.pages = []
+        self.total_seconds = 0.0
+        self.error = None
+        # 利用者に伝える警告（ページ単位のOCR失敗など）。ワーカースレッドから追記する
+        self.warnings = []
+        self._t0 = time.perf_counter()
+
+    def new_page(self, page_index):
+        page = {
+            'page': page_index + 1,
+            'width': 0,
+            'height': 0,
+            'boxes': 0,
+            'rows': 0,
+            'fallback': [],
+            'ocr_failed': False,
+            'ocr_pixels': 0,
+            'template': False,
+        }
+        for stage in STAGES:
+            page[f'{stage}_s'] = 0.0
+        self.pages.append(page)
+        return page
+
+    @contextmanager
+    def stage(self, page, name):
+        """ページの指定ステージの経過時間を加算する"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            page[f'{name}_s'] += time.perf_counter() - t0
+
+    def finish(self, error=None):
+        self.total_seconds = time.perf_counter() - self._t0
+        self.error = error
+        registry.observe(self)
+        return self
+
+    def to_records(self):
+        """ページ単位のレコード（JSON Lines 1行 = 1ページ）"""
+        records = []
+        for page in self.pages:
+            record = {'file': self.file_name, 'started_at': self.started_at}
+            record.update(page)
+            records.append(record)
+        if not records:
+            records.append({
+                'file': self.file_name,
+                'started_at': self.started_at,
+                'page': None,
+                'error': self.error,
+            })
+        return records
+
+    def summary(self):
+        """ファイル単位の集計"""
+        row = {
+            'ファイル': self.file_name,
+            'ページ数': len(self.pages),
+            '合計(秒)': round(self.total_seconds, 3),
+        }
+        for stage in STAGES:
+            row[f'{stage}(秒)'] = round(sum(p[f'{stage}_s'] for p in self.pages), 3)
+        row['ボックス数'] = sum(p['boxes'] for p in self.pages)
+        row['抽出行数'] = sum(p['rows'] for p in self.pages)
+        row['フォールバック'] = sum(1 for p in self.pages if p['fallback'])
+        row['テンプレート適用'] = sum(1 for p in self.pages if p['template'])
+        row['認識画素数'] = sum(p['ocr_pixels'] for p in self.pages)
+        return row
+
+    def write_jsonl(self, path=None):
+        path = path or os.path.join(METRICS_DIR, 'pdf_metrics.jsonl')
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            for record in self.to_records():
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return path
+
+
+class MetricsRegistry:
+    """プロセス全体の累積カウンタ（Prometheus テキスト出力用）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.files = 0
+            self.file_errors = 0
+            self.pages = 0
+            self.boxes = 0
+            self.rows = 0
+            self.ocr_failures = 0
+            self.ocr_pixels = 0
+            self.template_pages = 0
+            self.stage_seconds = {stage: 0.0 for stage in STAGES}
+            self.fallbacks = {coord: 0 for coord in FALLBACK_COORDS}
+
+    def observe(self, metrics):
+        with self._lock:
+            self.files += 1
+            if metrics.error:
+                self.file_errors += 1
+            for page in metrics.pages:
+                self.pages += 1
+                self.boxes += page['boxes']
+                self.rows += page['rows']
+                if page['ocr_failed']:
+                    self.ocr_failures += 1
+                self.ocr_pixels += page['ocr_pixels']
+                if page['template']:
+                    self.template_pages += 1
+                for stage in STAGES:
+                    self.stage_seconds[stage] += page[f'{stage}_s']
+                for coord in page['fallback']:
+                    self.fallbacks[coord] += 1
+
+    def render_prometheus(self):
+        with self._lock:
+            lines = [
+                '# HELP pdf_files_total Processed PDF files.',
+                '# TYPE pdf_files_total counter',
+                f'pdf_files_total {self.files}',
+                '# HELP pdf_file_errors_total PDF files that raised an error.',
+                '# TYPE pdf_file_errors_total counter',
+                f'pdf_file_errors_total {self.file_errors}',
+                '# HELP pdf_pages_total Processed PDF pages.',
+                '# TYPE pdf_pages_total counter',
+                f'pdf_pages_total {self.pages}',
+                '# HELP pdf_ocr_failures_total Pages whose OCR call failed.',
+                '# TYPE pdf_ocr_failures_total counter',
+                f'pdf_ocr_failures_total {self.ocr_failures}',
+                '# HELP pdf_ocr_boxes_total Text boxes returned by OCR.',
+                '# TYPE pdf_ocr_boxes_total counter',
+                f'pdf_ocr_boxes_total {self.boxes}',
+                '# HELP pdf_rows_extracted_total Order rows extracted from PDFs.',
+                '# TYPE pdf_rows_extracted_total counter',
+                f'pdf_rows_extracted_total {self.rows}',
+                '# HELP pdf_ocr_pixels_total Pixels passed to OCR.',
+                '# TYPE pdf_ocr_pixels_total counter',
+                f'pdf_ocr_pixels_total {self.ocr_pixels}',
+                '# HELP pdf_template_pages_total Pages OCR-ed with a learned layout template.',
+                '# TYPE pdf_template_pages_total counter',
+                f'pdf_template_pages_total {self.template_pages}',
+                '# HELP pdf_stage_seconds_total Time spent per pipeline stage.',
+                '# TYPE pdf_stage_seconds_total counter',
+            ]
+            for stage in STAGES:
+                lines.append(f'pdf_stage_seconds_total{{stage="{stage}"}} {self.stage_seconds[stage]:.6f}')
+            lines += [
+                '# HELP pdf_fallback_coords_total Pages that used a fallback coordinate.',
+                '# TYPE pdf_fallback_coords_total counter',
+            ]
+            for coord in FALLBACK_COORDS:
+                lines.append(f'pdf_fallback_coords_total{{coord="{coord}"}} {self.fallbacks[coord]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path=None):
+        path = path or os.path.join(METRICS_DIR, 'pdf_metrics.prom')
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+        return path
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,117 @@
+"""不足確認の実行プロファイル（オプトイン）
+
+環境変数 ALLOCATION_PROFILE=1 または URL の ?profile=1 で有効になる。
+有効時はステージ（在庫読み込み・受注読み込み・OCR結果取り込み・引当計算・結果表示）ごとに
+経過時間・CPU時間・RSS の増減を記録し、必要ならサンプリングプロファイラで
+実行全体のスタックを collapsed 形式（flamegraph.pl / speedscope で読める）で保存する。
+無効時は共有の nullcontext を返すだけで、計測処理は一切行わない。
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+PROFILE_ENV = 'ALLOCATION_PROFILE'
+SAMPLE_INTERVAL = float(os.environ.get('ALLOCATION_PROFILE_INTERVAL_MS', '5')) / 1000
+
+_NULL_STAGE = nullcontext()
+
+
+def profiling_requested(query_params=None):
+    """環境変数または ?profile=1 でプロファイルが要求されているか"""
+    if os.environ.get(PROFILE_ENV, '').lower() in ('1', 'true', 'yes'):
+        return True
+    return bool(query_params) and query_params.get('profile') in ('1', 'true')
+
+
+def current_rss_bytes():
+    """現在の常駐メモリ（取得できなければ None）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class NullProfiler:
+    """プロファイル無効時のダミー（オーバーヘッドなし）"""
+
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def stop(self):
+        pass
+
+
+class RunProfiler:
+    """ステージ別の経過時間・CPU時間・メモリ増減と、任意のサンプリングプロファイル"""
+
+    enabled = True
+
+    def __init__(self, sampling=True, interval=SAMPLE_INTERVAL):
+        self.stages = []
+        self.samples = Counter()
+        self.interval = interval
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started = time.perf_counter()
+        self.total_s = None
+        if sampling:
+            self._sampler = threading.Thread(target=self._sample, name='run-profiler', daemon=True)
+            self._sampler.start()
+
+    @contextmanager
+    def stage(self, name):
+        rss_before = current_rss_bytes()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            rss_after = current_rss_bytes()
+            self.stages.append({
+                'stage': name,
+                'wall_s': time.perf_counter() - wall,
+                'cpu_s': time.thread_time() - cpu,
+                'rss_delta_mb': (rss_after - rss_before) / 1024 / 1024 if rss_before is not None and rss_after is not None else None,
+            })
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        if self.total_s is None:
+            self.total_s = time.perf_counter() - self._started
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def records(self):
+        """ステージ別の記録（合計に対する割合付き）"""
+        total = sum(s['wall_s'] for s in self.stages) or 1.0
+        return [dict(s, share=s['wall_s'] / total) for s in self.stages]
+
+    def collapsed_stacks(self):
+        """サンプリング結果を collapsed 形式（"f1;f2;f3 回数"）で返す"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def start_profiler(query_params=None, sampling=True):
+    """要求されていれば RunProfiler を、そうでなければ NullProfiler を返す"""
+    if not profiling_requested(query_params):
+        return NullProfiler()
+    return RunProfiler(sampling=sampling)
@@ -0,0 +1,116 @@
+"""不足商品の在庫を伝票（または顧客）ごとに割り当てる
+
+不足している商品だけを対象に、利用可能な在庫（倉庫在庫数 + 入庫予定、負の場合は 0）を
+方針に従って伝票・顧客へ配分し、割当数と不足数を返す。商品ごとのループは使わず、
+商品でソートした配列上の区間累計（cumsum）と順位で計算する。
+
+方針:
+    proportional  受注数量に比例して配分（端数は剰余の大きい順に1個ずつ、同順位は伝票番号順）
+    priority      優先顧客リストの順に受注数量まで満たす（リスト外の顧客は後ろ、伝票番号順）
+    minimum       まず各伝票に最低数（受注数量が少なければその数）を伝票番号順に配り、残りを比例配分
+"""
+import numpy as np
+import pandas as pd
+
+SPECIAL_CODE = '19005'
+
+PROPORTIONAL = 'proportional'
+PRIORITY = 'priority'
+MINIMUM = 'minimum'
+POLICY_LABELS = {
+    PROPORTIONAL: '受注数量に比例',
+    PRIORITY: '優先顧客順',
+    MINIMUM: '最低数を確保して比例',
+}
+UNITS = ('伝票番号', '顧客コード')
+
+
+def _group_first(product):
+    """各要素について、同じ商品の先頭位置（product は昇順にソート済み）"""
+    if not len(product):
+        return np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, product[1:] != product[:-1]])
+    return np.repeat(starts, np.diff(np.r_[starts, len(product)]))
+
+
+def _group_cumsum(product, values):
+    """商品ごとの累計（自身を含む）。product は昇順にソート済み"""
+    total = np.cumsum(values)
+    first = _group_first(product)
+    return total - (total[first] - values[first])
+
+
+def fill_in_order(product, quantity, available):
+    """並び順に受注数量まで満たす（product は昇順、同じ商品内は配分順に並んでいること）"""
+    before = _group_cumsum(product, quantity) - quantity
+    return np.clip(available[product] - before, 0, quantity)
+
+
+def proportional(product, quantity, available):
+    """受注数量に比例して配分し、端数は剰余の大きい順に配る（最大剰余方式）"""
+    n_products = len(available)
+    total = np.bincount(product, weights=quantity, minlength=n_products).astype(np.int64)
+    cap = np.minimum(available, total)
+    numerator = quantity * cap[product]
+    share, fraction = np.divmod(numerator, np.maximum(total[product], 1))
+    remainder = cap - np.bincount(product, weights=share, minlength=n_products).astype(np.int64)
+
+    # 商品ごとに剰余の大きい順（同じなら元の並び順）に順位を付け、残りの個数分だけ 1 を加える
+    position = np.arange(len(product))
+    order = np.lexsort((position, -fraction, product))
+    rank = np.empty(len(product), dtype=np.int64)
+    rank[order] = position - _group_first(product[order])
+    return share + (rank < remainder[product])
+
+
+def ration(allocation_df, order_df, policy=PROPORTIONAL, unit='伝票番号', priority=(), minimum=1):
+    """不足商品の伝票（unit='顧客コード' なら顧客）ごとの受注数・割当数・不足数
+
+    allocation_df は calculate_allocation（または AllocationState.frame）の表、order_df は受注明細。
+    """
+    if policy not in POLICY_LABELS:
+        raise ValueError(f"不明な配分方針です: {policy}")
+    if unit not in UNITS:
+        raise ValueError(f"配分の単位は {' / '.join(UNITS)} のいずれかです: {unit}")
+    short = allocation_df[(allocation_df['引当後在庫'] < 0) & (allocation_df['商品コード'] != SPECIAL_CODE)]
+    short = short.sort_values('商品コード')
+    codes = pd.Index(short['商品コード'].astype(str))
+    available = np.maximum(short['倉庫在庫数'].to_numpy(np.int64), 0)
+
+    columns = list(dict.fromkeys(['商品コード', unit, '顧客コード', '顧客名', '発注数量']))
+    lines = order_df.loc[order_df['商品コード'].astype(str).isin(codes), columns]
+    lines = lines.astype({'商品コード': str, unit: str, '顧客コード': str, '顧客名': str})
+    keys = ['商品コード', unit]
+    aggregations = {'受注数': ('発注数量', 'sum'), '顧客名': ('顧客名', 'first')}
+    if unit != '顧客コード':
+        aggregations['顧客コード'] = ('顧客コード', 'first')
+    grouped = lines.groupby(keys, sort=True).agg(**aggregations).reset_index()
+
+    product = codes.get_indexer(grouped['商品コード']).astype(np.int64)
+    quantity = grouped['受注数'].to_numpy(np.int64)
+    if policy == PRIORITY:
+        rank = pd.Index([str(c) for c in priority]).get_indexer(grouped['顧客コード'])
+        rank = np.where(rank < 0, len(priority), rank)
+        order = np.lexsort((np.arange(len(grouped)), rank, product))
+        allocated = np.empty(len(grouped), dtype=np.int64)
+        allocated[order] = fill_in_order(product[order], quantity[order], available)
+    elif policy == MINIMUM:
+        floor = fill_in_order(product, np.minimum(quantity, minimum), available)
+        left = available - np.bincount(product, weights=floor, minlength=len(codes)).astype(np.int64)
+        allocated = floor + proportional(product, quantity - floor, left)
+    else:
+        allocated = proportional(product, quantity, available)
+
+    names = short['商品名'].to_numpy(object) if '商品名' in short else np.full(len(codes), '', dtype=object)
+    result = pd.DataFrame({
+        '商品コード': grouped['商品コード'],
+        '商品名': names[product],
+        unit: grouped[unit],
+    })
+    if unit != '顧客コード':
+        result['顧客コード'] = grouped['顧客コード']
+    result['顧客名'] = grouped['顧客名']
+    result['受注数'] = quantity
+    result['割当数'] = allocated
+    result['不足数'] = quantity - allocated
+    return result
@@ -0,0 +1,203 @@
+"""不足確認の実行履歴（SQLite）
+
+不足確認のたびに引当結果（商品ごと）と不足明細（伝票ごと）を追記し、
+商品コード・伝票番号・顧客コード・実行日時で索引を張る。日別の不足集計
+（daily_shortages）は記録時に更新するので、「今週毎日不足した商品」のような
+傾向は明細を走査せずに数ミリ秒で引ける。保持期間を過ぎた明細は compact() で
+削除し、日別集計はより長く残す。
+"""
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+HISTORY_DB = os.environ.get('RUN_HISTORY_DB', os.path.join('.run_history', 'run_history.sqlite3'))
+DETAIL_RETENTION_DAYS = int(os.environ.get('RUN_HISTORY_DETAIL_DAYS', '90'))
+ROLLUP_RETENTION_DAYS = int(os.environ.get('RUN_HISTORY_ROLLUP_DAYS', '400'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_at        TEXT NOT NULL,
+    inventory     TEXT,
+    order_files   TEXT,
+    products      INTEGER NOT NULL,
+    shortages     INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_run_at ON runs (run_at);
+
+CREATE TABLE IF NOT EXISTS run_items (
+    run_id        INTEGER NOT NULL,
+    run_at        TEXT NOT NULL,
+    product_code  TEXT NOT NULL,
+    product_name  TEXT,
+    stock         INTEGER NOT NULL,
+    ordered       INTEGER NOT NULL,
+    remaining     INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_run_items_product ON run_items (product_code, run_at);
+CREATE INDEX IF NOT EXISTS idx_run_items_run_at ON run_items (run_at);
+
+CREATE TABLE IF NOT EXISTS shortage_lines (
+    run_id        INTEGER NOT NULL,
+    run_at        TEXT NOT NULL,
+    product_code  TEXT NOT NULL,
+    slip_no       TEXT NOT NULL,
+    customer_code TEXT,
+    customer_name TEXT,
+    shortage      INTEGER NOT NULL,
+    quantity      INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_shortage_lines_product ON shortage_lines (product_code, run_at);
+CREATE INDEX IF NOT EXISTS idx_shortage_lines_slip ON shortage_lines (slip_no);
+CREATE INDEX IF NOT EXISTS idx_shortage_lines_customer ON shortage_lines (customer_code, run_at);
+CREATE INDEX IF NOT EXISTS idx_shortage_lines_run_at ON shortage_lines (run_at);
+
+CREATE TABLE IF NOT EXISTS daily_shortages (
+    day           TEXT NOT NULL,
+    product_code  TEXT NOT NULL,
+    product_name  TEXT,
+    runs_short    INTEGER NOT NULL,
+    max_shortage  INTEGER NOT NULL,
+    PRIMARY KEY (day, product_code)
+);
+CREATE INDEX IF NOT EXISTS idx_daily_shortages_product ON daily_shortages (product_code, day);
+"""
+
+
+def _iso(ts):
+    return ts.isoformat(timespec='seconds')
+
+
+class RunHistory:
+    """引当結果・不足明細の永続履歴"""
+
+    def __init__(self, db_path=HISTORY_DB):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            # 受注数量の列がない版の履歴に追加する（追加前の明細は数量なしとして扱う）
+            if 'quantity' not in {row['name'] for row in conn.execute("PRAGMA table_info(shortage_lines)")}:
+                conn.execute("ALTER TABLE shortage_lines ADD COLUMN quantity INTEGER")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def record_run(self, allocation_df, order_df, inventory=None, order_files=(), run_at=None):
+        """1回分の引当結果と不足明細を追記し、run_id を返す"""
+        run_at = _iso(run_at or datetime.now())
+        day = run_at[:10]
+        items = allocation_df[['商品コード', '商品名', '倉庫在庫数', '受注合計数', '引当後在庫']]
+        short = items[(items['引当後在庫'] < 0) & (items['商品コード'] != '19005')]
+        shortage = (-short['引当後在庫']).astype(int)
+
+        # 不足商品の受注明細（商品・伝票・顧客ごとに受注数量を合算）
+        lines = order_df.loc[order_df['商品コード'].astype(str).isin(short['商品コード']),
+                             ['商品コード', '伝票番号', '顧客コード', '顧客名', '発注数量']]
+        lines = lines.astype({'商品コード': str, '伝票番号': str, '顧客コード': str, '顧客名': str})
+        lines = lines.groupby(['商品コード', '伝票番号', '顧客コード'], sort=False, as_index=False).agg(
+            顧客名=('顧客名', 'first'), 発注数量=('発注数量', 'sum'))
+        lines = lines.merge(pd.DataFrame({'商品コード': short['商品コード'].astype(str), '不足数': shortage}), on='商品コード')
+
+        with self._lock, self._connect() as conn:
+            run_id = conn.execute(
+                "INSERT INTO runs (run_at, inventory, order_files, products, shortages) VALUES (?, ?, ?, ?, ?)",
+                (run_at, inventory, ', '.join(order_files), len(items), len(short))).lastrowid
+            conn.executemany(
+                "INSERT INTO run_items VALUES (?, ?, ?, ?, ?, ?, ?)",
+                zip([run_id] * len(items), [run_at] * len(items), items['商品コード'].astype(str),
+                    items['商品名'].astype(str), items['倉庫在庫数'].astype(int).tolist(),
+                    items['受注合計数'].astype(int).tolist(), items['引当後在庫'].astype(int).tolist()))
+            conn.executemany(
+                "INSERT INTO shortage_lines VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                zip([run_id] * len(lines), [run_at] * len(lines), lines['商品コード'],
+                    lines['伝票番号'], lines['顧客コード'], lines['顧客名'],
+                    lines['不足数'].astype(int).tolist(), lines['発注数量'].astype(int).tolist()))
+            conn.executemany(
+                "INSERT INTO daily_shortages VALUES (?, ?, ?, 1, ?) "
+                "ON CONFLICT (day, product_code) DO UPDATE SET runs_short = runs_short + 1, "
+                "max_shortage = MAX(max_shortage, excluded.max_shortage), product_name = excluded.product_name",
+                zip([day] * len(short), short['商品コード'].astype(str), short['商品名'].astype(str), shortage.tolist()))
+        return run_id
+
+    def _query(self, sql, params):
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return pd.DataFrame([dict(r) for r in rows])
+
+    def recurring_shortages(self, days=7, min_days=2, now=None):
+        """直近 days 日で min_days 日以上不足した商品（不足日数の多い順）"""
+        since = ((now or datetime.now()) - timedelta(days=days - 1)).date().isoformat()
+        df = self._query(
+            "SELECT product_code AS 商品コード, MAX(product_name) AS 商品名, COUNT(*) AS 不足日数, "
+            "SUM(runs_short) AS 不足回数, MAX(max_shortage) AS 最大不足数, MAX(day) AS 最終不足日 "
+            "FROM daily_shortages WHERE day >= ? GROUP BY product_code HAVING COUNT(*) >= ? "
+            "ORDER BY 不足日数 DESC, 最大不足数 DESC", (since, min_days))
+        if not df.empty:
+            run_days = self.run_days(days, now)
+            df['実行日数'] = run_days
+            df['毎日不足'] = df['不足日数'] >= run_days
+        return df
+
+    def run_days(self, days=7, now=None):
+        """直近 days 日のうち不足確認を実行した日数"""
+        since = ((now or datetime.now()) - timedelta(days=days - 1)).date().isoformat()
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(DISTINCT substr(run_at, 1, 10)) FROM runs WHERE run_at >= ?",
+                                (since,)).fetchone()[0]
+
+    def customer_impact(self, days=7, now=None):
+        """直近 days 日の顧客別の不足影響（伝票数・商品数・按分不足数）
+
+        不足数(按分) は DemandMatrix.customer_exposure と同じく、商品の不足数を顧客の受注数量に比例して
+        割り当てた値（受注数量 × 不足数 / 受注合計数）の合計。商品ごとに、その顧客が最後に不足した実行の
+        値を使うので、再実行しても重ねて数えない。受注数量を記録していない版の明細は 0 として扱う。
+        """
+        since = _iso((now or datetime.now()) - timedelta(days=days))
+        return self._query(
+            "WITH per_customer AS ("
+            "  SELECT run_id, product_code, customer_code, SUM(quantity) AS quantity, MAX(shortage) AS shortage "
+            "  FROM shortage_lines WHERE run_at >= ? GROUP BY run_id, product_code, customer_code), "
+            "latest AS ("
+            "  SELECT product_code, customer_code, MAX(run_id) AS run_id FROM per_customer "
+            "  GROUP BY product_code, customer_code), "
+            "shares AS ("
+            "  SELECT c.customer_code, "
+            "  ROUND(SUM(COALESCE(c.quantity, 0) * MIN(c.shortage * 1.0 / MAX(i.ordered, 1), 1.0)), 1) AS shortage "
+            "  FROM latest l JOIN per_customer c USING (run_id, product_code, customer_code) "
+            "  JOIN run_items i USING (run_id, product_code) GROUP BY c.customer_code) "
+            "SELECT s.customer_code AS 顧客コード, MAX(s.customer_name) AS 顧客名, "
+            "COUNT(DISTINCT s.slip_no) AS 不足伝票数, COUNT(DISTINCT s.product_code) AS 不足商品数, "
+            "MAX(shares.shortage) AS \"不足数(按分)\", MAX(s.run_at) AS 最終発生 "
+            "FROM shortage_lines s JOIN shares USING (customer_code) WHERE s.run_at >= ? GROUP BY s.customer_code "
+            "ORDER BY 不足伝票数 DESC, \"不足数(按分)\" DESC", (since, since))
+
+    def product_history(self, product_code, days=30, now=None):
+        """商品ごとの実行別の在庫・受注・引当後在庫の推移"""
+        since = _iso((now or datetime.now()) - timedelta(days=days))
+        return self._query(
+            "SELECT run_at AS 実行日時, stock AS 倉庫在庫数, ordered AS 受注合計数, remaining AS 引当後在庫 "
+            "FROM run_items WHERE product_code = ? AND run_at >= ? ORDER BY run_at", (product_code, since))
+
+    def compact(self, detail_days=DETAIL_RETENTION_DAYS, rollup_days=ROLLUP_RETENTION_DAYS, now=None):
+        """保持期間を過ぎた明細と日別集計を削除する（削除した明細行数を返す）"""
+        now = now or datetime.now()
+        detail_cutoff = _iso(now - timedelta(days=detail_days))
+        rollup_cutoff = (now - timedelta(days=rollup_days)).date().isoformat()
+        with self._lock, self._connect() as conn:
+            removed = conn.execute("DELETE FROM run_items WHERE run_at < ?", (detail_cutoff,)).rowcount
+            removed += conn.execute("DELETE FROM shortage_lines WHERE run_at < ?", (detail_cutoff,)).rowcount
+            # 実行の一覧は実行日数の集計に使うので、日別集計と同じ期間残す
+            conn.execute("DELETE FROM runs WHERE run_at < ?", (rollup_cutoff,))
+            conn.execute("DELETE FROM daily_shortages WHERE day < ?", (rollup_cutoff,))
+        if removed:
+            with self._connect() as conn:
+                conn.execute("VACUUM")
+        return removed
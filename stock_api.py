@@ -0,0 +1,222 @@
+"""商品別の引当可能数を返すローカル JSON API
+
+直近の不足確認結果（差分適用後、What-if の上書きは含まない）を商品コードのハッシュ索引付きで
+公開し、ハンディ端末などから商品ごとの在庫・受注合計・引当後在庫・該当伝票を引けるようにする。
+アプリと同じプロセスでスレッドとして起動する。
+
+結果はブラウザの所有者ID（アプリの URL の ?owner=）ごとに公開する。問い合わせは ?owner= で
+どの結果を引くかを指定する。公開中の結果が1つだけなら省略でき（1人で使う構成）、複数あるのに
+省略した場合は 400。保持する結果は新しいものから MAX_PUBLISHED 件まで。
+
+    STOCK_API_PORT=8766      # 待ち受けポート（既定 8766、off で無効）
+    STOCK_API_HOST=0.0.0.0   # 端末から接続する場合（既定 127.0.0.1）
+
+ポートはアプリ（Streamlit, 8080）とは別なので、コンテナで動かす場合は STOCK_API_HOST=0.0.0.0 を
+設定してポートを公開する（docker run -p 8080:8080 -p 8766:8766 ...）。Cloud Run は 8080 しか
+転送しないため、Cloud Run 上ではこの API には外部から接続できない（STOCK_API_PORT=off を推奨）。
+
+HTTP インターフェース（クエリ文字列 ?owner=<所有者ID> はどのパスでも指定できる）:
+    GET  /stock/<商品コード>   1商品の結果（先頭ゼロは無視）。未登録なら 404
+    POST /stock/lookup        本文: {"codes": [...]} -> {"results": [...], "not_found": [...]}
+    GET  /healthz             公開中の結果の有無・時刻・商品数
+"""
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+API_HOST = os.environ.get('STOCK_API_HOST', '127.0.0.1')
+API_PORT = os.environ.get('STOCK_API_PORT', '8766')
+MAX_BULK_CODES = int(os.environ.get('STOCK_API_MAX_BULK', '5000'))
+# 公開しておく所有者ごとの結果の上限（古いものから捨てる）
+MAX_PUBLISHED = int(os.environ.get('STOCK_API_MAX_PUBLISHED', '32'))
+
+
+def normalize_code(code):
+    return str(code).strip().lstrip('0')
+
+
+class StockIndex:
+    """引当結果の読み取り専用コピーと商品コード索引"""
+
+    def __init__(self, state, label=''):
+        self.label = label
+        self.as_of = datetime.now().isoformat(timespec='seconds')
+        self.index = dict(state.index)
+        self.codes = state.codes.tolist()
+        self.names = state.names.tolist()
+        self.stock = (state.on_hand + state.incoming).tolist()
+        self.ordered = state.ordered.tolist()
+        # What-if の上書きは公開しない
+        self.remaining = state.baseline_remaining().tolist()
+        # 受注明細の索引は作成後に変わらないので共有し、伝票は問い合わせ時に引く
+        self._product_slips = state.product_slips
+
+    def __len__(self):
+        return len(self.codes)
+
+    def lookup(self, code):
+        """商品コードの結果（dict）。未登録なら None"""
+        i = self.index.get(normalize_code(code))
+        if i is None:
+            return None
+        remaining = self.remaining[i]
+        return {
+            'code': self.codes[i],
+            'name': self.names[i],
+            'stock': self.stock[i],
+            'ordered': self.ordered[i],
+            'remaining': remaining,
+            'available': max(remaining, 0),
+            'short': remaining < 0,
+            'slips': [{'slip': slip, 'customer': customer} for slip, customer in self._product_slips(i)],
+        }
+
+    def bulk_lookup(self, codes):
+        results, not_found = [], []
+        for code in codes:
+            record = self.lookup(code)
+            if record is None:
+                not_found.append(str(code))
+            else:
+                results.append(record)
+        return {'results': results, 'not_found': not_found}
+
+
+class AmbiguousOwner(LookupError):
+    """所有者IDの指定がなく、公開中の結果が複数ある"""
+
+
+_published = {}
+_lock = threading.Lock()
+
+
+def publish(state, label='', owner=''):
+    """所有者の最新の引当結果を公開する（参照の差し替えのみなので処理中の問い合わせに影響しない）"""
+    index = StockIndex(state, label)
+    with _lock:
+        _published.pop(owner, None)
+        _published[owner] = index
+        # 古いものから捨てる（dict は登録順）
+        while len(_published) > MAX_PUBLISHED:
+            _published.pop(next(iter(_published)))
+    return index
+
+
+def current(owner=None):
+    """所有者の公開中の結果（未公開なら None）。owner を省略できるのは公開中の結果が1つだけの場合"""
+    with _lock:
+        if owner is not None:
+            return _published.get(owner)
+        if len(_published) > 1:
+            raise AmbiguousOwner(f"公開中の結果が {len(_published)} 件あります。?owner= で所有者IDを指定してください")
+        return next(iter(_published.values()), None)
+
+
+def make_handler(index_fn):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, payload):
+            data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _route(self):
+            """(パス, 所有者ID) を返す（クエリ文字列はルーティングに含めない）"""
+            url = urlsplit(self.path)
+            owner = parse_qs(url.query).get('owner')
+            return url.path, owner[0] if owner else None
+
+        def _index(self, owner):
+            try:
+                index = index_fn(owner)
+            except AmbiguousOwner as e:
+                self._reply(400, {'error': str(e)})
+                return None
+            if index is None:
+                self._reply(503, {'error': '不足確認の結果がまだありません'})
+            return index
+
+        def do_GET(self):
+            path, owner = self._route()
+            if path == '/healthz':
+                try:
+                    index = index_fn(owner)
+                except AmbiguousOwner as e:
+                    self._reply(400, {'error': str(e)})
+                    return
+                self._reply(200, {'ready': index is not None, 'as_of': index and index.as_of,
+                                  'label': index and index.label, 'products': len(index) if index else 0})
+            elif path.startswith('/stock/'):
+                index = self._index(owner)
+                if index is None:
+                    return
+                code = unquote(path[len('/stock/'):])
+                record = index.lookup(code)
+                if record is None:
+                    self._reply(404, {'error': 'not found', 'code': code})
+                else:
+                    self._reply(200, dict(record, as_of=index.as_of))
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            path, owner = self._route()
+            if path != '/stock/lookup':
+                self._reply(404, {'error': 'not found'})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                codes = body['codes']
+                if not isinstance(codes, list) or len(codes) > MAX_BULK_CODES:
+                    raise ValueError(f"codes は {MAX_BULK_CODES} 件以下のリストで指定してください")
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {'error': str(e)})
+                return
+            index = self._index(owner)
+            if index is None:
+                return
+            self._reply(200, dict(index.bulk_lookup(codes), as_of=index.as_of))
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    return Handler
+
+
+class StockApiServer:
+    """StockIndex を HTTP で公開するサーバー（port=0 で空きポートを使う）"""
+
+    def __init__(self, index_fn=current, host=API_HOST, port=0):
+        self.server = ThreadingHTTPServer((host, port), make_handler(index_fn))
+        self.server.daemon_threads = True
+        self.url = f'http://{host}:{self.server.server_address[1]}'
+        self._thread = threading.Thread(target=self.server.serve_forever, name='stock-api', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_server():
+    """環境変数の設定でサーバーを起動する（無効・起動失敗なら None）"""
+    if API_PORT.lower() in ('', 'off', 'none'):
+        return None
+    try:
+        server = StockApiServer(host=API_HOST, port=int(API_PORT)).start()
+    except OSError as e:
+        logger.warning("在庫照会APIを起動できませんでした (%s:%s): %s", API_HOST, API_PORT, e)
+        return None
+    logger.info("在庫照会API: %s", server.url)
+    return server
@@ -0,0 +1,163 @@
+"""受注TSV・速報倉庫在庫ファイルの合成データ生成
+
+実ファイル（o3306679.txt / 速報倉庫在庫.xlsx）と同じ列位置・文字コードのファイルを
+任意の規模で生成する。受注は 144 列・タブ区切り・cp932、在庫は 23 列（ヘッダーなし）の
+xlsx / csv。SKU 数（カーディナリティ）と不足率を指定でき、生成時に
+「不足になるはずの商品コード」を正解として返す。
+
+    python synth_data.py --rows 1000000 --skus 20000 --shortage-rate 0.05 --out bench_data
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+ORDER_COLUMNS = 144
+INVENTORY_COLUMNS = 23
+# 受注ファイルの使用列（load_order_file の usecols と同じ位置）
+ORDER_FIELDS = {
+    14: '顧客コード', 15: '顧客名', 38: '伝票番号', 97: '商品コード',
+    106: '商品名漢字', 108: '商品名カナ', 118: '発注数量', 143: 'チェーン店固有エリア',
+}
+# 在庫ファイルの使用列（load_inventory_file の usecols と同じ位置）
+INVENTORY_FIELDS = {1: '保管場所', 4: 'ロケーション', 8: '商品コード', 10: '入数', 13: '倉庫在庫数', 22: '入庫予定'}
+TARGET_WAREHOUSE = 'A309001'
+XLSX_MAX_ROWS = 1_048_576
+CHUNK_ROWS = 200_000
+
+
+def sku_codes(n_skus):
+    """商品コード（在庫・受注とも先頭ゼロ付きの7桁。30126 と 19005 は含めない）"""
+    codes = np.arange(100000, 100000 + n_skus)
+    return np.char.zfill(codes.astype(str), 7)
+
+
+def _order_chunk(rng, start, n_rows, codes, weights, n_customers, lines_per_slip):
+    index = np.arange(start, start + n_rows)
+    slip = index // lines_per_slip
+    customer = (slip * 7919) % n_customers
+    sku = rng.choice(len(codes), size=n_rows, p=weights)
+    qty = rng.integers(1, 25, size=n_rows)
+    fields = {
+        14: pd.Series(np.char.add('C', np.char.zfill(customer.astype(str), 6))),
+        15: pd.Series(np.char.add('顧客', customer.astype(str))),
+        38: pd.Series((10_000_000 + slip).astype(str)),
+        97: pd.Series(codes[sku]),
+        106: pd.Series(np.char.add('商品', codes[sku])),
+        108: pd.Series(np.char.add('ｼｮｳﾋﾝ', codes[sku])),
+        118: pd.Series(qty.astype(str)),
+        143: pd.Series(np.char.add('店舗商品名', codes[sku])),
+    }
+    return fields, sku, qty
+
+
+def _tsv_lines(fields):
+    """使用列だけ値を入れ、残りは空欄の 144 列の行を組み立てる"""
+    line = None
+    previous = -1
+    for position in sorted(fields):
+        gap = '\t' * (position - previous - 1)
+        line = gap + fields[position] if line is None else line + '\t' + gap + fields[position]
+        previous = position
+    return line + '\n'
+
+
+def write_order_tsv(path, n_rows, n_skus, seed=0, n_customers=None, lines_per_slip=8, zipf=1.1):
+    """受注TSVを書き出し、商品ごとの受注合計（int64 配列、SKU 順）を返す"""
+    rng = np.random.default_rng(seed)
+    codes = sku_codes(n_skus)
+    n_customers = n_customers or max(1, n_skus // 10)
+    # 売れ筋に偏った SKU 分布
+    weights = 1.0 / np.arange(1, n_skus + 1) ** zipf
+    weights = rng.permutation(weights / weights.sum())
+    totals = np.zeros(n_skus, dtype=np.int64)
+    header = '\t'.join(f'列{i + 1}' for i in range(ORDER_COLUMNS)) + '\n'
+    with open(path, 'w', encoding='cp932', newline='') as f:
+        f.write(header)
+        for start in range(0, n_rows, CHUNK_ROWS):
+            n = min(CHUNK_ROWS, n_rows - start)
+            fields, sku, qty = _order_chunk(rng, start, n, codes, weights, n_customers, lines_per_slip)
+            np.add.at(totals, sku, qty)
+            f.write(''.join(_tsv_lines(fields)))
+    return totals
+
+
+def inventory_frame(order_totals, shortage_rate=0.05, noise_rate=0.1, seed=0):
+    """在庫表（23 列・ヘッダーなし）と、不足になるはずの商品コード一覧を返す
+
+    受注のある SKU のうち shortage_rate の割合は実質在庫（倉庫在庫数 + 入庫予定 × 入数）が
+    受注合計を下回るようにする。他倉庫・ロケーション 9 始まりのノイズ行も混ぜる。
+    """
+    rng = np.random.default_rng(seed + 1)
+    n_skus = len(order_totals)
+    codes = sku_codes(n_skus)
+    ordered = np.flatnonzero(order_totals > 0)
+    short = rng.random(len(ordered)) < shortage_rate
+    pack = rng.choice([1, 6, 12, 24], size=n_skus)
+    incoming = rng.integers(0, 3, size=n_skus)
+    effective = order_totals + rng.integers(0, 50, size=n_skus)
+    effective[ordered[short]] = np.maximum(order_totals[ordered[short]] - rng.integers(1, 20, size=short.sum()), 0)
+    # 入庫予定分を差し引いた倉庫在庫数（負にならないよう入庫予定を調整）
+    incoming = np.where(incoming * pack > effective, 0, incoming)
+    stock = effective - incoming * pack
+
+    n_noise = int(n_skus * noise_rate)
+    noise_sku = rng.integers(0, n_skus, size=n_noise)
+    noise_other = rng.random(n_noise) < 0.5
+    frame = pd.DataFrame({
+        1: np.concatenate([np.full(n_skus, TARGET_WAREHOUSE), np.where(noise_other, 'B100001', TARGET_WAREHOUSE)]),
+        4: np.concatenate([np.char.add('1-', np.arange(n_skus).astype(str)),
+                           np.where(noise_other, '1-00', '9-00')]),
+        8: np.concatenate([codes, codes[noise_sku]]),
+        10: np.concatenate([pack, rng.choice([1, 6, 12], size=n_noise)]),
+        13: np.concatenate([stock, rng.integers(0, 1000, size=n_noise)]),
+        22: np.concatenate([incoming, rng.integers(0, 5, size=n_noise)]),
+    })
+    order = rng.permutation(len(frame))
+    frame = frame.iloc[order].reset_index(drop=True)
+    full = pd.DataFrame({i: frame[i] if i in frame else '' for i in range(INVENTORY_COLUMNS)})
+    expected = sorted(c.lstrip('0') for c in codes[ordered[short]])
+    return full, expected
+
+
+def write_inventory(path, frame):
+    """在庫表を拡張子に応じて xlsx（上限 1,048,576 行）または cp932 の csv で書き出す"""
+    if path.lower().endswith('.xlsx'):
+        if len(frame) > XLSX_MAX_ROWS:
+            raise ValueError(f"xlsx は {XLSX_MAX_ROWS:,} 行までです（{len(frame):,} 行）。csv を使ってください。")
+        frame.to_excel(path, header=False, index=False, engine='openpyxl')
+    else:
+        frame.to_csv(path, header=False, index=False, encoding='cp932')
+    return path
+
+
+def generate_dataset(out_dir, n_rows, n_skus, shortage_rate=0.05, seed=0, inventory_format='csv'):
+    """受注TSVと在庫ファイルを生成し、パスと正解（不足商品コード）を返す"""
+    os.makedirs(out_dir, exist_ok=True)
+    order_path = os.path.join(out_dir, f'orders_{n_rows}_{n_skus}_{seed}.txt')
+    inventory_path = os.path.join(out_dir, f'inventory_{n_rows}_{n_skus}_{seed}.{inventory_format}')
+    totals = write_order_tsv(order_path, n_rows, n_skus, seed=seed)
+    frame, expected = inventory_frame(totals, shortage_rate=shortage_rate, seed=seed)
+    write_inventory(inventory_path, frame)
+    return {'orders': order_path, 'inventory': inventory_path, 'expected_shortages': expected}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='合成受注TSV・在庫ファイルの生成')
+    parser.add_argument('--rows', type=int, default=100_000, help='受注行数')
+    parser.add_argument('--skus', type=int, default=5_000, help='SKU 数')
+    parser.add_argument('--shortage-rate', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv', help='在庫ファイルの形式')
+    parser.add_argument('--out', default='bench_data')
+    args = parser.parse_args(argv)
+    dataset = generate_dataset(args.out, args.rows, args.skus, args.shortage_rate, args.seed, args.format)
+    print(f"orders   : {dataset['orders']}")
+    print(f"inventory: {dataset['inventory']}")
+    print(f"expected shortages: {len(dataset['expected_shortages']):,}")
+    return 0
+
+
+if __name__ == "__main__":
+    main()
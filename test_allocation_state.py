@@ -0,0 +1,185 @@
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from allocation_state import AllocationState, DeltaError, RunningTotals, read_delta_file
+from app import calculate_allocation
+
+
+class Upload(BytesIO):
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def make_data():
+    inventory_df = pd.DataFrame({
+        '商品コード': ['111', '222', '333', '19005', '555'],
+        '倉庫在庫数': [150, 50, 10, 0, 40],
+        '入庫予定数': [50, 0, 0, 0, 12],
+        '入数': [10, 12, 6, 1, 6],
+    })
+    order_df = pd.DataFrame({
+        '顧客コード': ['C1', 'C2', 'C1', 'C3', 'C2'],
+        '顧客名': ['顧客1', '顧客2', '顧客1', '顧客3', '顧客2'],
+        '伝票番号': ['5001', '5002', '5001', '5003', '5002'],
+        '商品コード': ['111', '222', '333', '19005', '444'],
+        '商品名漢字': ['商品A', None, '商品C', '商品D', '商品E'],
+        '商品名カナ': ['ｱ', 'ｲ', 'ｳ', 'ｴ', 'ｵ'],
+        '発注数量': [100, 80, 5, 3, 2],
+        'チェーン店固有エリア': [''] * 5,
+    })
+    return inventory_df, order_df
+
+
+def test_build_matches_calculate_allocation():
+    inventory_df, order_df = make_data()
+    state = AllocationState.build(inventory_df, order_df)
+    expected = calculate_allocation(inventory_df[['商品コード', '倉庫在庫数']], order_df)
+    actual = state.frame()
+    assert list(actual['商品コード']) == list(expected['商品コード'])
+    assert list(actual['引当後在庫']) == list(expected['引当後在庫'].astype(int))
+    assert list(actual['商品名']) == list(expected['商品名'])
+    # 在庫のみの商品も索引にある
+    assert '555' in state.index and state.ordered[state.index['555']] == 0
+
+
+def test_delta_updates_only_affected_products():
+    inventory_df, order_df = make_data()
+    state = AllocationState.build(inventory_df, order_df)
+    before = state.remaining.copy()
+    delta = pd.DataFrame({
+        '商品コード': ['222', '222', '444', '666', '333'],
+        '在庫調整': [20, 15, 0, 7, 0],
+        '入庫予定調整': [0, 0, 1, 0, 2],
+        '入数': [0, 0, 6, 0, 0],
+    })
+    affected = state.apply_delta(delta, source='fix.csv')
+
+    assert sorted(state.codes[affected]) == ['222', '333', '444', '666']
+    assert state.remaining[state.index['222']] == 50 + 35 - 80
+    assert state.remaining[state.index['444']] == 6 - 2
+    assert state.remaining[state.index['333']] == 10 + 12 - 5
+    assert state.remaining[state.index['111']] == before[state.index['111']]
+    assert state.remaining[state.index['666']] == 7
+
+    # 全再計算と一致する
+    incremental = state.remaining.copy()
+    state.recompute()
+    assert np.array_equal(incremental, state.remaining)
+
+    audit = state.audit_frame()
+    assert len(audit) == 5
+    assert audit.loc[0, '引当後在庫(前)'] == -30
+    assert set(audit['差分ファイル']) == {'fix.csv'}
+
+
+def test_incoming_delta_without_pack_is_skipped():
+    inventory_df, order_df = make_data()
+    state = AllocationState.build(inventory_df.drop(columns=['入数']), order_df)
+    affected = state.apply_delta(pd.DataFrame({'商品コード': ['222'], '在庫調整': [0], '入庫予定調整': [3], '入数': [0]}))
+    assert len(affected) == 0
+    assert state.audit[0]['状態'] == '入数不明のため未適用'
+
+
+def test_read_delta_file():
+    data = '品目コード,在庫増減,入庫予定増減\n00222,5,\n0333,,2\n'.encode('cp932')
+    delta = read_delta_file(Upload(data, 'delta.csv'))
+    assert list(delta['商品コード']) == ['222', '333']
+    assert list(delta['在庫調整']) == [5, 0]
+    assert list(delta['入庫予定調整']) == [0, 2]
+    assert list(delta['入数']) == [0, 0]
+    try:
+        read_delta_file(Upload('商品コード,備考\n1,x\n'.encode('utf-8'), 'bad.csv'))
+        raise AssertionError('should fail')
+    except DeltaError:
+        pass
+    # 在庫ファイル（絶対値）を差分として足し込まない
+    try:
+        read_delta_file(Upload('商品コード,倉庫在庫数,入庫予定\n222,50,1\n'.encode('utf-8'), 'stock.csv'))
+        raise AssertionError('should fail')
+    except DeltaError as e:
+        assert '倉庫在庫数' in str(e)
+
+
+def test_whatif_overrides_and_clearing_slips():
+    inventory_df, order_df = make_data()
+    # 伝票 5001 は 111 と 333、伝票 5002 は 222 と 444
+    inventory_df.loc[inventory_df['商品コード'] == '111', '倉庫在庫数'] = 60
+    state = AllocationState.build(inventory_df, order_df)
+    assert state.remaining[state.index['111']] == -40
+
+    # 入庫予定が倍になったら（5 ケース -> 10 ケース）111 は解消する
+    state.set_override('111', incoming_cases=10)
+    assert state.remaining[state.index['111']] == 10 + 100 - 100
+    changes = state.slip_changes().set_index('伝票番号')
+    assert changes.loc['5001', '状態'] == '解消'
+    assert changes.loc['5001', '不足商品(前)'] == '111'
+
+    # 222 は在庫を上書きしても 444（在庫なし）が残るので伝票 5002 は不足のまま
+    state.set_override('222', on_hand=100)
+    changes = state.slip_changes().set_index('伝票番号')
+    assert changes.loc['5002', '状態'] == '不足のまま'
+    assert changes.loc['5002', '不足商品(後)'] == '444'
+    assert len(state.overrides_frame()) == 2
+
+    # 差分は上書きと独立して適用でき、上書き解除後も残る
+    state.apply_delta(pd.DataFrame({'商品コード': ['111'], '在庫調整': [5], '入庫予定調整': [0], '入数': [0]}))
+    state.clear_overrides()
+    assert state.remaining[state.index['111']] == -35
+    assert state.remaining[state.index['222']] == -30
+    assert state.slip_changes().empty
+
+
+def test_running_totals_converge_to_final_result():
+    inventory_df, order_df = make_data()
+    running = RunningTotals(inventory_df)
+    seen = set()
+    for part in (order_df.iloc[:2], order_df.iloc[2:4], order_df.iloc[4:]):
+        running.add(part)
+        codes = set(running.shortages()['商品コード'])
+        # 一度不足になった商品は後のファイルで解消しない
+        assert seen <= codes
+        seen = codes
+    final = running.shortages().set_index('商品コード')
+    expected = calculate_allocation(inventory_df[['商品コード', '倉庫在庫数']], order_df)
+    expected = expected[(expected['引当後在庫'] < 0) & (expected['商品コード'] != '19005')].set_index('商品コード')
+    assert sorted(final.index) == sorted(expected.index) == ['222', '444']
+    assert (final['引当後在庫'] == expected['引当後在庫'].reindex(final.index)).all()
+    assert final.loc['444', '商品名'] == '商品E' and running.files == 3
+
+
+def test_totals_only_state_adds_and_subtracts_orders():
+    inventory_df, order_df = make_data()
+    state = AllocationState.totals_only()
+    state.set_stock(inventory_df)
+    half = len(order_df) // 2
+    for part in (order_df.iloc[:half], order_df.iloc[half:]):
+        summary = part.groupby('商品コード').agg(発注数量=('発注数量', 'sum'), 商品名=('商品名カナ', 'first'))
+        state.add_orders(summary.index, summary['発注数量'], names=summary['商品名'])
+    expected = calculate_allocation(inventory_df[['商品コード', '倉庫在庫数']], order_df).set_index('商品コード')
+    idx = [state.index[c] for c in expected.index]
+    assert list(state.frame(idx)['引当後在庫']) == list(expected['引当後在庫'].astype(int))
+
+    # 差し引いた商品と、在庫を置き換えた商品だけが変わる
+    affected = state.add_orders(['222'], [-80])
+    assert state.remaining[affected[0]] == 50
+    state.set_stock(inventory_df[inventory_df['商品コード'] != '111'])
+    assert state.remaining[state.index['111']] == -100
+    try:
+        AllocationState.build(inventory_df, order_df).add_orders(['111'], [1])
+        raise AssertionError('should fail')
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    test_build_matches_calculate_allocation()
+    test_delta_updates_only_affected_products()
+    test_incoming_delta_without_pack_is_skipped()
+    test_read_delta_file()
+    test_whatif_overrides_and_clearing_slips()
+    test_running_totals_converge_to_final_result()
+    test_totals_only_state_adds_and_subtracts_orders()
+    print("All tests passed!")
@@ -0,0 +1,57 @@
+import pandas as pd
+
+from app import calculate_allocation
+from bench_demand_matrix import check, make_data
+from demand_matrix import DemandMatrix
+
+
+def make_orders():
+    return pd.DataFrame({
+        '顧客コード': ['C1', 'C1', 'C2', 'C2', 'C3', 'C1'],
+        '顧客名': ['顧客1', '顧客1', '顧客2', '顧客2', '顧客3', '顧客1'],
+        '伝票番号': ['5001', '5001', '5002', '5002', '5003', '5004'],
+        '商品コード': ['111', '222', '111', '333', '333', '111'],
+        '商品名漢字': ['A', 'B', 'A', 'C', 'C', 'A'],
+        '商品名カナ': ['ｱ', 'ｲ', 'ｱ', 'ｳ', 'ｳ', 'ｱ'],
+        '発注数量': [30, 10, 20, 5, 5, 10],
+        'チェーン店固有エリア': [''] * 6,
+    })
+
+
+def test_customer_exposure_matches_filtering():
+    order_df = make_orders()
+    # 111: 受注 60 / 在庫 30 -> 不足 30（不足率 0.5）、333: 受注 10 / 在庫 0 -> 不足 10
+    inventory_df = pd.DataFrame({'商品コード': ['111', '222', '333'], '倉庫在庫数': [30, 50, 0]})
+    allocation_df = calculate_allocation(inventory_df, order_df)
+    matrix = DemandMatrix.build(order_df)
+    assert matrix.shape == (3, 3)
+
+    exposure = matrix.customer_exposure(allocation_df).set_index('顧客コード')
+    assert list(exposure.index) == ['C1', 'C2', 'C3']
+    assert exposure.loc['C1', '不足明細数'] == 2 and exposure.loc['C1', '不足商品数'] == 1
+    assert exposure.loc['C1', '不足数(按分)'] == 20.0
+    assert exposure.loc['C2', '不足数(按分)'] == 10.0 + 5.0
+    assert exposure.loc['C3', '充足率'] == 0.0
+    assert abs(exposure.loc['C1', '充足率'] - (1 - 20 / 50)) < 1e-9
+    # 按分した不足数の合計は商品ごとの不足数の合計と一致する
+    assert exposure['不足数(按分)'].sum() == 40.0
+
+    detail = matrix.customer_shortages('C2', allocation_df)
+    assert list(detail['商品コード']) == ['111', '333'] and list(detail['不足数(按分)']) == [10.0, 5.0]
+    assert matrix.customer_shortages('C9', allocation_df).empty
+
+
+def test_views_on_random_matrix():
+    # 規模と時間は bench_demand_matrix.py で計測する
+    order_df, allocation_df = make_data(20_000, 1_000, 500)
+    matrix = DemandMatrix.build(order_df)
+    exposure = matrix.customer_exposure(allocation_df)
+    assert check(matrix, exposure, allocation_df, 500) == []
+    assert list(exposure.columns[:2]) == ['顧客コード', '顧客名']
+    assert exposure['不足明細数'].iloc[0] >= exposure['不足明細数'].iloc[-1]
+
+
+if __name__ == "__main__":
+    test_customer_exposure_matches_filtering()
+    test_views_on_random_matrix()
+    print("All tests passed!")
@@ -0,0 +1,70 @@
+from io import BytesIO
+
+import pandas as pd
+
+from allocation_state import AllocationState
+from bench_inbound_schedule import START, check, make_data as make_bench_data
+from inbound_schedule import ScheduleError, project, read_schedule_file
+from test_allocation_state import make_data
+
+
+class Upload(BytesIO):
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def test_read_schedule_aliases_and_cases():
+    csv = "品目コード,入荷予定日,入荷数,ケース数\n0222,2026/10/21,10,\n444,2026-10-25,,2\nxx,不明,1,\n".encode('cp932')
+    schedule = read_schedule_file(Upload(csv, 'schedule.csv'))
+    assert list(schedule['商品コード']) == ['222', '444']
+    assert list(schedule['入庫数']) == [10, 0] and list(schedule['ケース数']) == [0, 2]
+    assert schedule['入庫日'].iloc[1] == pd.Timestamp('2026-10-25')
+    try:
+        read_schedule_file(Upload("商品コード,数量\n1,2\n".encode('utf-8'), 'bad.csv'))
+        assert False
+    except ScheduleError:
+        pass
+    # 「数量」列は入庫数として読まない
+    try:
+        read_schedule_file(Upload("商品コード,入庫日,数量\n1,2026/10/21,2\n".encode('utf-8'), 'qty.csv'))
+        assert False
+    except ScheduleError:
+        pass
+
+
+def test_first_clear_day_and_outside_horizon():
+    inventory_df, order_df = make_data()
+    state = AllocationState.build(inventory_df, order_df)
+    schedule = pd.DataFrame({
+        '商品コード': ['222', '222', '444', '999'],
+        '入庫日': pd.to_datetime(['2026-10-10', '2026-10-25', '2026-12-31', '2026-10-20']),
+        '入庫数': [10, 30, 5, 1],
+        'ケース数': [0, 0, 0, 0],
+    })
+    projection = project(state, schedule, start='2026-10-19', horizon=30)
+    result = projection.shortages_frame().set_index('商品コード')
+    assert projection.unknown_codes == ['999']
+    # 222: 実在庫 50（日付なしの入庫予定は予定で置き換え）、開始日前の予定 10 は当日入庫
+    assert result.loc['222', '当日不足数'] == 20
+    assert result.loc['222', '解消日'] == pd.Timestamp('2026-10-25').date()
+    assert result.loc['222', '解消までの日数'] == 6
+    # 444: 期間外の入庫のみ -> 解消しない
+    assert pd.isna(result.loc['444', '解消日']) and result.loc['444', '期間外入庫数'] == 5
+    assert list(result.index) == ['444', '222']
+    chart = projection.product_frame('222')
+    assert len(chart) == 31 and chart['在庫'].iloc[-1] == 90
+
+
+def test_projection_at_scale():
+    # 計測時間は bench_inbound_schedule.py で確認する
+    state, schedule = make_bench_data(100_000, 200_000)
+    projection = project(state, schedule, start=START, horizon=30)
+    assert check(projection, projection.shortages_frame(), 100_000, 30) == []
+
+
+if __name__ == "__main__":
+    test_read_schedule_aliases_and_cases()
+    test_first_clear_day_and_outside_horizon()
+    test_projection_at_scale()
+    print("All tests passed!")
@@ -0,0 +1,73 @@
+import time
+
+import pandas as pd
+
+from app import load_inventory_file, load_inventory_files
+from bench_allocation import LocalFile
+from inventory_store import InventorySnapshotStore
+from synth_data import write_inventory
+
+
+def inventory_rows(rows):
+    # [商品コード, ロケーション, 入数, 倉庫在庫数, 入庫予定] -> 23 列の在庫表
+    frame = pd.DataFrame({i: [''] * len(rows) for i in range(23)})
+    frame[1] = 'A309001'
+    frame[4] = [r[1] for r in rows]
+    frame[8] = [r[0] for r in rows]
+    frame[10] = [r[2] for r in rows]
+    frame[13] = [r[3] for r in rows]
+    frame[22] = [r[4] for r in rows]
+    return frame
+
+
+def test_files_are_summed_and_conflicts_flagged(tmp_path):
+    east = write_inventory(str(tmp_path / 'east.csv'), inventory_rows([
+        ('00111', '1-01', 10, 100, 1), ('00222', '1-02', 6, 5, 0), ('00333', '1-03', 12, 7, 0)]))
+    west = write_inventory(str(tmp_path / 'west.xlsx'), inventory_rows([
+        ('00111', '2-01', 10, 40, 0), ('00222', '2-02', 12, 1, 0), ('00333', '1-03', 12, 7, 0)]))
+
+    merged = load_inventory_files([LocalFile(east), LocalFile(west)]).set_index('商品コード')['倉庫在庫数']
+    assert merged.to_dict() == {'111': 150, '222': 6, '333': 14}
+    single = load_inventory_file(LocalFile(east)).set_index('商品コード')['倉庫在庫数']
+    assert single['111'] == 110
+
+    df = load_inventory_files([LocalFile(east), LocalFile(west)])
+    conflicts = df.attrs['conflicts'].set_index('商品コード')['理由'].to_dict()
+    assert conflicts == {'222': '入数不一致', '333': 'ロケーション重複'}
+    report = df.attrs['file_report']
+    assert list(report['ファイル']) == ['east.csv', 'west.xlsx']
+    assert list(report['行数']) == [3, 3]
+    assert (report['読み込み時間(秒)'] >= 0).all()
+
+
+def test_same_file_set_shares_snapshot(tmp_path):
+    a = write_inventory(str(tmp_path / 'a.csv'), inventory_rows([('111', '1-01', 1, 5, 0)]))
+    b = write_inventory(str(tmp_path / 'b.csv'), inventory_rows([('222', '1-01', 1, 7, 0)]))
+    store = InventorySnapshotStore()
+    first, reused = store.get_or_load([LocalFile(a), LocalFile(b)], load_inventory_files)
+    assert not reused and first.file_name == 'a.csv, b.csv'
+    again, reused = store.get_or_load([LocalFile(b), LocalFile(a)], load_inventory_files)
+    assert reused and again is first
+    assert 'file_report' in first.attrs
+    assert dict(zip(first.to_frame()['商品コード'], first.to_frame()['倉庫在庫数'])) == {'111': 5, '222': 7}
+
+
+def test_parse_errors_name_the_file(tmp_path):
+    bad = tmp_path / 'bad.txt'
+    bad.write_text('x')
+    good = write_inventory(str(tmp_path / 'good.csv'), inventory_rows([('111', '1-01', 1, 5, 0)]))
+    try:
+        load_inventory_files([LocalFile(good), LocalFile(str(bad))])
+        raise AssertionError('should fail')
+    except Exception as e:
+        assert 'bad.txt' in str(e)
+
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+    for test in (test_files_are_summed_and_conflicts_flagged, test_same_file_set_shares_snapshot,
+                 test_parse_errors_name_the_file):
+        with tempfile.TemporaryDirectory() as d:
+            test(pathlib.Path(d))
+    print("All tests passed!")
@@ -0,0 +1,78 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import pandas as pd
+
+from app import calculate_allocation
+from inventory_store import InventorySnapshotStore
+
+
+class Upload(BytesIO):
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def parse(file):
+    time.sleep(0.05)
+    parse.calls += 1
+    return pd.DataFrame({'商品コード': ['111', '222'], '倉庫在庫数': [150, 50]})
+
+
+def test_same_file_is_parsed_once_and_shared():
+    parse.calls = 0
+    store = InventorySnapshotStore()
+    results = []
+
+    def session():
+        results.append(store.get_or_load(Upload(b'inventory-v1', 'stock.xlsx'), parse))
+
+    threads = [threading.Thread(target=session) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert parse.calls == 1
+    assert len({id(snapshot) for snapshot, _ in results}) == 1
+    assert sorted(reused for _, reused in results) == [False, True, True, True]
+
+    snapshot = results[0][0]
+    assert snapshot.version.startswith('v1-')
+    frame = snapshot.to_frame()
+    assert frame['倉庫在庫数'].dtype == 'int32'
+    try:
+        frame['倉庫在庫数'].to_numpy()[0] = 0
+        raise AssertionError('snapshot must be read-only')
+    except ValueError:
+        pass
+
+    # 別内容のファイルは別バージョン
+    other, reused = store.get_or_load(Upload(b'inventory-v2', 'stock.xlsx'), parse)
+    assert not reused and other.version.startswith('v2-')
+    assert [s.version for s in store.snapshots()] == [other.version, snapshot.version]
+
+
+def test_snapshot_works_with_allocation_and_expires():
+    parse.calls = 0
+    store = InventorySnapshotStore(ttl_hours=1)
+    snapshot, _ = store.get_or_load(Upload(b'x', 'stock.csv'), parse)
+    order_df = pd.DataFrame([
+        {'商品コード': '111', '発注数量': 200, '商品名漢字': 'A', '商品名カナ': ''},
+        {'商品コード': '222', '発注数量': 10, '商品名漢字': 'B', '商品名カナ': ''},
+    ])
+    allocation = calculate_allocation(snapshot.to_frame(), order_df).set_index('商品コード')
+    assert allocation.loc['111', '引当後在庫'] == -50
+    assert allocation.loc['222', '引当後在庫'] == 40
+
+    snapshot.expires_at = datetime.now() - timedelta(seconds=1)
+    assert store.snapshots() == []
+    assert store.get(snapshot.version) is None
+
+
+if __name__ == "__main__":
+    test_same_file_is_parsed_once_and_shared()
+    test_snapshot_works_with_allocation_and_expires()
+    print("All tests passed!")
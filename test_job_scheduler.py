@@ -0,0 +1,110 @@
+import threading
+import time
+
+from job_scheduler import OCR, TABULAR, AdmissionRejected, JobScheduler
+
+
+def make_scheduler(**kwargs):
+    kwargs.setdefault('limits', {OCR: 1, TABULAR: 1})
+    kwargs.setdefault('available_memory', lambda: 10**12)
+    kwargs.setdefault('memory_limit', lambda: 10**12)
+    kwargs.setdefault('headroom_bytes', 0)
+    return JobScheduler(**kwargs)
+
+
+def test_fifo_with_visible_position():
+    scheduler = make_scheduler()
+    order = []
+    positions = {}
+    release = threading.Event()
+
+    def job(name):
+        def on_wait(ahead):
+            positions.setdefault(name, []).append(ahead)
+        with scheduler.slot(TABULAR, on_wait=on_wait):
+            order.append(name)
+            if name == 'a':
+                release.wait(5)
+
+    first = threading.Thread(target=job, args=('a',))
+    first.start()
+    while not order:
+        time.sleep(0.01)
+    waiters = []
+    for name in ('b', 'c'):
+        t = threading.Thread(target=job, args=(name,))
+        t.start()
+        waiters.append(t)
+        while scheduler.queued(TABULAR) < len(waiters):
+            time.sleep(0.01)
+
+    # OCR 枠は表形式ジョブの待ちに影響されない
+    with scheduler.slot(OCR):
+        pass
+
+    release.set()
+    for t in [first] + waiters:
+        t.join(5)
+    assert order == ['a', 'b', 'c']
+    assert positions['b'][0] == 1
+    assert positions['c'][0] == 2
+    metrics = scheduler.render_prometheus()
+    assert 'scheduler_admitted_total{kind="tabular"} 3' in metrics
+    assert 'scheduler_admitted_total{kind="ocr"} 1' in metrics
+
+
+def test_rejections():
+    scheduler = make_scheduler(max_queued=0)
+    try:
+        with scheduler.slot(TABULAR):
+            pass
+        raise AssertionError('should be rejected')
+    except AdmissionRejected:
+        pass
+
+    scheduler = make_scheduler(memory_limit=lambda: 1000)
+    try:
+        with scheduler.slot(OCR, estimate_bytes=5000):
+            pass
+        raise AssertionError('should be rejected')
+    except AdmissionRejected:
+        pass
+    metrics = scheduler.render_prometheus()
+    assert 'scheduler_rejected_total{kind="ocr",reason="memory"} 1' in metrics
+
+
+def test_memory_admission_waits_for_running_job():
+    # 空きメモリが少ないので、2件目は1件目の終了を待つ
+    scheduler = make_scheduler(limits={OCR: 2, TABULAR: 2}, available_memory=lambda: 150)
+    events = []
+    release = threading.Event()
+
+    def first():
+        with scheduler.slot(TABULAR, estimate_bytes=100):
+            events.append('first-start')
+            release.wait(5)
+            events.append('first-end')
+
+    def second():
+        with scheduler.slot(TABULAR, estimate_bytes=100):
+            events.append('second-start')
+
+    t1 = threading.Thread(target=first)
+    t1.start()
+    while not events:
+        time.sleep(0.01)
+    t2 = threading.Thread(target=second)
+    t2.start()
+    time.sleep(0.2)
+    assert events == ['first-start']
+    release.set()
+    t1.join(5)
+    t2.join(5)
+    assert events == ['first-start', 'first-end', 'second-start']
+
+
+if __name__ == "__main__":
+    test_fifo_with_visible_position()
+    test_rejections()
+    test_memory_admission_waits_for_running_job()
+    print("All tests passed!")
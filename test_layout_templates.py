@@ -0,0 +1,112 @@
+import tempfile
+
+import fitz
+import numpy as np
+from PIL import Image
+
+from layout_templates import (TEMPLATE_VERSION, LayoutTemplateStore, build_template, fingerprint_distance,
+                              layout_fingerprint, template_coords, template_regions, trim_regions)
+from ocr_benchmark import generate_synthetic_pdf
+
+
+def render_pages(pdf_bytes, zoom=2.5):
+    doc = fitz.open(stream=pdf_bytes, filetype='pdf')
+    images = []
+    for page in doc:
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+        images.append(np.array(Image.frombytes('RGB', [pix.width, pix.height], pix.samples)))
+    doc.close()
+    return images
+
+
+def box(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+
+
+def test_same_layout_matches_and_other_layout_does_not():
+    pages = render_pages(generate_synthetic_pdf(seed=3, n_pages=2, noise=0, max_rotation=0)[0])
+    fp_a, fp_b = layout_fingerprint(pages[0]), layout_fingerprint(pages[1])
+    assert fingerprint_distance(fp_a, fp_b) <= 24
+
+    blank = np.full_like(pages[0], 255)
+    blank[:, :200] = 0
+    assert fingerprint_distance(fp_a, layout_fingerprint(blank)) > 24
+
+
+def word_boxes(pdf_bytes, zoom=2.5):
+    """テキスト層の単語 -> ページ画像上のボックス（ページごと）"""
+    doc = fitz.open(stream=pdf_bytes, filetype='pdf')
+    pages = []
+    for page in doc:
+        words = {}
+        for x0, y0, x1, y1, word, *_ in page.get_text('words'):
+            words.setdefault(word, []).append(box(x0 * zoom, y0 * zoom, x1 * zoom, y1 * zoom))
+        pages.append(words)
+    doc.close()
+    return pages
+
+
+def inside(b, regions):
+    return any(x0 <= b[0][0] and b[2][0] <= x1 and y0 <= b[0][1] and b[2][1] <= y1 for _, x0, y0, x1, y1 in regions)
+
+
+def test_template_regions_cut_pixels():
+    pdf_bytes, truths = generate_synthetic_pdf(seed=5, n_pages=1, noise=0, max_rotation=0)
+    words = word_boxes(pdf_bytes)[0]
+    page = render_pages(pdf_bytes)[0]
+    height, width = page.shape[:2]
+    codes = [words[row['商品コード']][0] for row in truths[0]['rows']]
+    quantities = [words[str(row['発注数量'])][-1] for row in truths[0]['rows']]
+    prod_header, qty_header = words['受注品目'][0], words['数量'][0]
+    template = build_template(
+        width, height, prod_x=(prod_header[0][0] + prod_header[1][0]) / 2,
+        qty_x=(qty_header[0][0] + qty_header[1][0]) / 2, header_y=prod_header[2][1],
+        customer_boxes=words['出荷先'] + words[truths[0]['顧客コード']] + words[truths[0]['顧客名']],
+        prod_boxes=codes, qty_boxes=quantities, prod_header=prod_header, qty_header=qty_header)
+    assert [r[0] for r in template_regions(template, width, height)] == ['customer', 'product', 'quantity']
+
+    # 同じレイアウトのスキャンページ（ノイズあり）では、認識する画素数が全面の 1/10 未満
+    scanned_pdf, scanned_truths = generate_synthetic_pdf(seed=5, n_pages=1, max_rotation=0)
+    regions = trim_regions(template_regions(template, width, height), render_pages(scanned_pdf)[0])
+    pixels = sum((x1 - x0) * (y1 - y0) for _, x0, y0, x1, y1 in regions)
+    assert pixels * 10 < width * height
+
+    # 学習したページより行数が多くても、表の下端まで残り、すべての商品コード・数量が領域に入る
+    long_pdf, long_truths = generate_synthetic_pdf(seed=6, n_pages=1, rows_per_page=20, noise=0, max_rotation=0)
+    long_words = word_boxes(long_pdf)[0]
+    for pdf, page_truth, page_words in ((scanned_pdf, scanned_truths[0], words), (long_pdf, long_truths[0], long_words)):
+        regions = trim_regions(template_regions(template, width, height), render_pages(pdf)[0])
+        for row in page_truth['rows']:
+            assert inside(page_words[row['商品コード']][0], regions)
+            assert any(inside(b, regions) for b in page_words[str(row['発注数量'])])
+
+    prod_x, qty_x, header_y = template_coords(template, width, height)
+    assert abs(header_y - prod_header[2][1]) < 1
+
+
+def test_store_persists_and_forgets():
+    page = render_pages(generate_synthetic_pdf(seed=4, n_pages=1, noise=0, max_rotation=0)[0])[0]
+    fp = layout_fingerprint(page)
+    template = {'prod_x': 0.4, 'qty_x': 0.6, 'header_y': 0.25,
+                'customer': [0, 0, 0.2, 0.2], 'product': [0.35, 0.24, 0.45, 1.0],
+                'quantity': [0.55, 0.24, 0.65, 1.0], 'version': TEMPLATE_VERSION}
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LayoutTemplateStore(tmp)
+        assert store.match(fp) is None
+        store.learn(fp, template)
+        reopened = LayoutTemplateStore(tmp)
+        assert reopened.match(fp)['prod_x'] == 0.4
+        reopened.forget(fp)
+        assert reopened.match(fp) is None
+        assert len(LayoutTemplateStore(tmp)) == 0
+
+        # 列領域の決め方が古いテンプレートは読み込まない
+        store.learn(fp, dict(template, version=1))
+        assert LayoutTemplateStore(tmp).match(fp) is None
+
+
+if __name__ == "__main__":
+    test_same_layout_matches_and_other_layout_does_not()
+    test_template_regions_cut_pixels()
+    test_store_persists_and_forgets()
+    print("All tests passed!")
@@ -15,7 +15,7 @@ except AttributeError:
 # Initialize PaddleOCR
 ocr = PaddleOCR(use_angle_cls=True, lang='japan')
 
-pdf_path = r"c:\Users\PC_User\Desktop\Antigravity\在庫引当チェックツール_vr3\PDF ファイル\受注一覧リスト必須項目.pdf"
+pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PDF ファイル', '受注一覧リスト必須項目.pdf')
 
 def get_best_text_below(texts, boxes, anchor_text, x_range=20, y_limit=100):
     """Find text directly below an anchor text within a certain x range"""
@@ -0,0 +1,59 @@
+import os
+import tempfile
+
+import fitz
+
+from ocr_benchmark import expected_rows, find_regressions, generate_synthetic_pdf, main, score_rows
+
+
+def test_synthetic_pdf_matches_ground_truth():
+    pdf_bytes, truths = generate_synthetic_pdf(seed=1, n_pages=2, rows_per_page=5, noise=0, max_rotation=0)
+    doc = fitz.open(stream=pdf_bytes, filetype='pdf')
+    assert len(doc) == 2
+    text = doc[0].get_text()
+    assert '出荷先' in text and '受注品目' in text and '数量' in text
+    assert truths[0]['顧客コード'] in text
+    for row in truths[0]['rows']:
+        assert row['商品コード'] in text
+    doc.close()
+    assert len(expected_rows(truths)) == 10
+
+
+def test_degraded_pdf_is_image_only():
+    pdf_bytes, _ = generate_synthetic_pdf(seed=2, n_pages=1, rows_per_page=3)
+    doc = fitz.open(stream=pdf_bytes, filetype='pdf')
+    assert doc[0].get_text().strip() == ''
+    assert len(doc[0].get_images()) == 1
+    doc.close()
+
+
+def test_score_rows():
+    expected = [('100', 5), ('200', 3), ('300', 1)]
+    actual = [('100', 5), ('200', 8)]
+    score = score_rows(expected, actual)
+    assert score['matched_rows'] == 1
+    assert score['precision'] == 0.5
+    assert abs(score['recall'] - 1 / 3) < 1e-9
+    assert abs(score['code_recall'] - 2 / 3) < 1e-9
+
+
+def test_find_regressions():
+    baseline = {'pages_per_sec': 1.0, 'precision': 0.95, 'recall': 0.90}
+    assert find_regressions({'pages_per_sec': 0.9, 'precision': 0.94, 'recall': 0.90}, baseline) == []
+    failures = find_regressions({'pages_per_sec': 0.5, 'precision': 0.80, 'recall': 0.90}, baseline)
+    assert len(failures) == 2
+
+
+def test_missing_baseline_fails():
+    with tempfile.TemporaryDirectory() as d:
+        baseline = os.path.join(d, 'baseline.json')
+        assert main(['--synthetic', '0', '--no-samples', '--baseline', baseline]) == 2
+
+
+if __name__ == "__main__":
+    test_synthetic_pdf_matches_ground_truth()
+    test_degraded_pdf_is_image_only()
+    test_score_rows()
+    test_find_regressions()
+    test_missing_baseline_fails()
+    print("All tests passed!")
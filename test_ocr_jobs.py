@@ -0,0 +1,139 @@
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from ocr_jobs import DONE, FAILED, QUEUED, OcrJobQueue
+from pdf_metrics import PdfMetrics
+
+
+def fake_pdf_order(file, on_page=None, metrics=None):
+    data = file.read()
+    if data == b'broken':
+        raise ValueError('not a pdf')
+    if not data:
+        return pd.DataFrame()
+    pages = 3
+    for i in range(pages):
+        on_page(i, pages)
+    on_page(pages, pages)
+    return pd.DataFrame([{
+        '顧客コード': '000000001',
+        '顧客名': 'テスト',
+        '伝票番号': 'PDF受注',
+        '商品コード': '12345',
+        '商品名漢字': 'PDF抽出商品',
+        '商品名カナ': '',
+        '発注数量': len(data),
+        'チェーン店固有エリア': '',
+    }])
+
+
+def wait_for(queue, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in (DONE, FAILED):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+def test_job_lifecycle_and_persistence():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = OcrJobQueue(fake_pdf_order, jobs_dir=tmp)
+        job_id = queue.submit('a.pdf', b'12345', owner='u1')
+        job = wait_for(queue, job_id)
+        assert job['status'] == DONE
+        assert (job['pages_done'], job['pages_total']) == (3, 3)
+
+        df = queue.result(job_id)
+        assert df.iloc[0]['商品コード'] == '12345'
+        assert df.iloc[0]['顧客コード'] == '000000001'
+        assert df.iloc[0]['発注数量'] == 5
+
+        # 同じ内容の再アップロードは既存ジョブに紐付く
+        assert queue.submit('a (copy).pdf', b'12345', owner='u1') == job_id
+
+        # 行が抽出できなかったPDFも受注明細の列を持つ空の表になる
+        empty_id = queue.submit('blank.pdf', b'', owner='u1')
+        assert wait_for(queue, empty_id)['status'] == DONE
+        empty = queue.result(empty_id)
+        assert empty.empty and '伝票番号' in empty.columns and '発注数量' in empty.columns
+
+        bad_id = queue.submit('bad.pdf', b'broken', owner='u1')
+        bad = wait_for(queue, bad_id)
+        assert bad['status'] == FAILED
+        assert 'not a pdf' in bad['error']
+        assert queue.result(bad_id) is None
+        queue.stop()
+
+        # 別インスタンス（再起動後）からもジョブを参照できる
+        reopened = OcrJobQueue(fake_pdf_order, jobs_dir=tmp)
+        assert reopened.get(job_id)['status'] == DONE
+        assert {j['job_id'] for j in reopened.list_jobs('u1')} == {job_id, empty_id, bad_id}
+        reopened.stop()
+
+
+def test_jobs_listed_per_owner_and_compacted():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = OcrJobQueue(fake_pdf_order, jobs_dir=tmp)
+        mine = queue.submit('a.pdf', b'12345', owner='u1')
+        # 同じ内容でも別のブラウザのジョブには紐付けない
+        theirs = queue.submit('a.pdf', b'12345', owner='u2')
+        assert theirs != mine
+        wait_for(queue, mine)
+        wait_for(queue, theirs)
+        assert [j['job_id'] for j in queue.list_jobs('u1')] == [mine]
+        assert queue.list_jobs('u3') == []
+
+        assert queue.compact() == 0
+        # 保持期間を過ぎた完了ジョブは結果ごと削除し、待機中のジョブは残す
+        queue.stop()
+        queued_id = queue.submit('b.pdf', b'678', owner='u1')
+        assert queue.compact(now=datetime.now() + timedelta(hours=49)) == 2
+        assert queue.get(mine) is None and queue.get(theirs) is None
+        assert queue.get(queued_id)['status'] == QUEUED
+
+
+def test_job_table_without_owner_column_is_migrated():
+    with tempfile.TemporaryDirectory() as tmp:
+        with sqlite3.connect(f'{tmp}/ocr_jobs.sqlite3') as conn:
+            conn.execute("CREATE TABLE ocr_jobs (job_id TEXT PRIMARY KEY, file_name TEXT NOT NULL, digest TEXT NOT NULL, "
+                         "status TEXT NOT NULL, pages_done INTEGER NOT NULL DEFAULT 0, pages_total INTEGER NOT NULL DEFAULT 0, "
+                         "error TEXT, result_json TEXT, created_at TEXT NOT NULL, updated_at TEXT NOT NULL)")
+            conn.execute("INSERT INTO ocr_jobs (job_id, file_name, digest, status, result_json, created_at, updated_at) "
+                         "VALUES ('old', 'old.pdf', 'x', 'done', '[]', ?, ?)", (datetime.now().isoformat(),) * 2)
+        queue = OcrJobQueue(fake_pdf_order, jobs_dir=tmp)
+        # 所有者のない以前のジョブはどのブラウザの一覧にも出さない
+        assert queue.get('old')['status'] == DONE and queue.list_jobs('u1') == []
+        job_id = queue.submit('a.pdf', b'12345', owner='u1')
+        assert wait_for(queue, job_id)['status'] == DONE
+        queue.stop()
+
+
+def test_page_warnings_recorded_on_job():
+    def partial_order(file, on_page=None, metrics=None):
+        metrics.warnings.append('ページ 2 のOCR処理に失敗しました: timeout')
+        return fake_pdf_order(file, on_page=on_page)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = OcrJobQueue(partial_order, jobs_dir=tmp, metrics_factory=PdfMetrics)
+        job_id = queue.submit('a.pdf', b'12345')
+        job = wait_for(queue, job_id)
+        assert job['status'] == DONE and 'ページ 2' in job['error']
+        assert len(queue.result(job_id)) == 1
+        # 計測結果は取り出したら保持しない
+        assert queue.take_metrics(job_id).file_name == 'a.pdf'
+        assert queue.take_metrics(job_id) is None and queue.metrics == {}
+        queue.stop()
+
+
+if __name__ == "__main__":
+    test_job_lifecycle_and_persistence()
+    test_jobs_listed_per_owner_and_compacted()
+    test_job_table_without_owner_column_is_migrated()
+    test_page_warnings_recorded_on_job()
+    print("All tests passed!")
@@ -0,0 +1,103 @@
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+from ocr_service import OcrBatcher, OcrService, OcrServiceClient
+
+
+class StandInEngine:
+    """PaddleOCR の代わりに画像の内容をそのまま返すローカルエンジン"""
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.lock = threading.Lock()
+
+    def __call__(self, images):
+        with self.lock:
+            self.batch_sizes.append(len(images))
+        return [[[[[0, 0], [10, 0], [10, 10], [0, 10]], (str(int(img[0, 0, 0])), 0.99)]] for img in images]
+
+
+def test_concurrent_sessions_are_batched():
+    engine = StandInEngine()
+    service = OcrService(OcrBatcher(engine, window_ms=200, max_batch=8)).start()
+    try:
+        client = OcrServiceClient(service.url)
+        results = {}
+        start = threading.Barrier(6)
+
+        def session(i):
+            img = np.full((20, 30, 3), i, dtype=np.uint8)
+            start.wait()
+            results[i] = client.ocr(img)[0][0][1][0]
+
+        threads = [threading.Thread(target=session, args=(i,)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # 各セッションに自分の画像の結果が返る
+        assert results == {i: str(i) for i in range(6)}
+        assert sum(engine.batch_sizes) == 6
+        assert max(engine.batch_sizes) > 1
+
+        many = client.ocr_many([np.full((5, 5, 3), v, dtype=np.uint8) for v in (7, 8, 9)])
+        assert [lines[0][1][0] for lines in many] == ['7', '8', '9']
+
+        with urllib.request.urlopen(service.url + '/metrics') as response:
+            metrics = response.read().decode('utf-8')
+        assert 'ocr_service_requests_total 9' in metrics
+        assert 'ocr_service_queue_depth 0' in metrics
+        assert 'ocr_service_batch_size_count' in metrics
+    finally:
+        service.stop()
+
+
+def test_engine_error_is_returned_to_every_request():
+    def broken(images):
+        raise RuntimeError('engine down')
+
+    batcher = OcrBatcher(broken, window_ms=50)
+    futures = [batcher.submit(np.zeros((2, 2, 3), dtype=np.uint8)) for _ in range(3)]
+    for f in futures:
+        assert isinstance(f.exception(timeout=5), RuntimeError)
+    assert batcher.errors >= 1
+
+
+def test_short_engine_result_fails_remaining_requests():
+    # 入力より少ない結果しか返さないエンジンでも、残りの呼び出し側が待ち続けない
+    batcher = OcrBatcher(lambda images: [[]], window_ms=200, max_batch=8)
+    futures = [batcher.submit(np.zeros((2, 2, 3), dtype=np.uint8)) for _ in range(3)]
+    outcomes = [f.exception(timeout=5) for f in futures]
+    assert outcomes[0] is None and futures[0].result() == []
+    assert all(isinstance(e, RuntimeError) for e in outcomes[1:])
+    assert batcher.errors >= 1
+
+
+def test_client_ocr_many_raises_send_errors():
+    def broken(images):
+        raise RuntimeError('engine down')
+
+    service = OcrService(OcrBatcher(broken, window_ms=50)).start()
+    try:
+        client = OcrServiceClient(service.url, timeout=10)
+        assert client.ocr_many([]) == []
+        try:
+            client.ocr_many([np.zeros((2, 2, 3), dtype=np.uint8)] * 2)
+        except urllib.error.HTTPError:
+            pass
+        else:
+            raise AssertionError('送信の失敗が握りつぶされています')
+    finally:
+        service.stop()
+
+
+if __name__ == "__main__":
+    test_concurrent_sessions_are_batched()
+    test_engine_error_is_returned_to_every_request()
+    test_short_engine_result_fails_remaining_requests()
+    test_client_ocr_many_raises_send_errors()
+    print("All tests passed!")
@@ -0,0 +1,84 @@
+import io
+import tarfile
+import zipfile
+from io import BytesIO
+
+from app import load_order_file
+from order_archive import archive_report, iter_archive_orders
+
+
+class Upload(BytesIO):
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+HEADER = ['顧客コード', '顧客名', '伝票番号', '商品コード', '商品名漢字', '商品名カナ', '発注数量', 'チェーン店固有エリア']
+
+
+def order_tsv(slip, lines):
+    rows = ['\t'.join(HEADER)] + ['\t'.join(['C1', '顧客1', str(slip), str(1000 + i), '商品', 'ｼｮｳﾋﾝ', '2', ''])
+                                  for i in range(lines)]
+    return ('\r\n'.join(rows) + '\r\n').encode('cp932')
+
+
+def members():
+    return [(f'daily/o{i:03d}.txt', order_tsv(5000 + i, 10 + i)) for i in range(12)] + [
+        ('daily/broken.txt', b'\xff\xfe\x00garbage'),
+        ('daily/readme.md', b'ignored'),
+        ('__MACOSX/daily/._o000.txt', b'ignored'),
+    ]
+
+
+def make_zip():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def make_tar_gz():
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, data in members():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def test_zip_and_tar_members_parsed_in_order():
+    for data, name in ((make_zip(), 'daily.zip'), (make_tar_gz(), 'daily.tar.gz')):
+        results = list(iter_archive_orders(Upload(data, name), load_order_file, max_workers=3))
+        assert [r.name for r in results] == [f'daily/o{i:03d}.txt' for i in range(12)] + ['daily/broken.txt']
+        assert [r.lines for r in results[:12]] == [10 + i for i in range(12)]
+        assert results[-1].df is None and results[-1].error
+        assert str(results[0].df['伝票番号'].iloc[0]) == '5000'
+        report = archive_report(name, results)
+        assert report['明細数'].sum() == sum(10 + i for i in range(12))
+        assert (report['エラー'] != '').sum() == 1
+
+
+def test_memory_budget_bounds_members_in_flight():
+    size = len(order_tsv(5000, 21))
+    results = list(iter_archive_orders(Upload(make_zip(), 'daily.zip'), load_order_file,
+                                       memory_budget=size * 2, max_workers=4))
+    assert all(r.error is None for r in results[:12])
+
+    # 1メンバーで予算を超える場合は解析しない
+    results = list(iter_archive_orders(Upload(make_zip(), 'daily.zip'), load_order_file, memory_budget=100))
+    assert all(r.df is None and 'メモリ上限' in r.error for r in results[:12])
+
+
+def test_corrupt_archive_reported():
+    results = list(iter_archive_orders(Upload(b'not a zip', 'bad.zip'), load_order_file))
+    assert len(results) == 1 and 'アーカイブの読み込みエラー' in results[0].error
+
+
+if __name__ == "__main__":
+    test_zip_and_tar_members_parsed_in_order()
+    test_memory_budget_bounds_members_in_flight()
+    test_corrupt_archive_reported()
+    print("All tests passed!")
@@ -0,0 +1,88 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from order_dedup import OrderDeduplicator
+
+
+def make_orders(slips, codes, qty):
+    return pd.DataFrame({
+        '顧客名': ['顧客'] * len(slips),
+        '伝票番号': slips,
+        '商品コード': codes,
+        '発注数量': qty,
+    })
+
+
+def test_same_file_and_overlapping_exports():
+    dedup = OrderDeduplicator('line')
+    first = make_orders(['5001', '5001', '5001', '5002'], ['111', '111', '222', '111'], [1, 2, 3, 4])
+    assert len(dedup.add(first, 'a.txt', 'digest-a')) == 4
+
+    # 同じファイルの再アップロード（別名）はまるごと除外
+    assert dedup.add(first.copy(), 'a (1).txt', 'digest-a').empty
+
+    # 伝票 5002 が重なる別のエクスポート。同じ伝票・商品の2行目は新しい明細
+    second = make_orders(['5002', '5002', '5003'], ['111', '111', '111'], [4, 9, 5])
+    kept = dedup.add(second, 'b.txt', 'digest-b')
+    assert list(kept['発注数量']) == [9, 5]
+
+    report = dedup.report_frame().set_index('ファイル名')
+    assert report.loc['a (1).txt', '状態'] == 'a.txt と同一ファイル'
+    assert report.loc['a (1).txt', '重複分の発注数量'] == 10
+    assert report.loc['b.txt', '重複明細数'] == 1 and report.loc['b.txt', '重複分の発注数量'] == 4
+    assert dedup.duplicates == 5
+
+
+def test_key_modes():
+    orders = make_orders(['5001', '5001'], ['111', '111'], [1, 2])
+    slip_product = OrderDeduplicator('slip_product')
+    assert list(slip_product.add(orders, 'a.txt')['発注数量']) == [1]
+    off = OrderDeduplicator('off')
+    assert len(off.add(orders, 'a.txt', 'd')) == 2 and len(off.add(orders, 'b.txt', 'd')) == 2
+    try:
+        OrderDeduplicator('bogus')
+        raise AssertionError('should fail')
+    except ValueError:
+        pass
+
+
+def test_pdf_and_blank_slips_not_matched_across_customers():
+    dedup = OrderDeduplicator('line')
+    pdf_a = make_orders(['PDF受注'], ['111'], [5]).assign(顧客コード='C1')
+    pdf_b = make_orders(['PDF受注'], ['111'], [7]).assign(顧客コード='C2')
+    assert len(dedup.add(pdf_a, 'a.pdf', 'ocr:1')) == 1
+    assert list(dedup.add(pdf_b, 'b.pdf', 'ocr:2')['発注数量']) == [7]
+    # 同じ伝票番号でも顧客が違えば別の明細
+    assert len(dedup.add(make_orders(['5001'], ['111'], [1]).assign(顧客コード='C1'), 'c.txt', 'c')) == 1
+    assert len(dedup.add(make_orders(['5001'], ['111'], [1]).assign(顧客コード='C2'), 'd.txt', 'd')) == 1
+    blank = make_orders([np.nan, np.nan], ['222', '222'], [2, 3])
+    assert len(dedup.add(blank, 'e.txt', 'e')) == 2 and len(dedup.add(blank.copy(), 'f.txt', 'f')) == 2
+    # 同じ PDF の再取り込みはファイル単位で除く
+    assert dedup.add(pdf_a, 'a.pdf', 'ocr:1').empty
+
+
+def test_large_day_stays_linear_and_compact():
+    rng = np.random.default_rng(0)
+    n = 500_000
+    # 1伝票8明細、伝票単位で重なる2つのエクスポート
+    codes = rng.integers(0, 20_000, n) * 8 + np.arange(n) % 8
+    orders = make_orders((np.arange(n) // 8).astype(str), codes.astype(str), np.ones(n, dtype=np.int64))
+    dedup = OrderDeduplicator('line')
+    t0 = time.perf_counter()
+    dedup.add(orders.iloc[:300_000], 'a.txt', 'a')
+    kept = dedup.add(orders.iloc[200_000:], 'b.txt', 'b')
+    assert time.perf_counter() - t0 < 10
+    assert len(kept) == n - 300_000
+    assert dedup.nbytes == n * 8
+    # 併合後もハッシュ集合はソート済みで重複がない
+    assert np.all(np.diff(dedup._seen) > 0)
+
+
+if __name__ == "__main__":
+    test_same_file_and_overlapping_exports()
+    test_key_modes()
+    test_pdf_and_blank_slips_not_matched_across_customers()
+    test_large_day_stays_linear_and_compact()
+    print("All tests passed!")
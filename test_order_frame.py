@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from app import build_shortage_table, calculate_allocation
+from order_frame import compact_order_frame, order_memory_report
+
+
+def make_orders(n=2000):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        '顧客コード': rng.integers(1, 20, n),
+        '顧客名': [f'顧客{i % 19}' for i in range(n)],
+        '伝票番号': 50000 + np.arange(n) // 4,
+        '商品コード': [str(1000 + i % 97) for i in range(n)],
+        '商品名漢字': [np.nan if i % 97 == 3 else f'商品{i % 97}' for i in range(n)],
+        '商品名カナ': [f'ｼｮｳﾋﾝ{i % 97}' for i in range(n)],
+        '発注数量': rng.integers(1, 30, n),
+        'チェーン店固有エリア': [np.nan if i % 5 else 'E1' for i in range(n)],
+    })
+
+
+def test_compact_frame_keeps_allocation_identical():
+    order_df = make_orders()
+    compact_df = compact_order_frame(order_df)
+    assert compact_df['発注数量'].dtype == np.int32
+    assert isinstance(compact_df['伝票番号'].dtype, pd.CategoricalDtype)
+    assert compact_df['伝票番号'].iloc[0] == '50000'
+    assert compact_df['チェーン店固有エリア'].isna().sum() == order_df['チェーン店固有エリア'].isna().sum()
+
+    inventory_df = pd.DataFrame({'商品コード': [str(1000 + i) for i in range(97)], '倉庫在庫数': [200] * 97})
+    before = calculate_allocation(inventory_df, order_df)
+    after = calculate_allocation(inventory_df, compact_df)
+    pd.testing.assert_frame_equal(before, after)
+    shortage = before[before['引当後在庫'] < 0]
+    assert not shortage.empty
+    pd.testing.assert_frame_equal(build_shortage_table(shortage, order_df), build_shortage_table(shortage, compact_df))
+
+    report = order_memory_report(order_df, compact_df)
+    assert report['変換後(バイト/明細)'] < report['変換前(バイト/明細)'] / 3
+
+
+def test_mixed_values_become_distinct_strings():
+    values = compact_order_frame(pd.DataFrame({'伝票番号': pd.Series([1, '1', None, '2'], dtype=object)}))['伝票番号']
+    assert list(values.cat.categories) == ['1', '2'] and values.isna().sum() == 1
+
+
+if __name__ == "__main__":
+    test_compact_frame_keeps_allocation_identical()
+    test_mixed_values_become_distinct_strings()
+    print("All tests passed!")
@@ -0,0 +1,89 @@
+from io import BytesIO
+
+from app import load_order_file
+from order_schema import LEGACY_COLUMN_COUNT, LEGACY_POSITIONS, OrderSchemaError, PlanCache, plan_cache, resolve_plan
+
+
+class Upload(BytesIO):
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def order_tsv(header, rows, encoding='cp932'):
+    lines = ['\t'.join(header)] + ['\t'.join(row) for row in rows]
+    return ('\r\n'.join(lines) + '\r\n').encode(encoding)
+
+
+def test_header_names_win_over_positions():
+    header = ['伝票No', 'ダミー', '数量', '商品名', '品目コード', '得意先コード', '得意先名', '商品名（カナ）', '固有エリア']
+    plan = resolve_plan(header)
+    assert plan.positions == {'顧客コード': 5, '顧客名': 6, '伝票番号': 0, '商品コード': 4,
+                              '商品名漢字': 3, '商品名カナ': 7, '発注数量': 2, 'チェーン店固有エリア': 8}
+    assert plan.fallback_fields == []
+
+    # 列名のない従来レイアウトは固定位置
+    legacy = resolve_plan([f'列{i + 1}' for i in range(144)])
+    assert legacy.positions == LEGACY_POSITIONS
+    assert len(legacy.fallback_fields) == len(LEGACY_POSITIONS)
+
+    # 列数が足りない・固定位置が別の項目の列
+    for names in (header[:3], ['列'] * 38 + ['商品コード'] + ['列'] * 110):
+        try:
+            resolve_plan(names)
+            raise AssertionError('should fail')
+        except OrderSchemaError:
+            pass
+
+
+def test_generic_names_do_not_override_legacy_positions():
+    names = [f'列{i + 1}' for i in range(LEGACY_COLUMN_COUNT)]
+    # 従来レイアウトの別の列にある「数量」「商品名」は使わない
+    names[20], names[30] = '数量', '商品名'
+    plan = resolve_plan(names)
+    assert plan.positions == LEGACY_POSITIONS and plan.moved == []
+    # 固有の列名は位置が違っても使い、移動した項目として記録する
+    names[50] = '発注数量'
+    plan = resolve_plan(names)
+    assert plan.positions['発注数量'] == 50 and plan.sources['発注数量'] == 'header'
+    assert plan.moved == ['発注数量']
+    # 列数が違うファイルでは一般的な列名も使う
+    wider = ['数量'] + [f'列{i + 2}' for i in range(LEGACY_COLUMN_COUNT)]
+    assert resolve_plan(wider).positions['発注数量'] == 0
+
+
+def test_plan_cached_per_header_fingerprint():
+    cache = PlanCache()
+    header = ['顧客コード', '顧客名', '伝票番号', '商品コード', '商品名漢字', '商品名カナ', '発注数量', 'チェーン店固有エリア']
+    first = cache.plan_for(order_tsv(header, [['C1'] * 8]), 'cp932')
+    second = cache.plan_for(order_tsv(header, [['C2'] * 8]), 'cp932')
+    assert first is second and (cache.hits, cache.misses) == (1, 1)
+    cache.plan_for(order_tsv(header[::-1], []), 'cp932')
+    assert cache.misses == 2
+
+
+def test_load_order_file_with_shifted_layout():
+    plan_cache.clear()
+    header = ['備考', '発注数量', '商品コード', '伝票番号', '顧客名', '顧客コード', '商品名カナ', '商品名漢字', 'チェーン店固有エリア']
+    rows = [
+        ['', '12', '0061539', '5001', '顧客1', 'C1', 'ｱ', '商品A', 'E1'],
+        ['', '3', '0030126', '5001', '顧客1', 'C1', 'ｲ', '除外', 'E1'],
+        ['x', '5', '0062192', '5002', '顧客2', 'C2', 'ｳ', '商品B', ''],
+    ]
+    df = load_order_file(Upload(order_tsv(header, rows), 'o.txt'))
+    assert list(df['商品コード']) == ['61539', '62192']
+    assert list(df['発注数量']) == [12, 5]
+    assert list(df['顧客名']) == ['顧客1', '顧客2']
+    assert list(df.columns) == ['顧客コード', '顧客名', '伝票番号', '商品コード', '商品名漢字', '商品名カナ',
+                                '発注数量', 'チェーン店固有エリア']
+    load_order_file(Upload(order_tsv(header, rows[:1]), 'o2.txt'))
+    assert plan_cache.hits == 1
+
+
+if __name__ == "__main__":
+    test_header_names_win_over_positions()
+    test_generic_names_do_not_override_legacy_positions()
+    test_plan_cached_per_header_fingerprint()
+    test_load_order_file_with_shifted_layout()
+    print("All tests passed!")
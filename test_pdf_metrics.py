@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+
+from pdf_metrics import MetricsRegistry, PdfMetrics, registry
+
+
+def test_page_metrics_and_exports():
+    registry.reset()
+    metrics = PdfMetrics('sample.pdf')
+    page = metrics.new_page(0)
+    for stage in ('render', 'ocr', 'header', 'rows'):
+        with metrics.stage(page, stage):
+            pass
+    page['boxes'] = 42
+    page['rows'] = 3
+    page['fallback'].append('qty_x')
+    metrics.finish()
+
+    summary = metrics.summary()
+    assert summary['ページ数'] == 1
+    assert summary['ボックス数'] == 42
+    assert summary['抽出行数'] == 3
+    assert summary['フォールバック'] == 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = metrics.write_jsonl(os.path.join(tmp, 'pdf_metrics.jsonl'))
+        with open(path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        assert len(records) == 1
+        assert records[0]['file'] == 'sample.pdf'
+        assert records[0]['page'] == 1
+        assert records[0]['ocr_s'] >= 0
+
+        prom_path = registry.write_prometheus(os.path.join(tmp, 'pdf_metrics.prom'))
+        with open(prom_path, encoding='utf-8') as f:
+            text = f.read()
+    assert 'pdf_files_total 1' in text
+    assert 'pdf_rows_extracted_total 3' in text
+    assert 'pdf_fallback_coords_total{coord="qty_x"} 1' in text
+
+
+def test_error_file_is_counted():
+    local = MetricsRegistry()
+    metrics = PdfMetrics('broken.pdf')
+    metrics.total_seconds = 0.0
+    metrics.error = 'boom'
+    local.observe(metrics)
+    assert 'pdf_file_errors_total 1' in local.render_prometheus()
+    assert metrics.to_records()[0]['error'] == 'boom'
+
+
+if __name__ == "__main__":
+    test_page_metrics_and_exports()
+    test_error_file_is_counted()
+    print("All tests passed!")
@@ -0,0 +1,49 @@
+import threading
+import time
+
+from profiling import PROFILE_ENV, NullProfiler, RunProfiler, profiling_requested, start_profiler
+
+
+def busy_loop(seconds):
+    end = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < end:
+        total += 1
+    return total
+
+
+def test_disabled_profiler_is_free(monkeypatch):
+    monkeypatch.delenv(PROFILE_ENV, raising=False)
+    threads = threading.active_count()
+    profiler = start_profiler({})
+    assert isinstance(profiler, NullProfiler)
+    assert profiler.stage('a') is profiler.stage('b')
+    assert threading.active_count() == threads
+
+
+def test_enabled_by_env_or_query(monkeypatch):
+    monkeypatch.delenv(PROFILE_ENV, raising=False)
+    assert profiling_requested({'profile': '1'})
+    assert not profiling_requested({'profile': '0'})
+    monkeypatch.setenv(PROFILE_ENV, '1')
+    assert profiling_requested(None)
+
+
+def test_stage_breakdown_and_sampling():
+    profiler = RunProfiler(interval=0.001)
+    with profiler.stage('引当計算'):
+        busy_loop(0.1)
+    with profiler.stage('結果表示'):
+        time.sleep(0.05)
+    profiler.stop()
+
+    records = {r['stage']: r for r in profiler.records()}
+    assert records['引当計算']['cpu_s'] > 0.05
+    assert records['結果表示']['cpu_s'] < records['結果表示']['wall_s']
+    assert abs(sum(r['share'] for r in records.values()) - 1.0) < 1e-9
+    assert 'busy_loop (test_profiling.py' in profiler.collapsed_stacks()
+
+
+if __name__ == "__main__":
+    test_stage_breakdown_and_sampling()
+    print("All tests passed!")
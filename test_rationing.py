@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from app import calculate_allocation
+from bench_rationing import check, make_data
+from rationing import MINIMUM, PRIORITY, PROPORTIONAL, ration
+
+
+def make_orders():
+    return pd.DataFrame({
+        '顧客コード': ['C1', 'C2', 'C3', 'C1', 'C2'],
+        '顧客名': ['顧客1', '顧客2', '顧客3', '顧客1', '顧客2'],
+        '伝票番号': ['5001', '5002', '5003', '5004', '5002'],
+        '商品コード': ['111', '111', '111', '111', '222'],
+        '商品名漢字': ['商品A'] * 4 + ['商品B'],
+        '商品名カナ': ['ｱ'] * 4 + ['ｲ'],
+        '発注数量': [10, 5, 1, 4, 3],
+    })
+
+
+def allocated(result):
+    return dict(zip(result['伝票番号'], result['割当数']))
+
+
+def test_policies_split_available_stock():
+    order_df = make_orders()
+    # 111: 受注 20 / 在庫 7 -> 不足、222 は充足なので対象外
+    allocation_df = calculate_allocation(pd.DataFrame({'商品コード': ['111', '222'], '倉庫在庫数': [7, 5]}), order_df)
+
+    result = ration(allocation_df, order_df)
+    assert list(result['商品コード'].unique()) == ['111']
+    # 7 × (10, 5, 1, 4) / 20 = 3.5, 1.75, 0.35, 1.4 -> 端数の大きい 5002・5001 に 1 個ずつ
+    assert allocated(result) == {'5001': 4, '5002': 2, '5003': 0, '5004': 1}
+    assert list(result['不足数']) == [6, 3, 1, 3]
+
+    result = ration(allocation_df, order_df, policy=PRIORITY, priority=['C3', 'C2'])
+    assert allocated(result) == {'5001': 1, '5002': 5, '5003': 1, '5004': 0}
+
+    result = ration(allocation_df, order_df, policy=MINIMUM, minimum=2)
+    assert allocated(result) == {'5001': 2, '5002': 2, '5003': 1, '5004': 2}
+
+    by_customer = ration(allocation_df, order_df, unit='顧客コード')
+    assert dict(zip(by_customer['顧客コード'], by_customer['受注数'])) == {'C1': 14, 'C2': 5, 'C3': 1}
+    assert by_customer['割当数'].sum() == 7
+
+
+def test_policies_conserve_stock_at_scale():
+    inventory_df, order_df = make_data(200_000, 5_000, shortage_rate=0.1)
+    allocation_df = calculate_allocation(inventory_df, order_df)
+    for policy, options in ((PROPORTIONAL, {}), (PRIORITY, {'priority': ['C3', 'C7']}), (MINIMUM, {'minimum': 3})):
+        result = ration(allocation_df, order_df, policy=policy, **options)
+        assert check(result, allocation_df) == []
+        assert np.all(result['割当数'] + result['不足数'] == result['受注数'])
+
+
+if __name__ == "__main__":
+    test_policies_split_available_stock()
+    test_policies_conserve_stock_at_scale()
+    print("All tests passed!")
@@ -0,0 +1,128 @@
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from app import calculate_allocation
+from demand_matrix import DemandMatrix
+from run_history import RunHistory
+
+
+def make_run(short_codes, n_products=200):
+    inventory_df = pd.DataFrame({
+        '商品コード': [str(1000 + i) for i in range(n_products)],
+        '倉庫在庫数': [0 if str(1000 + i) in short_codes else 100 for i in range(n_products)],
+    })
+    order_df = pd.DataFrame({
+        '顧客コード': [f'C{i % 5}' for i in range(n_products)],
+        '顧客名': [f'顧客{i % 5}' for i in range(n_products)],
+        '伝票番号': [str(50000 + i // 4) for i in range(n_products)],
+        '商品コード': [str(1000 + i) for i in range(n_products)],
+        '商品名漢字': ['商品'] * n_products,
+        '商品名カナ': ['ｼｮｳﾋﾝ'] * n_products,
+        '発注数量': [3] * n_products,
+        'チェーン店固有エリア': [''] * n_products,
+    })
+    return calculate_allocation(inventory_df, order_df), order_df
+
+
+def test_recurring_shortages_and_customer_impact(tmp_path):
+    history = RunHistory(str(tmp_path / 'history.sqlite3'))
+    now = datetime(2026, 3, 7, 18, 0)
+    for day in range(7):
+        run_at = now - timedelta(days=6 - day)
+        short = {'1000', '1001'} | ({'1002'} if day % 2 else set())
+        allocation_df, order_df = make_run(short)
+        history.record_run(allocation_df, order_df, inventory='stock.xlsx', order_files=['o.txt'], run_at=run_at)
+    # 同じ日の2回目の実行
+    allocation_df, order_df = make_run({'1000'})
+    history.record_run(allocation_df, order_df, run_at=now)
+
+    recurring = history.recurring_shortages(days=7, now=now).set_index('商品コード')
+    assert history.run_days(7, now=now) == 7
+    assert bool(recurring.loc['1000', '毎日不足']) and recurring.loc['1000', '不足回数'] == 8
+    assert bool(recurring.loc['1001', '毎日不足'])
+    assert recurring.loc['1002', '不足日数'] == 3 and not recurring.loc['1002', '毎日不足']
+
+    impact = history.customer_impact(days=7, now=now).set_index('顧客コード')
+    assert impact.loc['C0', '不足伝票数'] == 1
+    # 再実行しても同じ不足を重ねて数えない（最後の実行の不足数 3）
+    assert impact.loc['C0', '不足数(按分)'] == 3
+    assert len(history.product_history('1000', days=7, now=now)) == 8
+
+
+def test_customer_impact_matches_demand_matrix(tmp_path):
+    history = RunHistory(str(tmp_path / 'history.sqlite3'))
+    now = datetime(2026, 3, 7, 18, 0)
+    inventory_df = pd.DataFrame({'商品コード': ['P1', 'P2'], '倉庫在庫数': [3, 1]})
+    order_df = pd.DataFrame({
+        '顧客コード': ['C1', 'C1', 'C2', 'C2'],
+        '顧客名': ['顧客1', '顧客1', '顧客2', '顧客2'],
+        '伝票番号': ['5001', '5002', '5003', '5003'],
+        '商品コード': ['P1', 'P1', 'P1', 'P2'],
+        '商品名漢字': ['商品'] * 4,
+        '商品名カナ': ['ｼｮｳﾋﾝ'] * 4,
+        '発注数量': [2, 4, 6, 5],
+    })
+    allocation_df = calculate_allocation(inventory_df, order_df)
+    # P1 は不足 9 を受注数量（C1: 6、C2: 6）で按分し、伝票数では按分しない。同じ日に2回実行しても増えない
+    for hours in (2, 1):
+        history.record_run(allocation_df, order_df, run_at=now - timedelta(hours=hours))
+    impact = history.customer_impact(days=7, now=now).set_index('顧客コード')
+    assert impact['不足数(按分)'].to_dict() == {'C1': 4.5, 'C2': 8.5}
+    assert impact.loc['C1', '不足伝票数'] == 2
+
+    exposure = DemandMatrix.build(order_df).customer_exposure(allocation_df).set_index('顧客コード')
+    assert impact['不足数(按分)'].to_dict() == exposure['不足数(按分)'].to_dict()
+
+
+def test_history_without_quantity_column_is_migrated(tmp_path):
+    path = str(tmp_path / 'history.sqlite3')
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE shortage_lines (run_id INTEGER NOT NULL, run_at TEXT NOT NULL, product_code TEXT NOT NULL, "
+                     "slip_no TEXT NOT NULL, customer_code TEXT, customer_name TEXT, shortage INTEGER NOT NULL)")
+    history = RunHistory(path)
+    now = datetime(2026, 3, 7, 18, 0)
+    allocation_df, order_df = make_run({'1000'})
+    history.record_run(allocation_df, order_df, run_at=now)
+    assert history.customer_impact(days=7, now=now).loc[0, '不足数(按分)'] == 3
+
+
+def test_compaction_keeps_daily_rollups(tmp_path):
+    history = RunHistory(str(tmp_path / 'history.sqlite3'))
+    now = datetime(2026, 3, 7, 18, 0)
+    for days_ago in (120, 100, 1):
+        allocation_df, order_df = make_run({'1000'})
+        history.record_run(allocation_df, order_df, run_at=now - timedelta(days=days_ago))
+
+    removed = history.compact(detail_days=90, rollup_days=110, now=now)
+    assert removed > 0
+    assert len(history.product_history('1000', days=365, now=now)) == 1
+    assert len(history.customer_impact(days=365, now=now)) == 1
+    recurring = history.recurring_shortages(days=365, min_days=1, now=now)
+    assert recurring.loc[0, '不足日数'] == 2
+
+
+def test_queries_stay_fast_over_months(tmp_path):
+    history = RunHistory(str(tmp_path / 'history.sqlite3'))
+    now = datetime(2026, 3, 7, 18, 0)
+    for day in range(90):
+        allocation_df, order_df = make_run({str(1000 + (day + i) % 50) for i in range(20)}, n_products=500)
+        history.record_run(allocation_df, order_df, run_at=now - timedelta(days=day))
+    t0 = time.perf_counter()
+    recurring = history.recurring_shortages(days=30, now=now)
+    history.customer_impact(days=30, now=now)
+    assert time.perf_counter() - t0 < 0.5
+    assert not recurring.empty
+
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+    for test in (test_recurring_shortages_and_customer_impact, test_customer_impact_matches_demand_matrix,
+                 test_history_without_quantity_column_is_migrated, test_compaction_keeps_daily_rollups,
+                 test_queries_stay_fast_over_months):
+        with tempfile.TemporaryDirectory() as d:
+            test(pathlib.Path(d))
+    print("All tests passed!")
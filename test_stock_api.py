@@ -0,0 +1,112 @@
+import json
+import time
+import urllib.error
+import urllib.request
+
+import pandas as pd
+
+import stock_api
+from allocation_state import AllocationState
+
+
+def make_state():
+    inventory_df = pd.DataFrame({
+        '商品コード': ['111', '222', '555'],
+        '倉庫在庫数': [150, 50, 40],
+        '入庫予定数': [50, 0, 0],
+        '入数': [10, 12, 6],
+    })
+    order_df = pd.DataFrame({
+        '顧客コード': ['C1', 'C2', 'C3', 'C2'],
+        '顧客名': ['顧客1', '顧客2', '顧客3', '顧客2'],
+        '伝票番号': ['5001', '5002', '5003', '5002'],
+        '商品コード': ['111', '222', '222', '222'],
+        '商品名漢字': ['商品A', '商品B', '商品B', '商品B'],
+        '商品名カナ': ['ｱ', 'ｲ', 'ｲ', 'ｲ'],
+        '発注数量': [100, 40, 20, 20],
+        'チェーン店固有エリア': [''] * 4,
+    })
+    return AllocationState.build(inventory_df, order_df)
+
+
+def request(url, payload=None):
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=5) as res:
+            return res.status, json.loads(res.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_index_lookup_excludes_whatif():
+    state = make_state()
+    state.set_override('222', on_hand=500)
+    index = stock_api.StockIndex(state, label='stock.xlsx')
+    record = index.lookup('000222')
+    assert record['stock'] == 50 and record['ordered'] == 80
+    assert record['remaining'] == -30 and record['available'] == 0 and record['short']
+    assert [s['slip'] for s in record['slips']] == ['5002', '5003']
+    assert index.lookup('555')['slips'] == [] and index.lookup('999') is None
+
+    t0 = time.perf_counter()
+    for _ in range(1000):
+        index.lookup('111')
+    assert (time.perf_counter() - t0) / 1000 < 0.001
+
+
+def test_server_single_and_bulk():
+    published = {}
+    server = stock_api.StockApiServer(index_fn=lambda owner: published.get('index'), port=0).start()
+    try:
+        status, body = request(f'{server.url}/stock/111')
+        assert status == 503
+        assert request(f'{server.url}/healthz')[1]['ready'] is False
+
+        published['index'] = stock_api.StockIndex(make_state(), label='stock.xlsx')
+        status, body = request(f'{server.url}/stock/111')
+        assert status == 200 and body['remaining'] == 50 and body['name'] == '商品A'
+        assert request(f'{server.url}/stock/999')[0] == 404
+        # クエリ文字列はルーティングに含めない
+        assert request(f'{server.url}/stock/111?owner=u1')[1]['code'] == '111'
+        assert request(f'{server.url}/healthz?owner=u1')[1]['ready'] is True
+
+        status, body = request(f'{server.url}/stock/lookup', {'codes': ['111', '0222', '999']})
+        assert status == 200
+        assert [r['code'] for r in body['results']] == ['111', '222']
+        assert body['not_found'] == ['999']
+        assert request(f'{server.url}/stock/lookup', {'codes': 'x'})[0] == 400
+    finally:
+        server.stop()
+
+
+def test_results_published_per_owner():
+    stock_api._published.clear()
+    server = stock_api.StockApiServer(port=0).start()
+    try:
+        assert request(f'{server.url}/stock/111')[0] == 503
+        state = make_state()
+        stock_api.publish(state, 'a.xlsx', owner='u1')
+        # 公開中の結果が1つなら所有者IDは省略できる
+        assert request(f'{server.url}/stock/111')[1]['remaining'] == 50
+
+        other = make_state()
+        other.set_stock(pd.DataFrame({'商品コード': ['111'], '倉庫在庫数': [0], '入庫予定数': [0], '入数': [10]}))
+        stock_api.publish(other, 'b.xlsx', owner='u2')
+        assert request(f'{server.url}/stock/111')[0] == 400
+        assert request(f'{server.url}/stock/lookup', {'codes': ['111']})[0] == 400
+        # 後から公開した別のブラウザの結果に上書きされない
+        assert request(f'{server.url}/stock/111?owner=u1')[1]['remaining'] == 50
+        assert request(f'{server.url}/stock/111?owner=u2')[1]['remaining'] == -100
+        assert request(f'{server.url}/stock/111?owner=u9')[0] == 503
+        assert request(f'{server.url}/healthz?owner=u2')[1]['label'] == 'b.xlsx'
+    finally:
+        server.stop()
+        stock_api._published.clear()
+
+
+if __name__ == "__main__":
+    test_index_lookup_excludes_whatif()
+    test_server_single_and_bulk()
+    test_results_published_per_owner()
+    print("All tests passed!")
@@ -0,0 +1,69 @@
+import pandas as pd
+
+from app import build_shortage_table, calculate_allocation, load_inventory_file, load_order_file
+from bench_allocation import LocalFile, find_regressions, main
+from synth_data import generate_dataset, inventory_frame, write_inventory
+
+
+def reference_shortage_rows(shortage_df, order_df):
+    # 以前の display_results の伝票展開（1行ずつ）
+    rows = []
+    for _, row in shortage_df.iterrows():
+        details = order_df[order_df['商品コード'] == row['商品コード']][['顧客名', '伝票番号', 'チェーン店固有エリア']].drop_duplicates(subset=['伝票番号'])
+        for _, detail in details.iterrows():
+            rows.append((row['商品コード'], str(detail['伝票番号']), str(detail['顧客名']), str(detail['チェーン店固有エリア'])))
+    return sorted(rows)
+
+
+def test_generated_files_load_and_match_truth(tmp_path):
+    dataset = generate_dataset(str(tmp_path), n_rows=3000, n_skus=300, shortage_rate=0.1, seed=3)
+    inventory_df = load_inventory_file(LocalFile(dataset['inventory']))
+    order_df = load_order_file(LocalFile(dataset['orders']))
+    assert len(order_df) == 3000
+    assert len(inventory_df) == 300
+
+    allocation_df = calculate_allocation(inventory_df, order_df)
+    shortage_df = allocation_df[allocation_df['引当後在庫'] < 0]
+    assert sorted(shortage_df['商品コード']) == dataset['expected_shortages']
+    assert dataset['expected_shortages']
+
+    table = build_shortage_table(shortage_df, order_df)
+    actual = sorted(zip(table['商品コード'], table['伝票番号'], table['該当顧客名'], table['商品名']))
+    assert actual == reference_shortage_rows(shortage_df, order_df)
+    assert list(table['伝票番号']) == sorted(table['伝票番号'])
+    assert (table['不足数'] > 0).all()
+
+
+def test_xlsx_inventory_and_row_cap(tmp_path):
+    frame, _ = inventory_frame(pd.Series([5, 0, 3]).to_numpy(), seed=1)
+    assert frame.shape[1] == 23
+    path = write_inventory(str(tmp_path / 'inventory.xlsx'), frame)
+    assert len(load_inventory_file(LocalFile(path))) == 3
+    try:
+        write_inventory(str(tmp_path / 'big.xlsx'), pd.DataFrame(index=range(1_048_577)))
+        raise AssertionError('should refuse')
+    except ValueError:
+        pass
+
+
+def test_find_regressions():
+    stage = {'seconds': 1.0, 'peak_rss_mb': 100.0}
+    baseline = {'scales': {'1000': {'stages': {'load_order_file': stage}}}}
+    result = {'rows': 1000, 'correct': True, 'stages': {'load_order_file': {'seconds': 1.1, 'peak_rss_mb': 90.0}}}
+    assert find_regressions([result], baseline) == []
+    result['stages']['load_order_file'] = {'seconds': 2.0, 'peak_rss_mb': 200.0}
+    assert len(find_regressions([result], baseline)) == 2
+    result['correct'] = False
+    assert len(find_regressions([result], {})) == 1
+
+
+def test_missing_baseline_fails(tmp_path):
+    baseline = str(tmp_path / 'baseline.json')
+    assert main(['--scales', '1000', '--baseline', baseline]) == 2
+    assert main(['--scales', '1000', '--baseline', baseline, '--update-baseline']) == 0
+    assert main(['--scales', '2000', '--baseline', baseline]) == 2
+
+
+if __name__ == "__main__":
+    test_find_regressions()
+    print("All tests passed!")
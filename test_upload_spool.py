@@ -0,0 +1,69 @@
+import gc
+import os
+from io import BytesIO
+
+from app import load_order_file
+from upload_spool import UploadSpool, detect_encoding
+
+
+class Upload(BytesIO):
+    def __init__(self, data, name, file_id):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+        self.file_id = file_id
+
+
+def order_tsv(encoding, n_rows=50):
+    header = '\t'.join(f'col{i}' for i in range(144))
+    lines = [header]
+    for i in range(n_rows):
+        row = [''] * 144
+        row[14], row[15], row[38] = '1001', 'テスト店', str(5000 + i)
+        row[97], row[106], row[108], row[118], row[143] = f'00{111 + i % 3}', '商品', 'ｼｮｳﾋﾝ', '2', ''
+        lines.append('\t'.join(row))
+    return ('\n'.join(lines) + '\n').encode(encoding)
+
+
+def test_large_upload_is_spooled_and_parsed_from_disk():
+    spool = UploadSpool(threshold_mb=0.001)
+    data = order_tsv('cp932')
+    large = spool.spool(Upload(data, 'order.txt', 'f1'))
+    small = UploadSpool(threshold_mb=10).spool(Upload(data, 'order.txt', 'f2'))
+
+    assert large.path and os.path.getsize(large.path) == len(data)
+    assert small.path is None
+    spooled_df = load_order_file(large)
+    memory_df = load_order_file(small)
+    assert len(spooled_df) == 50
+    assert spooled_df.equals(memory_df)
+    assert spooled_df['顧客名'].iloc[0] == 'テスト店'
+    assert spool.spool(Upload(data, 'order.txt', 'f1')) is large
+
+    # アップロードが外されたファイルは即座に削除される
+    spool.retain([])
+    assert not os.path.exists(large.path)
+
+
+def test_spool_directory_is_removed_with_session():
+    spool = UploadSpool(threshold_mb=0.001)
+    spool.spool(Upload(order_tsv('utf-8'), 'order.txt', 'f1'))
+    directory = spool.dir
+    assert os.listdir(directory)
+    del spool
+    gc.collect()
+    assert not os.path.exists(directory)
+
+
+def test_detect_encoding():
+    encodings = ['utf-8-sig', 'utf-8', 'cp932']
+    assert detect_encoding(order_tsv('utf-8'), encodings) == 'utf-8-sig'
+    assert detect_encoding(order_tsv('cp932'), encodings) == 'cp932'
+    assert detect_encoding(b'\xff\xfe\x81', ['utf-8']) is None
+
+
+if __name__ == "__main__":
+    test_large_upload_is_spooled_and_parsed_from_disk()
+    test_spool_directory_is_removed_with_session()
+    test_detect_encoding()
+    print("All tests passed!")
@@ -0,0 +1,167 @@
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from watch_daemon import WatchDaemon, WatchedFile, read_report
+
+HEADER = ['顧客コード', '顧客名', '伝票番号', '商品コード', '商品名漢字', '商品名カナ', '発注数量', 'チェーン店固有エリア']
+
+
+def write(path, data, age=60):
+    with open(path, 'wb') as f:
+        f.write(data)
+    # 書き込み完了から十分に時間が経ったファイルとして扱う
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def order_tsv(rows):
+    lines = ['\t'.join(HEADER)] + ['\t'.join(['C1', customer, slip, code, '商品', 'ｼｮｳﾋﾝ', str(qty), ''])
+                                   for customer, slip, code, qty in rows]
+    return ('\r\n'.join(lines) + '\r\n').encode('cp932')
+
+
+def inventory_csv(stock):
+    rows = []
+    for code, (on_hand, incoming, pack) in stock.items():
+        row = [''] * 23
+        row[1], row[4], row[8], row[10], row[13], row[22] = 'A309001', '1-01', code, pack, on_hand, incoming
+        rows.append(row)
+    return pd.DataFrame(rows).to_csv(header=False, index=False).encode('cp932')
+
+
+def shortages(daemon):
+    shortage_df, _ = daemon.state.shortage_report()
+    return dict(zip(shortage_df['商品コード'], -shortage_df['引当後在庫']))
+
+
+def test_incremental_updates_and_report():
+    with tempfile.TemporaryDirectory() as inbox:
+        daemon = WatchDaemon(inbox, settle_seconds=2)
+        write(os.path.join(inbox, 'orders_am.txt'), order_tsv([('顧客1', '5001', '0111', 30), ('顧客2', '5002', '222', 5)]))
+        assert daemon.poll()
+        # 在庫ファイルが届くまでは判定しない
+        assert shortages(daemon) == {}
+
+        # 111: 在庫 10 + 入庫予定 1 ケース × 6 = 16
+        write(os.path.join(inbox, 'inventory.csv'), inventory_csv({'0111': (10, 1, 6), '222': (50, 0, 1)}))
+        assert daemon.poll()
+        assert shortages(daemon) == {'111': 14}
+        assert not daemon.poll()
+
+        # 書き込み直後のファイルは次回に回す
+        write(os.path.join(inbox, 'orders_pm.txt'), order_tsv([('顧客3', '5003', '222', 60)]), age=0)
+        assert not daemon.poll()
+        write(os.path.join(inbox, 'orders_pm.txt'), order_tsv([('顧客3', '5003', '222', 60)]))
+        assert daemon.poll()
+        assert shortages(daemon) == {'111': 14, '222': 15}
+
+        # 更新されたファイルは前回分を差し引いて置き換え、削除されたファイルは差し引く
+        write(os.path.join(inbox, 'orders_am.txt'), order_tsv([('顧客1', '5001', '111', 20)]), age=30)
+        assert daemon.poll()
+        assert shortages(daemon) == {'111': 4, '222': 10}
+        os.remove(os.path.join(inbox, 'orders_pm.txt'))
+        assert daemon.poll()
+        assert shortages(daemon) == {'111': 4} and daemon.state.order_lines == 1
+
+        status, table = read_report(daemon.out_dir)
+        assert status['order_files'] == ['orders_am.txt'] and status['shortages'] == 1
+        assert list(table['商品コード']) == ['111'] and list(table['伝票番号']) == ['5001']
+
+
+def test_broken_file_reported_until_changed():
+    with tempfile.TemporaryDirectory() as inbox:
+        daemon = WatchDaemon(inbox)
+        write(os.path.join(inbox, 'inventory.csv'), inventory_csv({'111': (10, 0, 1)}))
+        write(os.path.join(inbox, 'broken.txt'), b'\xff\xfe\x00garbage')
+        write(os.path.join(inbox, 'notes.md'), b'ignored')
+        daemon.poll()
+        status, _ = read_report(daemon.out_dir)
+        assert list(status['errors']) == ['broken.txt'] and status['inventory_files'] == ['inventory.csv']
+        assert not daemon.poll()
+
+        write(os.path.join(inbox, 'broken.txt'), order_tsv([('顧客1', '5001', '111', 12)]), age=30)
+        assert daemon.poll()
+        assert daemon.errors == {} and shortages(daemon) == {'111': 2}
+
+
+def test_duplicate_orders_counted_once():
+    with tempfile.TemporaryDirectory() as inbox:
+        daemon = WatchDaemon(inbox)
+        write(os.path.join(inbox, 'inventory.csv'), inventory_csv({'111': (10, 0, 1), '222': (10, 0, 1)}))
+        morning = order_tsv([('顧客1', '5001', '111', 12), ('顧客2', '5002', '222', 4)])
+        write(os.path.join(inbox, 'a_orders.txt'), morning)
+        assert daemon.poll()
+        # 同じファイルの再送と、前のファイルの明細を含むファイル
+        write(os.path.join(inbox, 'b_resent.txt'), morning)
+        write(os.path.join(inbox, 'c_merged.txt'), order_tsv([('顧客1', '5001', '111', 12), ('顧客3', '5003', '222', 9)]))
+        assert daemon.poll()
+        assert shortages(daemon) == {'111': 2, '222': 3}
+        status, _ = read_report(daemon.out_dir)
+        assert status['duplicate_lines'] == 3 and status['order_lines'] == 3
+
+        # 元のファイルが消えたら、重複として除いていた明細を数える
+        os.remove(os.path.join(inbox, 'a_orders.txt'))
+        assert daemon.poll()
+        assert shortages(daemon) == {'111': 2, '222': 3} and daemon.state.dedup.duplicates == 1
+        os.remove(os.path.join(inbox, 'b_resent.txt'))
+        assert daemon.poll()
+        assert shortages(daemon) == {'111': 2} and daemon.state.order_lines == 2
+
+
+def test_only_changed_and_later_files_are_rematched():
+    with tempfile.TemporaryDirectory() as inbox:
+        daemon = WatchDaemon(inbox)
+        for i, name in enumerate(('a.txt', 'b.txt', 'c.txt')):
+            write(os.path.join(inbox, name), order_tsv([('顧客1', f'500{i}', '111', 1)]))
+            assert daemon.poll()
+        matched = []
+        add_mask = daemon.state.dedup.add_mask
+        daemon.state.dedup.add_mask = lambda order_df, name, *args: matched.append(name) or add_mask(order_df, name, *args)
+
+        # 新しいファイルはそのファイルだけ、更新されたファイルはそれより後のファイルも照合し直す
+        write(os.path.join(inbox, 'd.txt'), order_tsv([('顧客1', '5009', '111', 1)]))
+        assert daemon.poll() and matched == ['d.txt']
+        matched.clear()
+        write(os.path.join(inbox, 'b.txt'), order_tsv([('顧客1', '5001', '111', 2)]), age=30)
+        assert daemon.poll() and matched == ['c.txt', 'd.txt', 'b.txt']
+        assert daemon.state.allocation()['受注合計数'].tolist() == [5]
+
+
+def test_report_in_watched_folder_is_not_ingested():
+    with tempfile.TemporaryDirectory() as inbox:
+        daemon = WatchDaemon(inbox, out_dir=inbox)
+        write(os.path.join(inbox, 'inventory.csv'), inventory_csv({'111': (10, 0, 1)}))
+        write(os.path.join(inbox, 'orders.txt'), order_tsv([('顧客1', '5001', '111', 12)]))
+        assert daemon.poll()
+        assert shortages(daemon) == {'111': 2}
+        # 書き出した shortages.csv を在庫ファイルとして読まない
+        daemon.clock = lambda: time.time() + 60
+        assert not daemon.poll()
+        assert daemon.state.inventory_rows.keys() == {'inventory.csv'} and daemon.errors == {}
+
+
+def test_watched_file_survives_truncation():
+    with tempfile.TemporaryDirectory() as inbox:
+        path = os.path.join(inbox, 'orders.txt')
+        data = order_tsv([('顧客1', '5001', '111', 12)])
+        write(path, data)
+        file = WatchedFile(path)
+        # 読み込んだ後にファイルが切り詰められても、解析中の内容は変わらない
+        with open(path, 'wb'):
+            pass
+        with file.getbuffer() as buffer:
+            assert bytes(buffer) == data
+        assert file.name == 'orders.txt' and file.size == len(data)
+
+
+if __name__ == "__main__":
+    test_incremental_updates_and_report()
+    test_broken_file_reported_until_changed()
+    test_duplicate_orders_counted_once()
+    test_only_changed_and_later_files_are_rematched()
+    test_report_in_watched_folder_is_not_ingested()
+    test_watched_file_survives_truncation()
+    print("All tests passed!")
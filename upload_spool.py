@@ -0,0 +1,138 @@
+"""大きなアップロードファイルの一時ファイル退避
+
+しきい値（既定 32MB）を超えるアップロードはセッション専用の一時ディレクトリに書き出し、
+パーサーにはファイルパスとメモリマップ（コピーなし）で渡す。小さいファイルは
+アップロードバッファをそのまま使う。一時ファイルはアップロードが外されたとき、
+またはセッション終了でスプールが破棄されたときに削除される。
+"""
+import codecs
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+import weakref
+
+logger = logging.getLogger(__name__)
+
+SPOOL_THRESHOLD_MB = float(os.environ.get('UPLOAD_SPOOL_THRESHOLD_MB', '32'))
+SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR') or None
+DECODE_CHUNK = 1024 * 1024
+
+
+class SpooledUpload:
+    """UploadedFile 互換のラッパー（退避済みなら path と mmap を持つ）"""
+
+    def __init__(self, file, path=None):
+        self._file = file
+        self.name = file.name
+        self.size = file.size
+        self.path = path
+        self._fh = None
+        self._mmap = None
+
+    def __getattr__(self, attr):
+        # read / seek などは元のアップロードバッファに委譲する
+        return getattr(self._file, attr)
+
+    def getbuffer(self):
+        """内容へのコピーなしのビュー（退避済みならメモリマップ）"""
+        if self.path is None:
+            return self._file.getbuffer()
+        if self._mmap is None:
+            self._fh = open(self.path, 'rb')
+            self._mmap = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        return memoryview(self._mmap)
+
+    def close(self):
+        if self._mmap is not None and not isinstance(self._mmap, bytes):
+            try:
+                self._mmap.close()
+            except BufferError:
+                # ビューが残っている場合は GC に任せる
+                logger.debug("mmap still exported: %s", self.path)
+        if self._fh is not None:
+            self._fh.close()
+        self._mmap = self._fh = None
+
+
+def parser_source(file):
+    """パーサーに渡す入力（退避済みならパス、そうでなければバッファ）"""
+    path = getattr(file, 'path', None)
+    if path:
+        return path
+    if isinstance(file, SpooledUpload):
+        # パーサーにはラッパーではなく元のバッファを渡す（文字コード指定が効くように）
+        file = file._file
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    return file
+
+
+def detect_encoding(buffer, encodings):
+    """全体を逐次デコードして、最初にエラーなく読めるエンコーディングを返す（なければ None）
+
+    文字列全体は作らず、チャンク単位で検証する。
+    """
+    view = memoryview(buffer)
+    try:
+        for encoding in encodings:
+            decoder = codecs.getincrementaldecoder(encoding)()
+            try:
+                for start in range(0, len(view), DECODE_CHUNK):
+                    decoder.decode(view[start:start + DECODE_CHUNK])
+                decoder.decode(b'', final=True)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+        return None
+    finally:
+        view.release()
+
+
+class UploadSpool:
+    """セッション単位の一時ディレクトリ"""
+
+    def __init__(self, threshold_mb=SPOOL_THRESHOLD_MB, base_dir=SPOOL_DIR):
+        self.threshold = int(threshold_mb * 1024 * 1024)
+        self.dir = tempfile.mkdtemp(prefix='upload-spool-', dir=base_dir)
+        self._files = {}
+        # セッション（このオブジェクト）が破棄されたら一時ディレクトリを消す
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.dir, ignore_errors=True)
+
+    def spool(self, file):
+        """アップロードを SpooledUpload に包む（しきい値を超えるものは一時ファイルへ）"""
+        if file is None:
+            return None
+        key = getattr(file, 'file_id', None) or f'{file.name}:{file.size}'
+        if key in self._files:
+            return self._files[key]
+        path = None
+        if file.size > self.threshold:
+            path = os.path.join(self.dir, f'{len(self._files):04d}_{os.path.basename(file.name)}')
+            with open(path, 'wb') as f:
+                f.write(file.getbuffer())
+        wrapped = self._files[key] = SpooledUpload(file, path)
+        return wrapped
+
+    def retain(self, files):
+        """現在アップロードされていないファイルの一時ファイルを削除する"""
+        keep = {getattr(f, 'file_id', None) or f'{f.name}:{f.size}' for f in files if f is not None}
+        for key in [k for k in self._files if k not in keep]:
+            wrapped = self._files.pop(key)
+            wrapped.close()
+            if wrapped.path:
+                try:
+                    os.remove(wrapped.path)
+                except OSError:
+                    pass
+
+    def cleanup(self):
+        for wrapped in self._files.values():
+            wrapped.close()
+        self._files.clear()
+        self._finalizer()
+
+    @property
+    def spooled_bytes(self):
+        return sum(w.size for w in self._files.values() if w.path)
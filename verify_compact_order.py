@@ -0,0 +1,72 @@
+"""受注明細の省メモリ表現（order_frame.compact_order_frame）の検証
+
+synth_data の合成データ（既定 500 万明細、bench_data/ にキャッシュ）を読み込み、
+変換前後の明細あたりのバイト数を表示する。引当結果・不足一覧・引当状態が
+変換前と完全に一致しない場合は終了コード 1。
+
+    python verify_compact_order.py
+    python verify_compact_order.py --rows 1000000 --skus 20000
+"""
+import argparse
+import sys
+import time
+
+import pandas as pd
+
+from allocation_state import AllocationState
+from app import build_shortage_table, calculate_allocation, load_inventory_file, load_order_file
+from bench_allocation import LocalFile, dataset_for
+from order_frame import compact_order_frame, order_memory_report
+
+
+def shortages(allocation_df):
+    return allocation_df[(allocation_df['引当後在庫'] < 0) & (allocation_df['商品コード'] != '19005')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='compact order frame verification')
+    parser.add_argument('--rows', type=int, default=5_000_000)
+    parser.add_argument('--skus', type=int, help='SKU 数（既定は行数 / 50、最低 1000）')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    dataset = dataset_for(args.rows, args.skus, args.seed, 'csv')
+    inventory_df = load_inventory_file(LocalFile(dataset['inventory']))
+    order_df = load_order_file(LocalFile(dataset['orders']))
+
+    t0 = time.perf_counter()
+    compact_df = compact_order_frame(order_df)
+    convert_s = time.perf_counter() - t0
+    report = order_memory_report(order_df, compact_df)
+    print(f"明細数: {report['明細数']:,}（変換 {convert_s:.2f} 秒）")
+    print(f"変換前: {report['変換前(バイト)'] / 1024 / 1024:,.1f} MB ({report['変換前(バイト/明細)']:.1f} バイト/明細)")
+    print(f"変換後: {report['変換後(バイト)'] / 1024 / 1024:,.1f} MB ({report['変換後(バイト/明細)']:.1f} バイト/明細)")
+    print(f"削減率: {report['削減率']:.1%}")
+
+    results = {}
+    for label, frame in (('変換前', order_df), ('変換後', compact_df)):
+        t0 = time.perf_counter()
+        allocation_df = calculate_allocation(inventory_df, frame)
+        table = build_shortage_table(shortages(allocation_df), frame)
+        state = AllocationState.build(inventory_df, frame).frame()
+        results[label] = (allocation_df, table, state)
+        print(f"{label}: 引当・不足一覧・引当状態 {time.perf_counter() - t0:.2f} 秒")
+
+    failures = []
+    for name, before, after in zip(('calculate_allocation', 'build_shortage_table', 'AllocationState'),
+                                   results['変換前'], results['変換後']):
+        try:
+            pd.testing.assert_frame_equal(before, after)
+        except AssertionError as e:
+            failures.append(f"{name}: {e}")
+    if failures:
+        print("NG:")
+        for msg in failures:
+            print(f"  {msg}")
+        return 1
+    print(f"OK: 不足 {len(results['変換後'][1]):,} 行を含む結果が一致しました")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,7 +14,7 @@ class MockFile:
             return f.read()
 
 def test_pdf_extraction():
-    pdf_path = r"c:\Users\PC_User\Desktop\Antigravity\在庫引当チェックツール_vr3\PDF ファイル\受注一覧リスト必須項目.pdf"
+    pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PDF ファイル', '受注一覧リスト必須項目.pdf')
     if not os.path.exists(pdf_path):
         print(f"File not found: {pdf_path}")
         return
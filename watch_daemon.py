@@ -0,0 +1,342 @@
+"""監視フォルダの在庫・受注ファイルを取り込み続けるデーモン
+
+フォルダをポーリングし（inotify などは使わないので、どの Linux でも動く）、新しいファイルや
+更新されたファイルだけを1回ずつ解析して、メモリ上の引当状態を差分で更新する。
+
+- 在庫ファイル（.csv / .xlsx / .xls）: load_inventory_rows で読み、全ファイルを商品コードごとに合算
+  （load_inventory_files と同じ規則）
+- 受注ファイル（.txt）: load_order_file で読み、ファイルごとの商品別受注合計を足し引きする
+  （更新されたファイルは前回分を差し引いてから加算し、削除されたファイルは差し引く）。
+  先に取り込んだファイルと同じ内容のファイル・同じ明細は、アプリと同じく OrderDeduplicator で除く
+
+書き込み途中のファイルを読まないよう、更新時刻が WATCH_SETTLE_SECONDS 秒以内のファイルは次回に回す。
+解析に失敗したファイルは、次に更新されるまで再試行しない。
+状態が変わるたびに、不足一覧（伝票別）と状態を出力フォルダへ書き出す（一時ファイルから置き換え）。
+アプリは WATCH_REPORT_DIR が設定されていれば、その最新結果を表示する。
+
+    python watch_daemon.py /srv/inbox                        # 出力は /srv/inbox/report
+    python watch_daemon.py /srv/inbox --out /srv/report --interval 5
+    python watch_daemon.py /srv/inbox --once                 # 1回だけ取り込んで終了
+"""
+import argparse
+import json
+import io
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from allocation_state import AllocationState
+from app import build_shortage_table, combine_inventory_rows, load_inventory_rows, load_order_file
+from order_dedup import OrderDeduplicator, file_digest
+from order_frame import compact_order_frame
+
+logger = logging.getLogger(__name__)
+
+INVENTORY = 'inventory'
+ORDERS = 'orders'
+FILE_KINDS = {'.csv': INVENTORY, '.xlsx': INVENTORY, '.xls': INVENTORY, '.txt': ORDERS}
+
+WATCH_INTERVAL_SECONDS = float(os.environ.get('WATCH_INTERVAL_SECONDS', '10'))
+WATCH_SETTLE_SECONDS = float(os.environ.get('WATCH_SETTLE_SECONDS', '2'))
+WATCH_REPORT_DIR = os.environ.get('WATCH_REPORT_DIR')
+
+REPORT_FILE = 'shortages.csv'
+STATUS_FILE = 'status.json'
+
+
+def file_kind(name):
+    """ファイル名から 在庫 / 受注 を判定する（対象外・隠しファイル・Office の一時ファイルは None）"""
+    if name.startswith(('.', '~$')):
+        return None
+    return FILE_KINDS.get(os.path.splitext(name)[1].lower())
+
+
+def scan(directory):
+    """フォルダ直下の対象ファイル -> (更新時刻 ns, サイズ)"""
+    found = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and file_kind(entry.name):
+                stat = entry.stat()
+                found[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    return found
+
+
+class WatchedFile(io.BytesIO):
+    """UploadedFile 互換（ディスク上のファイルの内容を一度に読み込む）
+
+    メモリマップで読むと、解析中にファイルが切り詰められたときに SIGBUS で落ちるので、
+    バイト列に読み込んでからハンドルを閉じる。
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        super().__init__(data)
+        self.name = os.path.basename(path)
+        self.size = len(data)
+
+
+class OrderFile:
+    """取り込んだ受注ファイル（明細・重複除去で残す明細・商品別の合計）"""
+
+    def __init__(self, order_df, digest=None, hashes=None):
+        self.order_df = order_df
+        self.digest = digest
+        # 識別キーのハッシュ（後ろのファイルを照合し直すときに再計算しない）
+        self.hashes = hashes
+        self.kept = np.ones(len(order_df), dtype=bool)
+        self.summary = None
+
+    @property
+    def lines(self):
+        return self.order_df if self.kept.all() else self.order_df[self.kept]
+
+    def summarize(self):
+        """重複を除いた明細の商品別の受注数量・明細数・商品名"""
+        summary = self.lines.groupby('商品コード', observed=True).agg(
+            発注数量=('発注数量', 'sum'), 明細数=('発注数量', 'size'),
+            商品名漢字=('商品名漢字', 'first'), 商品名カナ=('商品名カナ', 'first'))
+        summary.index = summary.index.astype(str)
+        summary['商品名'] = summary['商品名漢字'].astype(object).fillna(summary['商品名カナ'].astype(object)).fillna('')
+        self.summary = summary[['発注数量', '明細数', '商品名']]
+
+
+class WatchState:
+    """ファイルごとの解析結果と、商品ごとの引当状態（ファイル単位で足し引きする）
+
+    引当は AllocationState（totals_only）で持ち、在庫ファイルが変わったら在庫を置き換え、受注ファイルは
+    商品別の合計を足し引きして、その商品だけ再計算する。受注ファイルは取り込んだ順に OrderDeduplicator
+    （ファイル内容のダイジェスト + 明細の識別キー）を通し、先に取り込んだファイルと重複する明細は数えない。
+    新しいファイルはそのファイルだけを照合する。更新・削除されたファイルがあれば、そのファイルと
+    それより後に取り込んだファイルだけを取り消して照合し直す（重複の判定が変わることがあるため）。
+    """
+
+    def __init__(self):
+        self.inventory_rows = {}
+        self.allocation_state = AllocationState.totals_only()
+        # 商品ごとの、重複を除いた受注明細の数（0 の商品は不足一覧に出さない）
+        self.line_counts = np.zeros(0, dtype=np.int64)
+        self.files = {}
+        self.dedup = OrderDeduplicator()
+
+    def set_inventory(self, name, rows):
+        self.inventory_rows[name] = rows
+        self._combine_inventory()
+
+    def set_orders(self, name, order_df, digest=None):
+        """受注ファイルを取り込む（同名のファイルを取り込み済みなら置き換える）"""
+        order_df = compact_order_frame(order_df)
+        later = self._withdraw(name) if name in self.files else []
+        for other, order_file in later:
+            self._put(other, order_file)
+        self._put(name, OrderFile(order_df, digest, self.dedup.hashes(order_df)))
+
+    def remove(self, name):
+        if self.inventory_rows.pop(name, None) is not None:
+            self._combine_inventory()
+        if name in self.files:
+            for other, order_file in self._withdraw(name):
+                self._put(other, order_file)
+
+    def _withdraw(self, name):
+        """name とそれより後に取り込んだファイルを取り消し、後ろのファイルを (名前, OrderFile) で返す"""
+        names = list(self.files)
+        tail = names[names.index(name):]
+        for other in reversed(tail):
+            order_file = self.files[other]
+            self._apply(order_file.summary, -1)
+            self.dedup.discard(order_file.order_df, order_file.kept, other, order_file.digest, order_file.hashes)
+        return [(other, self.files.pop(other)) for other in tail][1:]
+
+    def _put(self, name, order_file):
+        order_file.kept = self.dedup.add_mask(order_file.order_df, name, order_file.digest, order_file.hashes)
+        order_file.summarize()
+        self._apply(order_file.summary, 1)
+        self.files[name] = order_file
+
+    def _apply(self, summary, sign):
+        idx = self.allocation_state.add_orders(summary.index, sign * summary['発注数量'].to_numpy(np.int64),
+                                               names=summary['商品名'].to_numpy(object))
+        grown = len(self.allocation_state) - len(self.line_counts)
+        if grown:
+            self.line_counts = np.concatenate([self.line_counts, np.zeros(grown, dtype=np.int64)])
+        self.line_counts[idx] += sign * summary['明細数'].to_numpy(np.int64)
+
+    def _combine_inventory(self):
+        if self.inventory_rows:
+            self.allocation_state.set_stock(combine_inventory_rows(self.inventory_rows))
+        else:
+            self.allocation_state.set_stock(pd.DataFrame({'商品コード': [], '倉庫在庫数': []}))
+
+    @property
+    def order_lines(self):
+        return sum(int(order_file.kept.sum()) for order_file in self.files.values())
+
+    @property
+    def products(self):
+        return int((self.line_counts > 0).sum())
+
+    def allocation(self):
+        """calculate_allocation と同じ表（受注のある商品、商品コード順）"""
+        idx = np.flatnonzero(self.line_counts > 0)
+        return self.allocation_state.frame(idx).sort_values('商品コード').reset_index(drop=True)
+
+    def shortage_report(self):
+        """不足商品を伝票番号ごとに1行へ展開した一覧（build_shortage_table と同じ列）"""
+        allocation_df = self.allocation()
+        shortage_df = allocation_df[(allocation_df['引当後在庫'] < 0) & (allocation_df['商品コード'] != '19005')]
+        if not self.inventory_rows:
+            # 在庫ファイルが届くまでは判定しない
+            shortage_df = shortage_df.iloc[:0]
+        codes = set(shortage_df['商品コード'])
+        lines = [df[df['商品コード'].astype(str).isin(codes)].astype({'商品コード': str})
+                 for df in (order_file.lines for order_file in self.files.values())]
+        lines = [df for df in lines if len(df)]
+        if not lines:
+            return shortage_df, build_shortage_table(shortage_df, pd.DataFrame(
+                columns=['商品コード', '顧客名', '伝票番号', 'チェーン店固有エリア']))
+        return shortage_df, build_shortage_table(shortage_df, pd.concat(lines, ignore_index=True))
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class WatchDaemon:
+    """フォルダをポーリングして WatchState を更新し、変化があれば結果を書き出す"""
+
+    def __init__(self, directory, out_dir=None, settle_seconds=WATCH_SETTLE_SECONDS, clock=time.time):
+        self.directory = directory
+        self.out_dir = out_dir or os.path.join(directory, 'report')
+        self.settle_seconds = settle_seconds
+        self.clock = clock
+        self.state = WatchState()
+        self.signatures = {}
+        self.errors = {}
+
+    def poll(self):
+        """1回分の取り込み。状態が変わった場合は True"""
+        # 出力フォルダが監視フォルダと同じでも、自分の書き出した不足一覧は取り込まない
+        outputs = {os.path.abspath(os.path.join(self.out_dir, name)) for name in (REPORT_FILE, STATUS_FILE)}
+        current = {path: signature for path, signature in scan(self.directory).items()
+                   if os.path.abspath(path) not in outputs}
+        now = self.clock()
+        changed = False
+        for path in sorted(set(self.signatures) - set(current)):
+            name = os.path.basename(path)
+            self.state.remove(name)
+            self.errors.pop(name, None)
+            del self.signatures[path]
+            logger.info("removed %s", name)
+            changed = True
+        for path, signature in sorted(current.items()):
+            if self.signatures.get(path) == signature:
+                continue
+            # 書き込み途中かもしれないファイルは次回に回す
+            if now - signature[0] / 1e9 < self.settle_seconds:
+                continue
+            self.signatures[path] = signature
+            self._load(path)
+            changed = True
+        if changed:
+            self.publish()
+        return changed
+
+    def _load(self, path):
+        name = os.path.basename(path)
+        t0 = time.perf_counter()
+        try:
+            if file_kind(name) == INVENTORY:
+                self.state.set_inventory(name, load_inventory_rows(WatchedFile(path)))
+            else:
+                file = WatchedFile(path)
+                self.state.set_orders(name, load_order_file(file), file_digest(file))
+            self.errors.pop(name, None)
+            logger.info("loaded %s (%.2fs)", name, time.perf_counter() - t0)
+        except Exception as e:
+            # 前回取り込んだ内容も使わない（次に更新されたら再試行する）
+            self.state.remove(name)
+            self.errors[name] = str(e)
+            logger.warning("failed to load %s: %s", name, e)
+
+    def status(self, shortage_df, table):
+        return {
+            'updated_at': datetime.now().isoformat(timespec='seconds'),
+            'directory': os.path.abspath(self.directory),
+            'inventory_files': sorted(self.state.inventory_rows),
+            'order_files': sorted(self.state.files),
+            'order_lines': self.state.order_lines,
+            'duplicate_lines': self.state.dedup.duplicates,
+            'products': self.state.products,
+            'shortages': len(shortage_df),
+            'shortage_lines': len(table),
+            'errors': dict(sorted(self.errors.items())),
+        }
+
+    def publish(self):
+        """不足一覧（CSV）と状態（JSON）を出力フォルダへ書き出す"""
+        shortage_df, table = self.state.shortage_report()
+        status = self.status(shortage_df, table)
+        os.makedirs(self.out_dir, exist_ok=True)
+        _write_atomic(os.path.join(self.out_dir, REPORT_FILE), table.to_csv(index=False).encode('utf-8-sig'))
+        _write_atomic(os.path.join(self.out_dir, STATUS_FILE), json.dumps(status, ensure_ascii=False, indent=2).encode('utf-8'))
+        logger.info("published %d shortages (%d lines)", status['shortages'], status['shortage_lines'])
+        return status
+
+    def run(self, interval=WATCH_INTERVAL_SECONDS, stop=None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                self.poll()
+            except OSError as e:
+                logger.warning("poll failed: %s", e)
+            stop.wait(interval)
+
+
+def read_report(out_dir):
+    """デーモンが書き出した (状態, 不足一覧) を読む（まだなければ (None, None)）"""
+    try:
+        with open(os.path.join(out_dir, STATUS_FILE), encoding='utf-8') as f:
+            status = json.load(f)
+        table = pd.read_csv(os.path.join(out_dir, REPORT_FILE), dtype={'商品コード': str, '伝票番号': str},
+                            encoding='utf-8-sig', keep_default_na=False)
+    except (OSError, ValueError):
+        return None, None
+    return status, table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Watch a folder for inventory and order files')
+    parser.add_argument('directory')
+    parser.add_argument('--out', default=WATCH_REPORT_DIR, help='出力フォルダ（既定は <directory>/report）')
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL_SECONDS, help='ポーリング間隔（秒）')
+    parser.add_argument('--settle', type=float, default=WATCH_SETTLE_SECONDS, help='更新後に待つ秒数')
+    parser.add_argument('--once', action='store_true', help='1回だけ取り込んで終了')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    daemon = WatchDaemon(args.directory, out_dir=args.out, settle_seconds=0 if args.once else args.settle)
+    if args.once:
+        if not daemon.poll():
+            daemon.publish()
+        return 1 if daemon.errors else 0
+    logger.info("watching %s every %.1fs -> %s", args.directory, args.interval, daemon.out_dir)
+    try:
+        daemon.run(args.interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())